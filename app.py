@@ -1,16 +1,25 @@
-from flask import Flask, render_template, request, jsonify, g
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context
 from flask_socketio import SocketIO, join_room, leave_room, emit
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
-from sqlalchemy import func, BigInteger, Integer
+from sqlalchemy import select, bindparam, func, case, and_, or_, exists, text, type_coerce, cast, null, event, BigInteger, Integer, String
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import aliased
 import os
 import random
-from collections import defaultdict
-from functools import wraps
+import sqlite3
+from collections import defaultdict, namedtuple, OrderedDict
+from bisect import bisect_left, insort
+from functools import lru_cache, wraps
+import click
 import jwt, datetime
+import atexit
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 from google.oauth2 import id_token as google_id_token
 from google.auth.transport import requests as google_requests
 from dotenv import load_dotenv
+import hashlib
+import threading
 import time
 
 # Load environment variables from a .env file, if present
@@ -78,6 +87,7 @@ def inject_globals():
     return {
         'GOOGLE_CLIENT_ID': app.config.get('GOOGLE_CLIENT_ID'),
         'now': datetime.datetime.now(datetime.timezone.utc),
+        'RESULT_INGEST_QUEUED': RESULT_INGEST_MODE == 'queue',
     }
 
 # ======================
@@ -95,11 +105,20 @@ class User(db.Model):
     # Falls back to live recompute via compute_xp_and_level() if NULL (e.g., legacy rows
     # before the column was added). Backfill happens on first read.
     total_xp = db.Column(db.Integer)
+    # Day streak, advanced by record_result in the user's class-local calendar.
+    # activity_bitmap holds one bit per day for the ACTIVITY_CALENDAR_DAYS ending at
+    # last_active_date (bit 0 = that day); see mark_user_active().
+    current_streak = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    best_streak = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    last_active_date = db.Column(db.Date)
+    last_active_games = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    activity_bitmap = db.Column(db.LargeBinary)
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
     deleted_at = db.Column(db.DateTime(timezone=True))
 
     __table_args__ = (
         db.CheckConstraint("role IN ('student','teacher','admin')", name='ck_users_role'),
+        db.Index('ix_users_total_xp', 'total_xp'),  # leaderboard ordering and rank counts
     )
 
 
@@ -109,6 +128,7 @@ class Class(db.Model):
     teacher_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
     name = db.Column(db.Text, nullable=False)
     join_code = db.Column(db.Text, unique=True, nullable=False)
+    timezone = db.Column(db.Text)  # IANA name (e.g. 'America/Chicago'); NULL = UTC
     created_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
 
 
@@ -125,6 +145,7 @@ class ClassMembership(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('class_id', 'user_id', name='uq_class_user'),
+        db.Index('ix_class_memberships_user', 'user_id'),  # a user's classes (timezone lookup)
     )
 
 
@@ -278,9 +299,17 @@ class GameResult(db.Model):
     activity_id = db.Column(db.BigInteger, db.ForeignKey('activities.id'))
     details_json = db.Column(db.JSON)
     played_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+    ingest_key = db.Column(db.Text)  # ResultQueue entry key; NULL for results written in the request
 
+    # Hot query shapes (see migration 3f1d2c9a7b10): per-user recent/day-range
+    # scans on played_at, and per-user outcome filters for achievements.
+    # uq_results_ingest_key makes queued replays idempotent; it includes the
+    # partition key because Postgres requires that of unique indexes.
     __table_args__ = (
         db.Index('ix_results_user_mode', 'user_id', 'mode'),
+        db.Index('ix_results_user_played', user_id, played_at.desc()),
+        db.Index('ix_results_user_outcome', 'user_id', 'outcome'),
+        db.Index('uq_results_ingest_key', 'ingest_key', 'played_at', unique=True),
     )
 
 
@@ -297,7 +326,7 @@ class Achievement(db.Model):
 
 class UserAchievement(db.Model):
     __tablename__ = 'user_achievements'
-    id = db.Column(db.BigInteger, primary_key=True, autoincrement=True)
+    id = db.Column(BigInt, primary_key=True, autoincrement=True)
     user_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
     achievement_id = db.Column(db.BigInteger, db.ForeignKey('achievements.id'), nullable=False)
     unlocked_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
@@ -338,61 +367,171 @@ class UserItem(db.Model):
     )
 
 
-# Ensure tables exist in dev if migrations haven't been run (after models are defined)
-try:
-    with app.app_context():
-        db.create_all()
+class UserStat(db.Model):
+    """Per-user rollup of game_results keyed by (canonical mode, challenge_type).
+    Maintained incrementally by record_result (see apply_stat_delta) and
+    rebuilt from history by `flask backfill-user-stats`, so hot paths can read
+    totals without rescanning a student's whole result history."""
+    __tablename__ = 'user_stats'
+    id = db.Column(BigInt, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
+    mode = db.Column(db.Text, nullable=False)            # canonicalize_mode(result.mode)
+    challenge_type = db.Column(db.Text, nullable=False)  # see classify_result()
+    total = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    correct = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    incorrect = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    successes = db.Column(db.Integer, nullable=False, server_default=db.text('0'))  # outcome in SUCCESS_OUTCOMES
+    completed = db.Column(db.Integer, nullable=False, server_default=db.text('0'))  # success or neutral (NULL) outcome
+    scored = db.Column(db.Integer, nullable=False, server_default=db.text('0'))     # results with a score
+    score_sum = db.Column(db.Numeric(14, 2), nullable=False, server_default=db.text('0'))
+    score_max = db.Column(db.Numeric(10, 2))
+    success_run = db.Column(db.Integer, nullable=False, server_default=db.text('0'))  # current run of successes
+    last_played_on = db.Column(db.Date)
+    updated_at = db.Column(db.DateTime(timezone=True), server_default=func.now(), nullable=False)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'mode', 'challenge_type', name='uq_user_stats_key'),
+    )
+
+
+class DailyActivity(db.Model):
+    """Per-user per-day counters, written by record_result. Days are the user's
+    class-local days (UTC without a class timezone), the same calendar as the
+    streak and daily goal. Windowed leaderboards sum at most 7 of these rows per
+    user instead of scanning game_results, and the dashboard reads today's quest
+    progress from one row."""
+    __tablename__ = 'daily_activity'
+    id = db.Column(BigInt, primary_key=True, autoincrement=True)
+    user_id = db.Column(db.BigInteger, db.ForeignKey('users.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    xp = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    games = db.Column(db.Integer, nullable=False, server_default=db.text('0'))
+    # Daily quest counters: {'games': {mode: n}, 'wins': {mode: n}} by canonical mode.
+    # NULL on rows written before the column existed; see daily_quest_counters().
+    quest_json = db.Column(db.JSON)
+
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'day', name='uq_daily_activity_user_day'),
+        db.Index('ix_daily_activity_day', 'day'),
+    )
+
+
+# ---- Bootstrap ----
+# The schema comes from migrations (`flask db upgrade`). Catalog seeding runs once
+# per deploy (`flask bootstrap`, right after the upgrade in render.yaml) and when
+# the dev server starts, never at import or on request paths: workers come up
+# without a database round-trip and the first request pays no seeding cost.
+
+def ensure_dev_schema():
+    """Safety net for `python app.py` on a dev database that was never
+    migrated: create missing tables and add missing columns. Deploys use
+    `flask db upgrade` instead."""
+    db.create_all()
+    with db.engine.connect() as conn:
         # SQLite fix: if game_results.id isn't INTEGER PRIMARY KEY, drop and recreate table (no data expected yet)
-        if app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
-            from sqlalchemy import text
-            with db.engine.connect() as conn:
-                res = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='game_results'"))
-                row = res.fetchone()
-                if row and row[0] and ('"id" INTEGER' not in row[0] and ' id INTEGER' not in row[0]):
-                    # table exists with wrong id type; drop and recreate
-                    conn.execute(text('DROP TABLE IF EXISTS game_results'))
-                    db.metadata.tables['game_results'].create(bind=conn)
-except Exception:
-    pass
-
-# Ensure display_name column exists on users table (dev/SQLite auto-migration)
-try:
-    with app.app_context():
-        from sqlalchemy import text as _text
-        with db.engine.connect() as conn:
-            try:
-                conn.execute(_text("SELECT display_name FROM users LIMIT 1"))
-            except Exception:
-                conn.execute(_text("ALTER TABLE users ADD COLUMN display_name TEXT"))
+        if db.engine.dialect.name == 'sqlite':
+            row = conn.execute(text("SELECT sql FROM sqlite_master WHERE type='table' AND name='game_results'")).fetchone()
+            if row and row[0] and ('"id" INTEGER' not in row[0] and ' id INTEGER' not in row[0]):
+                # table exists with wrong id type; drop and recreate
+                conn.execute(text('DROP TABLE IF EXISTS game_results'))
+                db.metadata.tables['game_results'].create(bind=conn)
                 conn.commit()
-except Exception:
-    pass
-
-# Ensure coins column exists on users table (dev/SQLite auto-migration)
-try:
-    with app.app_context():
-        from sqlalchemy import text as _text2
-        with db.engine.connect() as conn:
+        for table, column, ddl in (
+            ('users', 'display_name', 'TEXT'),
+            ('users', 'coins', 'INTEGER NOT NULL DEFAULT 0'),
+            ('users', 'total_xp', 'INTEGER'),
+            ('users', 'current_streak', 'INTEGER NOT NULL DEFAULT 0'),
+            ('users', 'best_streak', 'INTEGER NOT NULL DEFAULT 0'),
+            ('users', 'last_active_date', 'DATE'),
+            ('users', 'last_active_games', 'INTEGER NOT NULL DEFAULT 0'),
+            ('users', 'activity_bitmap', 'BYTEA' if db.engine.dialect.name == 'postgresql' else 'BLOB'),
+            ('classes', 'timezone', 'TEXT'),
+            ('daily_activity', 'quest_json', 'JSON'),
+            ('game_results', 'ingest_key', 'TEXT'),
+        ):
             try:
-                conn.execute(_text2("SELECT coins FROM users LIMIT 1"))
+                conn.execute(text(f"SELECT {column} FROM {table} LIMIT 1"))
             except Exception:
-                conn.execute(_text2("ALTER TABLE users ADD COLUMN coins INTEGER NOT NULL DEFAULT 0"))
+                conn.rollback()
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
                 conn.commit()
-except Exception:
-    pass
+        conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS uq_results_ingest_key "
+                          "ON game_results (ingest_key, played_at)"))
+        conn.commit()
+
+
+def bootstrap_database():
+    """Seed the skill, achievement and shop catalogs. Idempotent; expects the
+    schema to be migrated already."""
+    ensure_standards_seed()
+    ensure_achievements_seed()
+    ensure_shop_seed()
+    reference_data.invalidate()
+
+
+@app.cli.command('bootstrap')
+def bootstrap_command():
+    """Seed the skill, achievement and shop catalogs (run once per deploy, after `flask db upgrade`)."""
+    t0 = time.perf_counter()
+    bootstrap_database()
+    ref = reference_data.get()
+    click.echo(f'bootstrap: {len(ref.skills)} skills, {len(ref.achievements)} achievements, '
+               f'{len(ref.shop_items)} shop items ({time.perf_counter() - t0:.2f}s)')
+    # A deploy must not go live with a catalog missing: results would earn no
+    # mastery, achievements or shop items without any error
+    empty = [name for name, rows in (('skills', ref.skills), ('achievements', ref.achievements),
+                                     ('shop items', ref.shop_items)) if not rows]
+    if len(ref.skills) < len(STANDARDS_CATALOG):
+        empty.append(f'skills ({len(ref.skills)} of {len(STANDARDS_CATALOG)} standards)')
+    if empty:
+        raise click.ClickException(f'bootstrap left catalogs incomplete: {", ".join(dict.fromkeys(empty))}')
+
+
+_STARTUP_PROBE = """
+import json, os, sys, time
+t0 = time.perf_counter()
+import app as app_module
+t1 = time.perf_counter()
+client = app_module.app.test_client()
+out = {'import': t1 - t0}
+uid = int(os.environ['STARTUP_PROBE_UID'])
+headers = {'Authorization': 'Bearer ' + app_module.issue_token(uid, 'student')}
+for path in ('/api/shop', '/api/dashboard'):
+    start = time.perf_counter()
+    status = client.get(path, headers=headers).status_code
+    out[path] = time.perf_counter() - start
+    out[path + ' status'] = status
+print(json.dumps(out))
+"""
+
+
+@app.cli.command('bench-startup')
+@click.option('--runs', default=7, show_default=True, help='Fresh processes to start.')
+def bench_startup_command(runs):
+    """Time cold starts against the configured database: each run imports
+    app.py in a fresh process, then times its first /api/shop and first
+    /api/dashboard request (reference-data load and first queries included).
+    Reports medians; the import time is mostly Python module imports."""
+    import json
+    import statistics
+    import subprocess
+    import sys
+    uid = db.session.query(func.min(User.id)).scalar()
+    if uid is None:
+        raise click.ClickException('bench-startup needs at least one user; sign in once or seed a user first')
+    env = dict(os.environ, STARTUP_PROBE_UID=str(int(uid)))
+    samples = []
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-c', _STARTUP_PROBE], cwd=app.root_path, env=env,
+                              capture_output=True, text=True, check=True)
+        samples.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    click.echo(f'startup: median of {runs} fresh processes, user {uid}')
+    click.echo(f'  import app.py:          {statistics.median(s["import"] for s in samples) * 1000:8.1f} ms')
+    for path in ('/api/shop', '/api/dashboard'):
+        statuses = sorted({s[path + " status"] for s in samples})
+        click.echo(f'  first GET {path:<14} {statistics.median(s[path] for s in samples) * 1000:8.1f} ms'
+                   f'  (status {", ".join(map(str, statuses))})')
 
-# Ensure total_xp column exists on users table (dev/SQLite auto-migration)
-try:
-    with app.app_context():
-        from sqlalchemy import text as _text3
-        with db.engine.connect() as conn:
-            try:
-                conn.execute(_text3("SELECT total_xp FROM users LIMIT 1"))
-            except Exception:
-                conn.execute(_text3("ALTER TABLE users ADD COLUMN total_xp INTEGER"))
-                conn.commit()
-except Exception:
-    pass
 
 # In-memory state storage per room and mode.
 # rooms_state[room]['plane'] or ['line'] -> last known state (dict)
@@ -483,24 +622,368 @@ def api_new_session():
 
 
 # Authentication utilities and endpoints
+#
+# Every authenticated request (and the optional-auth leaderboard, and every
+# Socket.IO connect) used to run a full HS256 jwt.decode. Polling clients send
+# the same token over and over, so the verified claims are kept in a bounded
+# LRU keyed by the token's SHA-256 digest; an entry lives no longer than the
+# token's own `exp`, and a token that fails verification is never cached.
+
+AUTH_TOKEN_TTL_HOURS = 12
+AUTH_CLAIMS_CACHE_SIZE = int(os.environ.get('AUTH_CLAIMS_CACHE_SIZE', '4096'))
+
+AuthUser = namedtuple('AuthUser', 'user_id role')
+
+
+def issue_token(user_id, role):
+    """Sign the app's own session token for a logged-in user."""
+    payload = {
+        'uid': int(user_id),
+        'role': role,
+        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=AUTH_TOKEN_TTL_HOURS)
+    }
+    return jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+
+
+class AuthTokenCache:
+    """Bounded LRU of verified session tokens -> AuthUser. verify() raises
+    jwt.InvalidTokenError for a bad or expired token, exactly like jwt.decode."""
+
+    def __init__(self, maxsize=AUTH_CLAIMS_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()   # sha256(token) -> (exp_ts, AuthUser)
+        self.metrics = {
+            'requests': 0,
+            'hits': 0,
+            'decodes': 0,
+            'rejected': 0,
+            'expired': 0,
+            'evictions': 0,
+        }
+
+    def verify(self, token):
+        self.metrics['requests'] += 1
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.time():
+                self._entries.move_to_end(key)
+                self.metrics['hits'] += 1
+                return entry[1]
+            del self._entries[key]
+            self.metrics['expired'] += 1
+        self.metrics['decodes'] += 1
+        try:
+            claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            self.metrics['rejected'] += 1
+            raise
+        user = AuthUser(claims.get('uid'), claims.get('role'))
+        exp = claims.get('exp')
+        if exp is not None:
+            # tokens without exp are still accepted but never cached
+            self._entries[key] = (float(exp), user)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.metrics['evictions'] += 1
+        return user
+
+    def clear(self):
+        self._entries.clear()
+
+    def snapshot_metrics(self):
+        m = dict(self.metrics)
+        m['size'] = len(self._entries)
+        m['hit_ratio'] = round(m['hits'] / m['requests'], 3) if m['requests'] else None
+        return m
+
+
+auth_tokens = AuthTokenCache()
+
+
+def bearer_token():
+    """The token from an `Authorization: Bearer ...` header, or None."""
+    auth = request.headers.get('Authorization', '')
+    if not auth.startswith('Bearer '):
+        return None
+    return auth.split(' ', 1)[1]
+
+
+def optional_auth_user():
+    """AuthUser for the request's bearer token; None when absent or invalid."""
+    token = bearer_token()
+    if not token:
+        return None
+    try:
+        return auth_tokens.verify(token)
+    except jwt.InvalidTokenError:
+        return None
+
+
+def socket_user():
+    """AuthUser of the current Socket.IO connection (set at connect), or None."""
+    return request.environ.get('auth_user')
+
 
 def require_auth(f):
     @wraps(f)
     def wrapper(*args, **kwargs):
-        auth = request.headers.get('Authorization', '')
-        if not auth.startswith('Bearer '):
+        token = bearer_token()
+        if not token:
             return jsonify({'error': 'auth_required'}), 401
-        token = auth.split(' ', 1)[1]
         try:
-            claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-        except Exception:
+            user = auth_tokens.verify(token)
+        except jwt.InvalidTokenError:
             return jsonify({'error': 'invalid_token'}), 401
-        g.user_id = claims.get('uid')
-        g.role = claims.get('role')
+        g.user_id = user.user_id
+        g.role = user.role
         return f(*args, **kwargs)
     return wrapper
 
 
+@app.cli.command('bench-auth')
+@click.option('--number', default=20000, show_default=True, help='Authenticated calls per timing run.')
+@click.option('--repeat', default=5, show_default=True, help='Timing runs; the best is reported.')
+@click.option('--tokens', default=200, show_default=True, help='Distinct tokens cycled through (active users).')
+def bench_auth_command(number, repeat, tokens):
+    """Time the per-request auth overhead: a bare jwt.decode versus the claims
+    cache, and the whole require_auth wrapper around a no-op view."""
+    import itertools
+    import timeit
+    pool = [issue_token(i + 1, 'student') for i in range(tokens)]
+    for token in pool:
+        auth_tokens.verify(token)
+    nxt = itertools.cycle(pool).__next__
+    secret = app.config['SECRET_KEY']
+    view = require_auth(lambda: None)
+
+    def wrapped():
+        with app.test_request_context(headers={'Authorization': f'Bearer {nxt()}'}):
+            view()
+
+    def baseline():
+        with app.test_request_context(headers={'Authorization': f'Bearer {nxt()}'}):
+            pass
+
+    for name, fn, subtract in (
+            ('jwt.decode (uncached)', lambda: jwt.decode(nxt(), secret, algorithms=['HS256']), None),
+            ('auth_tokens.verify (warm)', lambda: auth_tokens.verify(nxt()), None),
+            ('require_auth (warm cache)', wrapped, baseline)):
+        best = min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+        if subtract is not None:
+            # exclude the cost of building the test request context itself
+            best -= min(timeit.repeat(subtract, number=number, repeat=repeat)) / number
+        click.echo(f'bench: {name:<30} {best * 1e6:8.2f} us/request')
+    click.echo(f"bench: cache {auth_tokens.snapshot_metrics()}")
+
+# ---- Google ID token verification ----
+#
+# google.oauth2.id_token.verify_oauth2_token() downloads Google's signing certs
+# on every call through whatever transport it is handed. A class logging in at
+# once turns that into one HTTPS round trip per student on the single eventlet
+# worker. The certs rotate slowly and Google publishes how long they may be
+# cached (Cache-Control max-age), so keep them in the process, fetch them over
+# one pooled session, and let exactly one caller refresh when they go stale.
+
+GOOGLE_CERTS_URL = os.environ.get('GOOGLE_CERTS_URL', 'https://www.googleapis.com/oauth2/v1/certs')
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+GOOGLE_CERTS_DEFAULT_TTL_SEC = float(os.environ.get('GOOGLE_CERTS_DEFAULT_TTL_SEC', '300'))
+GOOGLE_CERTS_MIN_REFRESH_SEC = float(os.environ.get('GOOGLE_CERTS_MIN_REFRESH_SEC', '30'))
+GOOGLE_CERTS_TIMEOUT_SEC = float(os.environ.get('GOOGLE_CERTS_TIMEOUT_SEC', '5'))
+GOOGLE_TOKEN_CLOCK_SKEW_SEC = int(os.environ.get('GOOGLE_TOKEN_CLOCK_SKEW_SEC', '10'))
+
+
+def cache_control_ttl(headers, default=GOOGLE_CERTS_DEFAULT_TTL_SEC):
+    """Seconds a response may be reused: Cache-Control max-age minus Age, or
+    `default` when the server didn't say."""
+    max_age = None
+    for directive in (headers.get('Cache-Control') or '').split(','):
+        name, _, value = directive.strip().partition('=')
+        name = name.lower()
+        if name in ('no-cache', 'no-store'):
+            return 0.0
+        if name == 'max-age':
+            try:
+                max_age = int(value.strip('"'))
+            except ValueError:
+                pass
+    if max_age is None:
+        return default
+    try:
+        age = int(headers.get('Age') or 0)
+    except ValueError:
+        age = 0
+    return float(max(0, max_age - age))
+
+
+class HttpCertSource:
+    """Fetches a {kid: PEM certificate} document over a pooled requests.Session.
+    Any object with a fetch() -> (certs, ttl_seconds) method can stand in for it
+    (e.g. a local key server in tests or `flask bench-login-storm`)."""
+
+    def __init__(self, url=GOOGLE_CERTS_URL, timeout=GOOGLE_CERTS_TIMEOUT_SEC):
+        import requests
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def fetch(self):
+        resp = self.session.get(self.url, timeout=self.timeout)
+        resp.raise_for_status()
+        certs = resp.json()
+        if not isinstance(certs, dict) or not certs:
+            raise ValueError(f'no certificates at {self.url}')
+        return certs, cache_control_ttl(resp.headers)
+
+
+class GoogleCertCache:
+    """Process-wide cache of the signing certs from `source`. Refreshes when the
+    max-age runs out or a token names a kid we haven't seen (Google rotated),
+    the latter at most once per GOOGLE_CERTS_MIN_REFRESH_SEC. Only one caller
+    fetches at a time; the rest wait on the lock and reuse its result. If a
+    refresh fails the stale certs keep serving rather than locking everyone out."""
+
+    def __init__(self, source=None, min_refresh_sec=GOOGLE_CERTS_MIN_REFRESH_SEC):
+        self._source = source
+        self.min_refresh_sec = min_refresh_sec
+        self._certs = None
+        self._expires_at = 0.0
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self.metrics = {
+            'reads': 0,
+            'fetches': 0,
+            'fetch_errors': 0,
+            'stale_served': 0,
+            'unknown_kid_refreshes': 0,
+            'last_fetch_ms': None,
+            'last_ttl_sec': None,
+        }
+
+    @property
+    def source(self):
+        if self._source is None:
+            self._source = HttpCertSource()
+        return self._source
+
+    def get(self, kid=None):
+        """The current {kid: PEM} mapping, refreshed first if it has expired or
+        doesn't contain `kid`."""
+        self.metrics['reads'] += 1
+        certs = self._certs
+        if certs is not None and time.monotonic() < self._expires_at and (kid is None or kid in certs):
+            return certs
+        with self._lock:
+            certs = self._certs
+            now = time.monotonic()
+            if certs is not None and now < self._expires_at:
+                if kid is None or kid in certs:
+                    return certs  # another caller refreshed while we waited
+                if now - self._fetched_at < self.min_refresh_sec:
+                    return certs  # unknown kid, but we only just fetched
+                self.metrics['unknown_kid_refreshes'] += 1
+            return self._refresh(certs)
+
+    def _refresh(self, stale):
+        t0 = time.perf_counter()
+        try:
+            certs, ttl = self.source.fetch()
+        except Exception as e:
+            self.metrics['fetch_errors'] += 1
+            if stale is None:
+                raise
+            print(f'[WARN] Google cert refresh failed ({e}); serving cached certs')
+            self.metrics['stale_served'] += 1
+            # back off so a dead endpoint isn't hit by every login
+            self._expires_at = time.monotonic() + self.min_refresh_sec
+            return stale
+        self._certs = certs
+        self._fetched_at = time.monotonic()
+        self._expires_at = self._fetched_at + ttl
+        self.metrics['fetches'] += 1
+        self.metrics['last_fetch_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+        self.metrics['last_ttl_sec'] = ttl
+        return certs
+
+    def invalidate(self):
+        self._expires_at = 0.0
+
+    def snapshot_metrics(self):
+        m = dict(self.metrics)
+        certs = self._certs
+        m['kids'] = sorted(certs) if certs else []
+        m['expires_in_sec'] = round(max(0.0, self._expires_at - time.monotonic()), 1) if certs else None
+        return m
+
+
+google_certs = GoogleCertCache()
+
+
+def verify_google_id_token(token, audience=None, cache=None):
+    """Verify a Google ID token's signature, expiry, audience and issuer against
+    cached signing certs; return its claims. Raises ValueError when invalid."""
+    from google.auth import jwt as google_jwt
+    cache = google_certs if cache is None else cache
+    try:
+        kid = jwt.get_unverified_header(token).get('kid')
+    except jwt.PyJWTError as e:
+        raise ValueError(f'malformed token: {e}')
+    claims = google_jwt.decode(
+        token, certs=cache.get(kid), audience=audience or GOOGLE_CLIENT_ID,
+        clock_skew_in_seconds=GOOGLE_TOKEN_CLOCK_SKEW_SEC)
+    if claims.get('iss') not in GOOGLE_ISSUERS:
+        raise ValueError(f"wrong issuer: {claims.get('iss')}")
+    return claims
+
+
+@app.cli.command('bench-login-storm')
+@click.option('--logins', default=300, show_default=True, help='ID tokens to verify.')
+@click.option('--concurrency', default=30, show_default=True, help='Logins in flight at once.')
+@click.option('--fetch-delay-ms', default=50, show_default=True, help='Latency the stand-in key server adds per cert fetch.')
+def bench_login_storm_command(logins, concurrency, fetch_delay_ms):
+    """Verify a burst of ID tokens against a local stand-in key server, once the
+    old way (fresh transport, certs fetched per login) and once through the cache.
+    Run from a checkout: the key server lives with the tests."""
+    from concurrent.futures import ThreadPoolExecutor
+    try:
+        from tests.google_keys import StandInKeyServer
+    except ImportError:
+        raise click.ClickException('bench-login-storm needs tests/google_keys.py (run it from a checkout)')
+    audience = 'bench-client'
+    keys = StandInKeyServer(delay_sec=fetch_delay_ms / 1000.0)
+    try:
+        tokens = [keys.sign(audience, 1000 + i) for i in range(logins)]
+
+        def uncached(token):
+            return google_id_token.verify_token(
+                token, google_requests.Request(), audience, certs_url=keys.url)
+
+        cache = GoogleCertCache(HttpCertSource(keys.url))
+
+        def cached(token):
+            return verify_google_id_token(token, audience, cache=cache)
+
+        for label, verify in (('uncached', uncached), ('cached', cached)):
+            keys.fetches = 0
+
+            def timed(token):
+                t0 = time.perf_counter()
+                verify(token)
+                return time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                latencies = sorted(pool.map(timed, tokens))
+            wall = time.perf_counter() - t0
+            p50 = latencies[len(latencies) // 2] * 1000
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000
+            click.echo(f'bench: {label:<8} {logins} logins in {wall:6.2f}s '
+                       f'({logins / wall:7.1f}/s)  p50 {p50:7.2f}ms  p95 {p95:7.2f}ms  '
+                       f'cert fetches {keys.fetches}')
+    finally:
+        keys.close()
+
+
 @app.post('/auth/google')
 def google_auth():
     data = request.get_json(silent=True) or {}
@@ -509,9 +992,7 @@ def google_auth():
         return jsonify({'error': 'missing id_token'}), 400
 
     try:
-        idinfo = google_id_token.verify_oauth2_token(
-            id_token_str, google_requests.Request(), GOOGLE_CLIENT_ID
-        )
+        idinfo = verify_google_id_token(id_token_str)
         sub = idinfo['sub']
     except Exception:
         return jsonify({'error': 'invalid_google_token'}), 401
@@ -550,15 +1031,11 @@ def google_auth():
         user.display_name = given_name
         try:
             db.session.commit()
+            leaderboard_index.invalidate(int(user.id))
         except Exception:
             db.session.rollback()
 
-    payload = {
-        'uid': int(user.id),
-        'role': user.role,
-        'exp': datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=12)
-    }
-    token = jwt.encode(payload, app.config['SECRET_KEY'], algorithm='HS256')
+    token = issue_token(user.id, user.role)
 
     user_obj = {'id': int(user.id), 'role': user.role}
     if given_name:
@@ -569,26 +1046,202 @@ def google_auth():
     return jsonify({'token': token, 'user': user_obj})
 
 
+# Telemetry events (every vertex placement, every shot) are buffered in process
+# and bulk-inserted by a background greenlet, so a click costs a list append
+# instead of a commit. Buffered rows are lost if the process dies; /events/batch
+# answers 503 once EVENT_BUFFER_MAX rows are waiting (backpressure).
+EVENT_BATCH_MAX = int(os.environ.get('EVENT_BATCH_MAX', '500'))      # events per /events/batch request
+EVENT_FLUSH_SIZE = int(os.environ.get('EVENT_FLUSH_SIZE', '1000'))   # rows per bulk insert
+EVENT_FLUSH_SEC = float(os.environ.get('EVENT_FLUSH_SEC', '1.0'))    # longest an event waits in the buffer
+EVENT_BUFFER_MAX = int(os.environ.get('EVENT_BUFFER_MAX', '50000'))
+EVENT_PAYLOAD_MAX_BYTES = int(os.environ.get('EVENT_PAYLOAD_MAX_BYTES', '4096'))  # serialized payload_json
+EVENT_FLUSH_POLL_SEC = 0.05
+
+_EVENT_INT_FIELDS = ('session_id', 'activity_id', 'skill_id', 'duration_ms')
+
+
+def event_row(user_id, body, now):
+    """Normalize one client event into (events row, None), or (None, error
+    code) when it has no event_type or its payload_json serializes to more
+    than EVENT_PAYLOAD_MAX_BYTES. A payload is rejected rather than cut, since
+    truncated JSON is no longer JSON."""
+    import json
+    event_type = body.get('event_type')
+    if not isinstance(event_type, str) or not event_type.strip():
+        return None, 'missing_event_type'
+    payload = body.get('payload_json')
+    if payload is not None and len(json.dumps(payload, separators=(',', ':')).encode()) > EVENT_PAYLOAD_MAX_BYTES:
+        return None, 'payload_too_large'
+    row = {
+        'user_id': user_id,
+        'event_type': event_type.strip()[:64],
+        'room_pin': str(body['room_pin'])[:32] if body.get('room_pin') is not None else None,
+        'role': str(body['role'])[:32] if body.get('role') is not None else None,
+        'timestamp': now,
+        'payload_json': payload,
+    }
+    for field in _EVENT_INT_FIELDS:
+        try:
+            row[field] = int(body[field]) if body.get(field) is not None else None
+        except (TypeError, ValueError):
+            row[field] = None
+    return row, None
+
+
+class EventBuffer:
+    """Pending event rows, flushed as multi-row inserts once EVENT_FLUSH_SIZE
+    rows are waiting or the oldest has waited EVENT_FLUSH_SEC. flush() swaps
+    the list out before touching the database, so requests keep appending to a
+    fresh one while a flush is in flight."""
+
+    def __init__(self, max_rows=EVENT_BUFFER_MAX):
+        self.max_rows = max_rows
+        self._rows = []
+        self._oldest = None
+        self.metrics = {
+            'accepted': 0,
+            'rejected_full': 0,     # refused with 503 because the buffer was full
+            'flushed': 0,
+            'flushes': 0,
+            'dropped': 0,           # rows the database refused (e.g. bad foreign key)
+            'flush_errors': 0,
+            'max_depth': 0,
+            'last_flush_rows': 0,
+            'last_flush_ms': None,
+        }
+
+    def __len__(self):
+        return len(self._rows)
+
+    def offer(self, rows):
+        """Buffer rows; False (nothing buffered) when they don't fit."""
+        if len(self._rows) + len(rows) > self.max_rows:
+            self.metrics['rejected_full'] += len(rows)
+            return False
+        if not self._rows:
+            self._oldest = time.monotonic()
+        self._rows.extend(rows)
+        self.metrics['accepted'] += len(rows)
+        self.metrics['max_depth'] = max(self.metrics['max_depth'], len(self._rows))
+        return True
+
+    def due(self, now_ts):
+        return bool(self._rows) and (
+            len(self._rows) >= EVENT_FLUSH_SIZE or now_ts - self._oldest >= EVENT_FLUSH_SEC)
+
+    def flush(self):
+        """Insert everything buffered (needs an app context). Returns rows written."""
+        rows, self._rows, self._oldest = self._rows, [], None
+        if not rows:
+            return 0
+        t0 = time.perf_counter()
+        written = 0
+        for i in range(0, len(rows), EVENT_FLUSH_SIZE):
+            written += self._insert(rows[i:i + EVENT_FLUSH_SIZE])
+        self.metrics['flushes'] += 1
+        self.metrics['flushed'] += written
+        self.metrics['last_flush_rows'] = written
+        self.metrics['last_flush_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+        return written
+
+    def _insert(self, rows):
+        try:
+            db.session.execute(Event.__table__.insert(), rows)
+            db.session.commit()
+            return len(rows)
+        except Exception as e:
+            db.session.rollback()
+            self.metrics['flush_errors'] += 1
+            if len(rows) == 1:
+                self.metrics['dropped'] += 1
+                print(f'[WARN] dropping event {rows[0].get("event_type")!r}: {e}')
+                return 0
+            # bisect to isolate the bad rows instead of losing the whole chunk
+            mid = len(rows) // 2
+            return self._insert(rows[:mid]) + self._insert(rows[mid:])
+
+    def snapshot_metrics(self):
+        out = dict(self.metrics)
+        out['depth'] = len(self._rows)
+        out['capacity'] = self.max_rows
+        out['oldest_age_ms'] = round((time.monotonic() - self._oldest) * 1000, 1) if self._rows else 0
+        return out
+
+
+event_buffer = EventBuffer()
+_event_worker_started = False
+
+
+def _event_flush_worker():
+    while True:
+        if event_buffer.due(time.monotonic()):
+            try:
+                with app.app_context():
+                    event_buffer.flush()
+            except Exception as e:
+                print(f'[WARN] event flush failed: {e}')
+        socketio.sleep(EVENT_FLUSH_POLL_SEC)
+
+
+def ensure_event_flush_worker():
+    """Start the flush greenlet on first use (not at import, so CLI commands don't)."""
+    global _event_worker_started
+    if not _event_worker_started:
+        _event_worker_started = True
+        socketio.start_background_task(_event_flush_worker)
+
+
+@atexit.register
+def _flush_events_at_exit():
+    if len(event_buffer):
+        try:
+            with app.app_context():
+                event_buffer.flush()
+        except Exception:
+            pass
+
+
 @app.post('/events')
 @require_auth
 def ingest_event():
-    body = request.get_json(force=True)
-    e = Event(
-        user_id=g.user_id,
-        session_id=body.get('session_id'),
-        event_type=body.get('event_type'),
-        activity_id=body.get('activity_id'),
-        skill_id=body.get('skill_id'),
-        room_pin=body.get('room_pin'),
-        role=body.get('role'),
-        duration_ms=body.get('duration_ms'),
-        payload_json=body.get('payload_json')
-    )
+    body = request.get_json(silent=True) or {}
+    row, error = event_row(g.user_id, body, datetime.datetime.now(datetime.timezone.utc))
+    if error:
+        return jsonify({'error': error}), 400
+    e = Event(**row)
     db.session.add(e)
     db.session.commit()
     return jsonify({'ok': True, 'id': int(e.id)})
 
 
+@app.post('/events/batch')
+@require_auth
+def ingest_events_batch():
+    """Accept up to EVENT_BATCH_MAX events ({'events': [...]} or a bare array)
+    into the in-process buffer. 202 once buffered; 503 with Retry-After when
+    the buffer is full."""
+    body = request.get_json(silent=True)
+    entries = body.get('events') if isinstance(body, dict) else body
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'invalid_batch'}), 400
+    if len(entries) > EVENT_BATCH_MAX:
+        return jsonify({'error': 'batch_too_large', 'max': EVENT_BATCH_MAX}), 400
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rows = []
+    for entry in entries:
+        if isinstance(entry, dict):
+            row, error = event_row(g.user_id, entry, now)
+            if error is None:
+                rows.append(row)
+    if rows and not event_buffer.offer(rows):
+        resp = jsonify({'error': 'overloaded', 'retry_after': EVENT_FLUSH_SEC})
+        resp.headers['Retry-After'] = str(max(1, math.ceil(EVENT_FLUSH_SEC)))
+        return resp, 503
+    ensure_event_flush_worker()
+    return jsonify({'ok': True, 'accepted': len(rows), 'rejected': len(entries) - len(rows)}), 202
+
+
 # ------- Results ingestion and dashboard API -------
 #
 # OUTCOME VOCABULARY (two-tier intentional):
@@ -604,6 +1257,7 @@ def ingest_event():
 # (correct/win) vs the explicit incorrect set further down. Mastery updates
 # fire when outcome OR details.correct provides a clear correctness signal.
 SUCCESS_OUTCOMES = {'win', 'completed', 'success'}
+INCORRECT_OUTCOMES = {'incorrect', 'fail', 'wrong', 'lose', 'lost'}
 
 # Anti-cheat / abuse protection on /api/results.
 # Accept the canonical vocabulary plus None.
@@ -628,13 +1282,31 @@ MAX_DETAILS_BYTES = 16 * 1024  # 16KB cap on details_json after JSON encoding
 # fast-fire ratios drills but kills automated XP farming.
 RESULT_RATE_LIMIT_SEC = 1.5
 _last_result_at = {}  # user_id -> monotonic timestamp
-
-# 60-second leaderboard cache. The legacy compute path was O(N users * full XP
-# scan) per request — ~1200 queries for 200 users. With this cache the heavy
-# work runs at most once per minute per process; record_result invalidates it
-# eagerly so a fresh play shows in the rankings within seconds.
-LEADERBOARD_CACHE_TTL_SEC = 60.0
-_leaderboard_cache = {'data': None, 'expires_at': 0.0}
+# Drill modes (subitize, ratios) produce results faster than that floor, so
+# /api/results/batch accepts up to RESULT_BATCH_MAX at once and is limited by
+# result volume per window instead; single submissions count toward it too.
+RESULT_BATCH_MAX = int(os.environ.get('RESULT_BATCH_MAX', '50'))
+RESULT_KEY_MAX = 64  # client idempotency key length, see record_results_batch
+RESULT_VOLUME_WINDOW_SEC = 60
+RESULT_VOLUME_MAX = int(os.environ.get('RESULT_VOLUME_MAX', '120'))
+RESULT_MAX_AGE_SEC = 7 * 24 * 60 * 60  # oldest client timestamp accepted (offline play)
+_result_volume = {}  # user_id -> [window start (monotonic), results counted]
+
+# 'sync' writes each result inside the request; 'queue' appends it to a local
+# write-behind queue drained by a background greenlet (see ResultQueue), which
+# keeps end-of-period bursts from stacking up on database commits.
+RESULT_INGEST_MODE = os.environ.get('RESULT_INGEST_MODE', 'sync').strip().lower()
+RESULT_QUEUE_PATH = os.environ.get('RESULT_QUEUE_PATH') or os.path.join(app.instance_path, 'result_queue.db')
+RESULT_QUEUE_BATCH = int(os.environ.get('RESULT_QUEUE_BATCH', '200'))
+RESULT_QUEUE_IDLE_SEC = float(os.environ.get('RESULT_QUEUE_IDLE_SEC', '0.25'))
+RESULT_QUEUE_MAX_ATTEMPTS = int(os.environ.get('RESULT_QUEUE_MAX_ATTEMPTS', '8'))
+
+# The leaderboard lives in an in-process sorted index (LeaderboardIndex) that
+# record_result updates in place, so a play shows in the rankings immediately
+# without throwing the whole board away. A full rebuild from the users table
+# runs on cold start and then every LEADERBOARD_RECONCILE_SEC to pick up writes
+# made by other processes or outside record_result.
+LEADERBOARD_RECONCILE_SEC = float(os.environ.get('LEADERBOARD_RECONCILE_SEC', '300'))
 
 # Canonicalize mode names to ensure consistent storage and counting
 # Accept common synonyms and legacy variations and map them to canonical keys used across the app.
@@ -647,6 +1319,11 @@ MODE_SYNONYMS = {
     'ratios': {'ratios', 'ratio'},
     'subitize': {'subitize'},
 }
+# Flat synonym -> canonical index so canonicalize_mode() is one dict lookup
+MODE_CANONICAL = {}
+for _canon, _names in MODE_SYNONYMS.items():
+    for _name in _names:
+        MODE_CANONICAL.setdefault(_name, _canon)
 
 
 import math
@@ -771,6 +1448,9 @@ STANDARDS_CATALOG = [
      'description': 'Find whole-number quotients of whole numbers with up to four-digit dividends and two-digit divisors.'},
 ]
 
+# code -> catalog entry, so per-skill lookups don't scan STANDARDS_CATALOG
+STANDARDS_BY_CODE = {s['code']: s for s in STANDARDS_CATALOG}
+
 # Map (mode, challenge_type) -> list of standard codes practiced
 # Used to tag game results with standards and update mastery
 CHALLENGE_STANDARD_MAP = {
@@ -828,38 +1508,34 @@ def ensure_standards_seed():
     global _standards_seeded
     if _standards_seeded:
         return
-    _standards_seeded = True
     existing_codes = {s.standard_code for s in Skill.query.all()}
     if len(existing_codes) >= len(STANDARDS_CATALOG):
+        _standards_seeded = True
         return
+    # Explicit ids, as in ensure_achievements_seed: a migrated SQLite skills
+    # table has a BIGINT primary key, which SQLite doesn't auto-assign.
+    next_id = int(db.session.query(func.max(Skill.id)).scalar() or 0) + 1
     for s in STANDARDS_CATALOG:
         if s['code'] in existing_codes:
             continue
         skill = Skill(
+            id=next_id,
             standard_code=s['code'],
             name=s['name'],
             strand=s['strand'],
             difficulty=s.get('difficulty', s.get('grade', 1) - 4),
         )
+        next_id += 1
         db.session.add(skill)
-    try:
-        db.session.commit()
-    except Exception:
-        db.session.rollback()
-    # Invalidate the standard->skill_id cache so future lookups re-read the table
-    _standard_to_skill_id.clear()
-
-
-# Cache: standard_code -> skill.id (populated on first use)
-_standard_to_skill_id = {}
+    db.session.commit()
+    _standards_seeded = True
+    # New skills: future lookups must see their ids
+    reference_data.invalidate()
 
 
 def get_standard_skill_id(standard_code):
-    """Look up skill ID for a standard code, using a cache."""
-    if not _standard_to_skill_id:
-        for sk in Skill.query.all():
-            _standard_to_skill_id[sk.standard_code] = sk.id
-    return _standard_to_skill_id.get(standard_code)
+    """Look up skill ID for a standard code in the cached catalog."""
+    return reference_data.get().skill_id_by_code.get(standard_code)
 
 
 def resolve_standards_for_result(mode, details_json):
@@ -883,61 +1559,110 @@ def resolve_standards_for_result(mode, details_json):
     return []
 
 
-def update_mastery_for_result(user_id, mode, details_json, is_correct):
-    """Update mastery snapshots for all standards practiced in this result."""
-    ensure_standards_seed()
-    standard_codes = resolve_standards_for_result(mode, details_json)
-    if not standard_codes:
+def mastery_step(p, is_correct, learn_rate=MASTERY_LEARN_RATE, slip_rate=MASTERY_SLIP_RATE):
+    """One Bayesian-inspired update of a mastery probability, clamped and rounded."""
+    if is_correct:
+        p = p + (1 - p) * learn_rate
+    else:
+        p = p - p * slip_rate
+    return round(max(0.01, min(0.99, p)), 3)
+
+
+def mastery_se(opportunities):
+    return round(max(0.05, 1.0 / math.sqrt((opportunities or 1) + 1)), 3)
+
+
+def update_mastery_for_results(user_id, results):
+    """Apply (mode, details_json, is_correct) results, oldest first, to the
+    user's mastery snapshots: one IN query for the existing rows, one upsert to
+    write them back. Returns the final state of each practiced standard.
+
+    The snapshots are read-modify-write, so the existing rows are read FOR
+    UPDATE like record_daily_activity's (a no-op on SQLite)."""
+    practiced = []
+    skill_codes = {}
+    for mode, details_json, is_correct in results:
+        skill_ids = []
+        for code in resolve_standards_for_result(mode, details_json):
+            skill_id = get_standard_skill_id(code)
+            if skill_id:
+                skill_codes[skill_id] = code
+                skill_ids.append(skill_id)
+        practiced.append((skill_ids, is_correct))
+    if not skill_codes:
         return []
 
-    updated_standards = []
-    for code in standard_codes:
-        skill_id = get_standard_skill_id(code)
-        if not skill_id:
-            continue
-
-        snap = MasterySnapshot.query.filter_by(user_id=user_id, skill_id=skill_id).first()
-        if not snap:
-            snap = MasterySnapshot(
-                user_id=user_id,
-                skill_id=skill_id,
-                mastery_prob=MASTERY_PRIOR,
-                se=0.5,
-                opportunities=0,
-            )
-            db.session.add(snap)
-            try:
-                db.session.flush()
-            except Exception:
-                # A concurrent request may have created the same (user, skill)
-                # row in the gap between our SELECT and INSERT. Roll back this
-                # add and re-fetch the canonical row so we update it.
-                db.session.rollback()
-                snap = MasterySnapshot.query.filter_by(user_id=user_id, skill_id=skill_id).first()
-                if not snap:
-                    continue
-
-        # Bayesian-inspired update
-        p = float(snap.mastery_prob or MASTERY_PRIOR)
-        if is_correct:
-            p = p + (1 - p) * MASTERY_LEARN_RATE
-        else:
-            p = p - p * MASTERY_SLIP_RATE
-
-        snap.mastery_prob = round(max(0.01, min(0.99, p)), 3)
-        snap.opportunities = (snap.opportunities or 0) + 1
-        snap.se = round(max(0.05, 1.0 / math.sqrt((snap.opportunities or 1) + 1)), 3)
-        snap.last_evidence_at = func.now()
-        snap.updated_at = func.now()
+    existing = {
+        snap.skill_id: snap
+        for snap in MasterySnapshot.query.filter(
+            MasterySnapshot.user_id == user_id,
+            MasterySnapshot.skill_id.in_(list(skill_codes)),
+        ).with_for_update()
+    }
+    state = {
+        skill_id: (float(snap.mastery_prob or MASTERY_PRIOR), snap.opportunities or 0)
+        for skill_id, snap in existing.items()
+    }
+    for skill_ids, is_correct in practiced:
+        for skill_id in skill_ids:
+            p, opportunities = state.get(skill_id, (MASTERY_PRIOR, 0))
+            state[skill_id] = (mastery_step(p, is_correct), opportunities + 1)
 
+    rows = []
+    updated_standards = []
+    for skill_id, code in skill_codes.items():
+        p, opportunities = state[skill_id]
+        rows.append({
+            'user_id': user_id,
+            'skill_id': skill_id,
+            'mastery_prob': p,
+            'se': mastery_se(opportunities),
+            'opportunities': opportunities,
+        })
         updated_standards.append({
             'code': code,
-            'name': next((s['name'] for s in STANDARDS_CATALOG if s['code'] == code), code),
-            'mastery': float(snap.mastery_prob),
-            'opportunities': int(snap.opportunities),
+            'name': STANDARDS_BY_CODE.get(code, {}).get('name', code),
+            'mastery': p,
+            'opportunities': opportunities,
         })
 
-    db.session.flush()  # will be committed by the caller
+    stmt = upsert_insert(MasterySnapshot)
+    if stmt is None:
+        for row in rows:
+            snap = existing.get(row['skill_id'])
+            if snap is None:
+                snap = MasterySnapshot(user_id=user_id, skill_id=row['skill_id'])
+                db.session.add(snap)
+            snap.mastery_prob = row['mastery_prob']
+            snap.se = row['se']
+            snap.opportunities = row['opportunities']
+            snap.last_evidence_at = func.now()
+            snap.updated_at = func.now()
+        db.session.flush()  # will be committed by the caller
+        return updated_standards
+
+    # Rows that existed are locked until commit, so concurrent batches for the
+    # same user serialize on them. A lock can't cover a row that didn't exist:
+    # if another transaction creates the same snapshot first, it is
+    # overwritten rather than raising, so the result still commits but that
+    # transaction's first evidence for the skill is lost.
+    ex = stmt.excluded
+    db.session.execute(stmt.values([
+        dict(row, last_evidence_at=func.now(), updated_at=func.now()) for row in rows
+    ]).on_conflict_do_update(
+        index_elements=['user_id', 'skill_id'],
+        set_={
+            'mastery_prob': ex.mastery_prob,
+            'se': ex.se,
+            'opportunities': ex.opportunities,
+            'last_evidence_at': ex.last_evidence_at,
+            'updated_at': ex.updated_at,
+        },
+    ))
+    if existing:
+        # keep identity-mapped snapshots from serving stale values later in the request
+        for snap in existing.values():
+            db.session.expire(snap)
     return updated_standards
 
 
@@ -974,6 +1699,11 @@ def compute_xp_and_level(user_id):
                 db.session.commit()
             except Exception:
                 db.session.rollback()
+    return xp_level_info(total_xp)
+
+
+def xp_level_info(total_xp):
+    """Level breakdown for a total XP value (no DB access)."""
     # Level formula: solve XP_PER_LEVEL * L*(L+1)/2 = totalXP -> L ~ sqrt(2*totalXP/XP_PER_LEVEL)
     level = int((-1 + math.sqrt(1 + 8 * total_xp / XP_PER_LEVEL)) / 2) if total_xp > 0 else 0
     xp_for_current = int(XP_PER_LEVEL * level * (level + 1) / 2)
@@ -1003,68 +1733,355 @@ def get_level_title(level):
 DAILY_GOAL_TARGET = 5  # games per day to hit the daily goal
 
 
-def compute_streak_and_daily(user_id):
-    """Compute login streak (consecutive days with activity) and daily goal progress.
-    Uses game_results.played_at timestamps. No extra DB columns needed."""
-    # Fetch all distinct activity dates for the user (UTC date)
-    rows = db.session.query(
-        func.date(GameResult.played_at)
-    ).filter(
-        GameResult.user_id == user_id
-    ).distinct().all()
+def utc_today():
+    """Current UTC date; the day boundary for rollups and windowed leaderboards."""
+    return datetime.datetime.now(datetime.timezone.utc).date()
 
-    activity_dates = sorted({r[0] for r in rows if r[0] is not None}, reverse=True)
 
-    today = datetime.date.today()
+def utc_day_range(day):
+    """[start, end) UTC timestamps covering `day`. Filtering played_at on this
+    half-open range can use the (user_id, played_at) index; func.date(played_at)
+    cannot."""
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc)
+    return start, start + datetime.timedelta(days=1)
 
-    # Streak: count consecutive days going backwards from today/yesterday
-    streak = 0
-    if activity_dates:
-        # Check if today or yesterday has activity (streak can still be alive)
-        first = activity_dates[0]
-        # Convert to date if it's a string (SQLite returns strings)
-        if isinstance(first, str):
-            activity_dates = [datetime.date.fromisoformat(d) if isinstance(d, str) else d for d in activity_dates]
-            activity_dates.sort(reverse=True)
-            first = activity_dates[0]
-
-        if first == today:
-            streak = 1
-            check_date = today - datetime.timedelta(days=1)
-        elif first == today - datetime.timedelta(days=1):
-            # Yesterday counts - streak still alive but at risk today
-            streak = 1
-            check_date = today - datetime.timedelta(days=2)
-        else:
-            streak = 0
-            check_date = None
 
-        if check_date is not None:
-            date_set = set(activity_dates)
-            while check_date in date_set:
-                streak += 1
-                check_date -= datetime.timedelta(days=1)
+def _timestamp_bound(day, dialect_name, zone=datetime.timezone.utc):
+    """Midnight starting `day` in `zone` as a UTC instant, formatted for
+    comparison against stored timestamps."""
+    start = datetime.datetime.combine(day, datetime.time.min, tzinfo=zone).astimezone(datetime.timezone.utc)
+    if dialect_name == 'sqlite':
+        # SQLite CURRENT_TIMESTAMP stores 'YYYY-MM-DD HH:MM:SS' while bound datetimes
+        # render with microseconds, which would misfile rows written at exactly midnight.
+        return start.strftime('%Y-%m-%d %H:%M:%S')
+    return start
 
-    # Daily goal: how many games played today
-    games_today = db.session.query(func.count(GameResult.id)).filter(
-        GameResult.user_id == user_id,
-        func.date(GameResult.played_at) == today
-    ).scalar() or 0
 
-    played_today = activity_dates[0] == today if activity_dates else False
+def played_between(column, start_day, end_day, zone=datetime.timezone.utc):
+    """Index-friendly filter for timestamps in days [start_day, end_day) of
+    `zone` (default UTC). On partitioned Postgres tables the range also prunes
+    to the months it spans."""
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        column = type_coerce(column, String)
+    return and_(column >= _timestamp_bound(start_day, dialect_name, zone),
+                column < _timestamp_bound(end_day, dialect_name, zone))
+
+
+def played_on(column, day, zone=datetime.timezone.utc):
+    """Index-friendly filter for timestamps falling on `day` in `zone` (default UTC)."""
+    return played_between(column, day, day + datetime.timedelta(days=1), zone)
+
+
+def streak_from_dates(activity_dates, today):
+    """Count consecutive active days ending today, or yesterday (a streak is
+    still alive, just at risk, until a full day is missed)."""
+    if today in activity_dates:
+        check_date = today
+    elif today - datetime.timedelta(days=1) in activity_dates:
+        check_date = today - datetime.timedelta(days=1)
+    else:
+        return 0
+    streak = 0
+    while check_date in activity_dates:
+        streak += 1
+        check_date -= datetime.timedelta(days=1)
+    return streak
+
+
+def best_streak_from_dates(activity_dates):
+    """Longest run of consecutive days in a set of dates."""
+    best = 0
+    for day in activity_dates:
+        if day - datetime.timedelta(days=1) in activity_dates:
+            continue  # not the start of a run
+        length = 1
+        while day + datetime.timedelta(days=length) in activity_dates:
+            length += 1
+        best = max(best, length)
+    return best
+
+
+ACTIVITY_CALENDAR_DAYS = 371  # 53 full weeks: a year-long heatmap grid
+_ACTIVITY_MASK = (1 << ACTIVITY_CALENDAR_DAYS) - 1
+_zone_cache = {}
+
+
+def zone_for(name):
+    """ZoneInfo for an IANA name; UTC when unset or unknown."""
+    zone = _zone_cache.get(name)
+    if zone is None:
+        try:
+            zone = ZoneInfo(name) if name else datetime.timezone.utc
+        except (ZoneInfoNotFoundError, ValueError):
+            zone = datetime.timezone.utc
+        _zone_cache[name] = zone
+    return zone
+
+
+def user_timezones(user_ids):
+    """{user_id: timezone name} from each user's earliest-joined class that sets one."""
+    if not user_ids:
+        return {}
+    rows = db.session.query(ClassMembership.user_id, Class.timezone).join(
+        Class, Class.id == ClassMembership.class_id
+    ).filter(
+        ClassMembership.user_id.in_(user_ids),
+        Class.timezone.isnot(None),
+    ).order_by(ClassMembership.joined_at.desc()).all()
+    return {int(uid): tz for uid, tz in rows}  # earliest join wins (written last)
+
+
+def class_timezone(class_id):
+    """The class's IANA timezone name, or None (UTC)."""
+    return db.session.query(Class.timezone).filter(Class.id == class_id).scalar()
+
+
+def local_today(tz_name):
+    return datetime.datetime.now(zone_for(tz_name)).date()
+
+
+def mark_user_active(user, day):
+    """Advance the persisted streak, daily game count and activity bitmap for
+    a result played on local `day`. Plain date arithmetic; caller commits."""
+    last = user.last_active_date
+    bits = int.from_bytes(user.activity_bitmap or b'', 'little')
+    if last is not None and day < last:
+        # Late write from an earlier local day (e.g. timezone changed or a
+        # queued result): it may bridge a gap, so re-derive the runs from the
+        # bitmap. Runs reaching past the window keep their stored length.
+        offset = (last - day).days
+        if offset < ACTIVITY_CALENDAR_DAYS:
+            bits |= 1 << offset
+            current = (~bits & (bits + 1)).bit_length() - 1  # trailing ones: the run ending on `last`
+            if current < ACTIVITY_CALENDAR_DAYS:
+                user.current_streak = current
+            longest, runs = 0, bits
+            while runs:  # each pass shortens every run of ones by one
+                runs &= runs >> 1
+                longest += 1
+            user.best_streak = max(user.best_streak or 0, user.current_streak or 0, longest)
+    else:
+        if last == day:
+            user.last_active_games = (user.last_active_games or 0) + 1
+        else:
+            continues = last is not None and day - last == datetime.timedelta(days=1)
+            user.current_streak = (user.current_streak or 0) + 1 if continues else 1
+            user.last_active_games = 1
+            if last is not None:
+                bits <<= (day - last).days
+            user.last_active_date = day
+        bits |= 1
+        user.best_streak = max(user.best_streak or 0, user.current_streak or 0)
+    user.activity_bitmap = (bits & _ACTIVITY_MASK).to_bytes((ACTIVITY_CALENDAR_DAYS + 7) // 8, 'little')
+
+
+def streak_as_of(current_streak, last_active_date, today):
+    """A stored streak is still alive, just at risk, until a full day is missed."""
+    if last_active_date is None or today - last_active_date > datetime.timedelta(days=1):
+        return 0
+    return int(current_streak or 0)
+
+
+def activity_calendar(user, today):
+    """Active local days within the ACTIVITY_CALENDAR_DAYS ending `today`, from the bitmap."""
+    start = today - datetime.timedelta(days=ACTIVITY_CALENDAR_DAYS - 1)
+    active = []
+    last = user.last_active_date
+    if last is not None and user.activity_bitmap:
+        bits = int.from_bytes(user.activity_bitmap, 'little')
+        while bits:
+            offset = bits.bit_length() - 1
+            day = last - datetime.timedelta(days=offset)
+            if start <= day <= today:
+                active.append(day.isoformat())
+            bits ^= 1 << offset
+    return {'start': start.isoformat(), 'end': today.isoformat(),
+            'days': ACTIVITY_CALENDAR_DAYS, 'active': active}
+
+
+def _supports_window_functions():
+    dialect = db.session.get_bind().dialect
+    return dialect.name != 'sqlite' or (dialect.server_version_info or ()) >= (3, 25)
+
+
+def _local_day_expr(dialect_name):
+    """SQL for the local date of game_results.played_at in the zone bound as
+    :tz. SQLite has no time zone database, so there it calls local_date(),
+    registered on each connection by _register_sqlite_functions."""
+    tz = bindparam('tz', type_=String)
+    if dialect_name == 'postgresql':
+        return func.date(func.timezone(tz, GameResult.played_at))
+    return func.local_date(GameResult.played_at, tz)
+
+
+def _sqlite_local_date(played_at, tz_name):
+    if played_at is None:
+        return None
+    moment = datetime.datetime.fromisoformat(played_at)
+    if moment.tzinfo is None:  # stored as naive UTC
+        moment = moment.replace(tzinfo=datetime.timezone.utc)
+    return moment.astimezone(zone_for(tz_name)).date().isoformat()
+
+
+@event.listens_for(Engine, 'connect')
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('local_date', 2, _sqlite_local_date, deterministic=True)
+
+
+_streak_summary_stmts = {}  # dialect name -> compiled-once select
+
+
+def _streak_summary_stmt(dialect_name):
+    """Gaps-and-islands over each user's distinct local active days: day number
+    minus row number is constant across a run of consecutive days, so grouping
+    on it yields one row per run. Returns (user_id, current run length, best
+    run length, last active day, games on that day) per user, where the
+    current run is the one ending on the last active day. Built once per
+    dialect; everything varying is bound."""
+    stmt = _streak_summary_stmts.get(dialect_name)
+    if stmt is not None:
+        return stmt
+    local_day = _local_day_expr(dialect_name)
+    days = select(
+        GameResult.user_id.label('user_id'),
+        local_day.label('day'),
+        func.count().label('games'),
+    ).where(GameResult.user_id.in_(bindparam('user_ids', expanding=True))).group_by(
+        GameResult.user_id, local_day).subquery()
+    if dialect_name == 'sqlite':
+        day_number = func.julianday(days.c.day)
+    else:
+        day_number = days.c.day - datetime.date(2000, 1, 1)  # date - date = integer days
+    runs_src = select(
+        days.c.user_id, days.c.day, days.c.games,
+        (day_number - func.row_number().over(
+            partition_by=days.c.user_id, order_by=days.c.day)).label('run_key'),
+    ).subquery()
+    runs = select(
+        runs_src.c.user_id,
+        func.count().label('length'),
+        func.max(runs_src.c.day).label('last_day'),
+    ).group_by(runs_src.c.user_id, runs_src.c.run_key).subquery()
+    ranked = select(
+        runs.c.user_id, runs.c.length, runs.c.last_day,
+        func.max(runs.c.length).over(partition_by=runs.c.user_id).label('best'),
+        func.row_number().over(partition_by=runs.c.user_id, order_by=runs.c.last_day.desc()).label('rn'),
+    ).subquery()
+    stmt = select(
+        ranked.c.user_id, ranked.c.length, ranked.c.best, ranked.c.last_day, days.c.games,
+    ).join(days, and_(days.c.user_id == ranked.c.user_id, days.c.day == ranked.c.last_day)).where(ranked.c.rn == 1)
+    _streak_summary_stmts[dialect_name] = stmt
+    return stmt
+
+
+def streak_summaries(user_ids, tz_name=None):
+    """{user_id: (current streak, best streak, last active day, games that day)}
+    for users with any results, with days in `tz_name`, from one windowed
+    query. Falls back to walking the distinct days in Python on SQLite builds
+    without window functions (< 3.25)."""
+    if not user_ids:
+        return {}
+    dialect_name = db.session.get_bind().dialect.name
+    tz = tz_name or 'UTC'
+    if not _supports_window_functions():
+        local_day = _local_day_expr(dialect_name)
+        games = defaultdict(dict)
+        for uid, day, n in db.session.execute(
+                select(GameResult.user_id, local_day, func.count()).where(GameResult.user_id.in_(user_ids))
+                .group_by(GameResult.user_id, local_day), {'tz': tz}):
+            games[uid][_as_date(day)] = int(n)
+        out = {}
+        for uid, by_day in games.items():
+            last = max(by_day)
+            out[uid] = (streak_from_dates(by_day, last), best_streak_from_dates(by_day), last, by_day[last])
+        return out
+    rows = db.session.execute(_streak_summary_stmt(dialect_name), {'user_ids': list(user_ids), 'tz': tz})
+    return {uid: (int(current), int(best), _as_date(last), int(n)) for uid, current, best, last, n in rows}
+
+
+def _as_date(value):
+    """SQLite returns date() results as ISO strings."""
+    return datetime.date.fromisoformat(value) if isinstance(value, str) else value
+
+
+def _recent_active_days(user_ids, tz_name, since):
+    """{user_id: set of local days >= `since` with results}, for the bitmap."""
+    dialect_name = db.session.get_bind().dialect.name
+    local_day = _local_day_expr(dialect_name)
+    days = select(GameResult.user_id.label('user_id'), local_day.label('day')).where(
+        GameResult.user_id.in_(user_ids),
+        GameResult.played_at >= utc_day_range(since - datetime.timedelta(days=1))[0],
+    ).distinct().subquery()
+    out = defaultdict(set)
+    for uid, day in db.session.execute(select(days.c.user_id, days.c.day), {'tz': tz_name or 'UTC'}):
+        day = _as_date(day)
+        if day >= since:
+            out[uid].add(day)
+    return out
+
+
+def rebuild_users_activity(users, zones):
+    """Recompute the persisted streak columns and bitmap of `users` from
+    game_results, bucketing played_at into each user's local days (`zones`:
+    {user_id: tz name}). Streaks come from streak_summaries(), the bitmap from
+    the distinct days in its window; no per-result rows reach Python. Caller
+    commits."""
+    by_zone = defaultdict(list)
+    for user in users:
+        by_zone[zones.get(int(user.id))].append(user)
+    for tz_name, group in by_zone.items():
+        summaries = streak_summaries([int(u.id) for u in group], tz_name)
+        lasts = [summary[2] for summary in summaries.values()]
+        recent = _recent_active_days(
+            list(summaries), tz_name,
+            min(lasts) - datetime.timedelta(days=ACTIVITY_CALENDAR_DAYS - 1)) if lasts else {}
+        for user in group:
+            summary = summaries.get(int(user.id))
+            if summary is None:
+                user.current_streak = user.best_streak = user.last_active_games = 0
+                user.last_active_date = user.activity_bitmap = None
+                continue
+            current, best, last, games = summary
+            bits = 0
+            for day in recent.get(int(user.id), ()):
+                offset = (last - day).days
+                if 0 <= offset < ACTIVITY_CALENDAR_DAYS:
+                    bits |= 1 << offset
+            user.last_active_date = last
+            user.last_active_games = games
+            user.current_streak = current
+            user.best_streak = best
+            user.activity_bitmap = bits.to_bytes((ACTIVITY_CALENDAR_DAYS + 7) // 8, 'little')
+
+
+def rebuild_user_activity(user, tz_name=None):
+    """rebuild_users_activity() for one user. Caller commits."""
+    rebuild_users_activity([user], {int(user.id): tz_name})
+
+
+def compute_streak_and_daily(user, today):
+    """Login streak, best streak and daily goal progress read from the persisted
+    columns (see mark_user_active); `today` is the user's local date."""
+    if user is None:
+        current = best = games_today = 0
+    else:
+        current = streak_as_of(user.current_streak, user.last_active_date, today)
+        best = int(user.best_streak or 0)
+        games_today = int(user.last_active_games or 0) if user.last_active_date == today else 0
 
     return {
-        'streak': streak,
-        'played_today': played_today,
-        'games_today': int(games_today),
+        'streak': current,
+        'played_today': games_today > 0,
+        'games_today': games_today,
         'daily_goal': DAILY_GOAL_TARGET,
-        'daily_goal_met': int(games_today) >= DAILY_GOAL_TARGET,
-        'best_streak': streak,  # TODO: track historical best separately
+        'daily_goal_met': games_today >= DAILY_GOAL_TARGET,
+        'best_streak': max(best, current),
     }
 
 
 # ---- Daily Quest System ----
-import hashlib
 
 QUEST_TEMPLATES = [
     {'type': 'play_mode', 'mode': 'plane', 'count': 3, 'label': 'Play 3 Coordinate Plane games', 'icon': '\U0001f9ed'},
@@ -1082,12 +2099,12 @@ QUEST_TEMPLATES = [
     {'type': 'total_games', 'count': 3, 'label': 'Complete 3 total games', 'icon': '\u2728'},
 ]
 QUESTS_PER_DAY = 3
+QUEST_CALENDAR_DAYS = 365
 
 
-def get_daily_quests(date=None):
-    """Return 3 deterministically-selected quests for the given date."""
-    if date is None:
-        date = datetime.date.today()
+def select_daily_quests(date):
+    """Deterministically pick QUESTS_PER_DAY quests for a date (hash-based, so
+    every process agrees without sharing state)."""
     n = len(QUEST_TEMPLATES)
     indices = []
     for i in range(QUESTS_PER_DAY):
@@ -1098,30 +2115,120 @@ def get_daily_quests(date=None):
             idx = (idx + 1) % n
             attempts += 1
         indices.append(idx)
-    return [dict(QUEST_TEMPLATES[i], id=i) for i in indices]
+    return tuple(dict(QUEST_TEMPLATES[i], id=i) for i in indices)
 
 
-def compute_quest_progress(user_id):
-    """Compute progress on today's quests from game_results."""
-    today = datetime.date.today()
-    quests = get_daily_quests(today)
+def build_quest_calendar(start=None, days=QUEST_CALENDAR_DAYS):
+    """Precompute the quest picks for `days` days from `start` (default: yesterday
+    in UTC, so classes whose local day is still behind UTC are covered)."""
+    start = start or utc_today() - datetime.timedelta(days=1)
+    return {d: select_daily_quests(d) for d in (start + datetime.timedelta(days=i) for i in range(days))}
+
 
-    today_results = GameResult.query.filter(
+# date -> tuple of quest dicts (shared; treat as read-only). Days past the
+# precomputed range are picked on first use and added.
+quest_calendar = build_quest_calendar()
+
+
+def get_daily_quests(date=None):
+    """Return the 3 quests for the given (local) date from the precomputed calendar."""
+    if date is None:
+        date = utc_today()
+    quests = quest_calendar.get(date)
+    if quests is None:
+        quests = quest_calendar[date] = select_daily_quests(date)
+    return list(quests)
+
+
+def quest_counters_for_day(user_id, day, zone=datetime.timezone.utc):
+    """Count the user's games/wins per canonical mode on the given local day
+    from game_results. Only used for daily_activity rows that predate
+    quest_json; see daily_quest_counters()."""
+    day_results = db.session.query(GameResult.mode, GameResult.outcome).filter(
         GameResult.user_id == user_id,
-        func.date(GameResult.played_at) == today
+        played_on(GameResult.played_at, day, zone),
     ).all()
 
     games_by_mode = {}
     wins_by_mode = {}
     modes_played = set()
-    total_games = len(today_results)
-
-    for gr in today_results:
-        mode = canonicalize_mode(gr.mode)
+    for raw_mode, outcome in day_results:
+        mode = canonicalize_mode(raw_mode)
         games_by_mode[mode] = games_by_mode.get(mode, 0) + 1
         modes_played.add(mode)
-        if gr.outcome in SUCCESS_OUTCOMES:
+        if outcome in SUCCESS_OUTCOMES:
             wins_by_mode[mode] = wins_by_mode.get(mode, 0) + 1
+    return {
+        'games_by_mode': games_by_mode,
+        'wins_by_mode': wins_by_mode,
+        'modes_played': modes_played,
+        'total_games': len(day_results),
+    }
+
+
+def quest_counters_from_json(quest_json, total_games):
+    """Quest counters from a daily_activity row's quest_json and games count."""
+    quest_json = quest_json or {}
+    games_by_mode = dict(quest_json.get('games') or {})
+    return {
+        'games_by_mode': games_by_mode,
+        'wins_by_mode': dict(quest_json.get('wins') or {}),
+        'modes_played': set(games_by_mode),
+        'total_games': int(total_games or 0),
+    }
+
+
+def add_quest_plays(counters, games_by_mode, wins_by_mode):
+    """New counters with a batch of plays (per-mode game and win counts) added."""
+    games = dict(counters['games_by_mode'])
+    wins = dict(counters['wins_by_mode'])
+    for mode, n in games_by_mode.items():
+        games[mode] = games.get(mode, 0) + n
+    for mode, n in wins_by_mode.items():
+        wins[mode] = wins.get(mode, 0) + n
+    return {
+        'games_by_mode': games,
+        'wins_by_mode': wins,
+        'modes_played': set(games),
+        'total_games': counters['total_games'] + sum(games_by_mode.values()),
+    }
+
+
+def daily_quest_counters(user_id, day=None, tz_name=None):
+    """The user's quest counters for a local day (default: today in the class
+    timezone `tz_name`): one lookup on daily_activity's (user_id, day) key."""
+    day = day or local_today(tz_name)
+    row = db.session.query(DailyActivity.games, DailyActivity.quest_json).filter_by(
+        user_id=user_id, day=day).first()
+    if row is None:
+        return quest_counters_from_json(None, 0)
+    if row.quest_json is None and row.games:
+        return quest_counters_for_day(user_id, day, zone_for(tz_name))
+    return quest_counters_from_json(row.quest_json, row.games)
+
+
+def newly_completed_quests(before, after, day):
+    """Quests for `day` that the `after` counters complete and `before` didn't."""
+    was_done = {q['id'] for q in compute_quest_progress(None, before, day)['quests'] if q['completed']}
+    return [
+        {'id': q['id'], 'label': q['label'], 'icon': q['icon']}
+        for q in compute_quest_progress(None, after, day)['quests']
+        if q['completed'] and q['id'] not in was_done
+    ]
+
+
+def compute_quest_progress(user_id, counters=None, today=None, tz_name=None):
+    """Compute progress on today's quests from the daily quest counters. `today`
+    is the user's local date, as for the streak (default: now in `tz_name`)."""
+    today = today or local_today(tz_name)
+    quests = get_daily_quests(today)
+
+    if counters is None:
+        counters = daily_quest_counters(user_id, today, tz_name)
+    games_by_mode = counters['games_by_mode']
+    wins_by_mode = counters['wins_by_mode']
+    modes_played = counters['modes_played']
+    total_games = counters['total_games']
 
     result = []
     for q in quests:
@@ -1160,24 +2267,181 @@ def canonicalize_mode(value: str) -> str:
     v = (value or '').strip().lower()
     if not v:
         return 'unknown'
-    for canon, names in MODE_SYNONYMS.items():
-        if v in names:
-            return canon
-    return v
+    return MODE_CANONICAL.get(v, v)
 
 
+@lru_cache(maxsize=256)
 def canonical_mode_group(target_mode: str):
-    """Return list of mode keys that should be counted toward the given canonical mode bucket.
+    """Return the mode keys that should be counted toward the given canonical mode bucket.
     Plane bucket includes legacy 'line'. Others include common synonyms to count historical data.
+    Memoized; returns a tuple.
     """
     m = canonicalize_mode(target_mode)
     if m == 'plane':
-        return ['plane', 'line']
+        return ('plane', 'line')
     # include all known synonyms for robust counting
     names = set(MODE_SYNONYMS.get(m, {m}))
     # Always include the canonical itself
     names.add(m)
-    return sorted(names)
+    return tuple(sorted(names))
+
+
+# Per-row helpers run once per result (or per dashboard row), so their cost is
+# multiplied by traffic. `flask bench-helpers` times each one in isolation; run
+# it before and after touching them.
+
+def _helper_benchmarks():
+    """([(name, zero-arg callable)], modes per call): pairs covering the
+    per-row helpers, and how many modes each mode-helper call canonicalizes
+    (to report per-mode timings)."""
+    raw_modes = ['plane', 'Coordinate Plane', ' meme-dash ', 'ratio', 'line_graph', 'subitize', 'unknown-mode', '']
+    today = utc_today()
+    far_day = today + datetime.timedelta(days=QUEST_CALENDAR_DAYS * 3)
+    details = {'challenge_type': 'vertex', 'correct': True}
+    quest_json = {'games': {'plane': 3, 'ratios': 1}, 'wins': {'plane': 2}}
+    counters = quest_counters_from_json(quest_json, 4)
+    return [
+        ('canonicalize_mode', lambda: [canonicalize_mode(m) for m in raw_modes]),
+        ('canonical_mode_group', lambda: [canonical_mode_group(m) for m in raw_modes]),
+        ('get_daily_quests', lambda: get_daily_quests(today)),
+        ('select_daily_quests (uncached)', lambda: select_daily_quests(far_day)),
+        ('classify_result', lambda: classify_result('plane', 'Vertex Challenge', 'win', details)),
+        ('result_stat_delta', lambda: result_stat_delta(1, 'plane', 'Vertex Challenge', 'win', 10, details, today)),
+        ('resolve_standards_for_result', lambda: resolve_standards_for_result('plane', details)),
+        ('mastery_step', lambda: mastery_step(0.42, True)),
+        ('compute_xp_earned', lambda: compute_xp_earned('win', 80)),
+        ('quest_counters_from_json', lambda: quest_counters_from_json(quest_json, 4)),
+        ('compute_quest_progress', lambda: compute_quest_progress(None, counters, today)),
+    ], len(raw_modes)
+
+
+@app.cli.command('bench-helpers')
+@click.option('--number', default=20000, show_default=True, help='Calls per timing run.')
+@click.option('--repeat', default=5, show_default=True, help='Timing runs per helper; the best is reported.')
+def bench_helpers_command(number, repeat):
+    """Microbenchmark the per-row helpers (mode canonicalization, quests, stats, mastery)."""
+    import timeit
+    benches, modes_per_call = _helper_benchmarks()
+    for name, fn in benches:
+        best = min(timeit.repeat(fn, number=number, repeat=repeat)) / number
+        per = modes_per_call if name in ('canonicalize_mode', 'canonical_mode_group') else 1
+        click.echo(f'bench: {name:<32} {best / per * 1e9:9.0f} ns/call')
+
+
+# The hot-path indexes from migration 3f1d2c9a7b10, paired with the query
+# shape each one serves. tests/test_indexes.py asserts SQLite's plan uses them;
+# `flask bench-indexes` times the same shapes against a seeded scratch file.
+
+def index_probe_queries(user_id, day, dialect_name='sqlite'):
+    """(name, index it should use, statement) for the indexed query shapes."""
+    played_at = GameResult.played_at
+    if dialect_name == 'sqlite':
+        played_at = type_coerce(played_at, String)
+    return [
+        ('recent results', 'ix_results_user_played',
+         select(GameResult.id, GameResult.mode, GameResult.outcome, GameResult.score, GameResult.played_at)
+         .where(GameResult.user_id == user_id).order_by(GameResult.played_at.desc()).limit(25)),
+        ('results on a day', 'ix_results_user_played',
+         select(GameResult.mode, GameResult.outcome).where(
+             GameResult.user_id == user_id,
+             played_at >= _timestamp_bound(day, dialect_name),
+             played_at < _timestamp_bound(day + datetime.timedelta(days=1), dialect_name))),
+        ('wins by user', 'ix_results_user_outcome',
+         select(func.count()).select_from(GameResult).where(
+             GameResult.user_id == user_id, GameResult.outcome.in_(('win', 'completed')))),
+        ('leaderboard top 50', 'ix_users_total_xp',
+         select(User.id, User.total_xp).where(User.total_xp > 0).order_by(User.total_xp.desc()).limit(50)),
+    ]
+
+
+def explain_query_plan(conn, stmt):
+    """SQLite's EXPLAIN QUERY PLAN detail lines for a Core statement."""
+    compiled = stmt.compile(dialect=conn.dialect, compile_kwargs={'literal_binds': True})
+    return [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}')]
+
+
+def _seed_index_bench(engine, n_results, n_users):
+    import random
+    rng = random.Random(7)
+    modes = ['plane', 'line', 'ratios', 'battleship', 'memewars', 'memedash', 'subitize']
+    outcomes = ['win', 'lose', 'incorrect', 'completed']
+    start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=365)
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [
+            {'id': uid, 'google_sub': f'bench-{uid}', 'role': 'student', 'total_xp': rng.randint(0, 50000)}
+            for uid in range(1, n_users + 1)])
+    chunk = 50000
+    for offset in range(0, n_results, chunk):
+        rows = []
+        for _ in range(min(chunk, n_results - offset)):
+            mode = rng.choice(modes)
+            rows.append({
+                'user_id': rng.randint(1, n_users), 'mode': mode, 'game_name': mode, 'outcome': rng.choice(outcomes),
+                'score': rng.randint(0, 100),
+                'played_at': start + datetime.timedelta(seconds=rng.randint(0, 365 * 86400)),
+            })
+        with engine.begin() as conn:
+            conn.execute(GameResult.__table__.insert(), rows)
+
+
+@app.cli.command('bench-indexes')
+@click.option('--results', 'n_results', default=1_000_000, show_default=True, help='game_results rows to seed.')
+@click.option('--users', 'n_users', default=5000, show_default=True)
+@click.option('--runs', default=200, show_default=True, help='Executions per query shape.')
+@click.option('--path', default=None, help='Scratch SQLite file (default: a temp file, deleted afterwards).')
+@click.option('--compare/--no-compare', default=True, show_default=True,
+              help='Drop the indexes and time the same queries again.')
+def bench_indexes_command(n_results, n_users, runs, path, compare):
+    """Seed a scratch SQLite database and time the indexed query shapes (migration 3f1d2c9a7b10)."""
+    import random
+    import statistics
+    import tempfile
+    from sqlalchemy import create_engine
+    tmpdir = None
+    if path is None:
+        tmpdir = tempfile.mkdtemp(prefix='bench-indexes-')
+        path = os.path.join(tmpdir, 'bench.db')
+    engine = create_engine(f'sqlite:///{path}')
+    tables = [User.__table__, GameResult.__table__]
+    try:
+        db.metadata.drop_all(engine, tables=tables)
+        db.metadata.create_all(engine, tables=tables)
+        t0 = time.perf_counter()
+        _seed_index_bench(engine, n_results, n_users)
+        click.echo(f'bench: seeded {n_results} results for {n_users} users in {time.perf_counter() - t0:.1f}s')
+        with engine.connect() as conn:
+            conn.exec_driver_sql('ANALYZE')
+        rng = random.Random(11)
+        day = utc_today() - datetime.timedelta(days=30)
+
+        def run(label):
+            with engine.connect() as conn:
+                for i, (name, index_name, stmt) in enumerate(index_probe_queries(1, day)):
+                    plan = ' / '.join(explain_query_plan(conn, stmt))
+                    timings = []
+                    for _ in range(runs):
+                        stmt = index_probe_queries(rng.randint(1, n_users), day)[i][2]
+                        t = time.perf_counter()
+                        conn.execute(stmt).fetchall()
+                        timings.append((time.perf_counter() - t) * 1000)
+                    timings.sort()
+                    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+                    used = 'yes' if index_name in plan else 'NO'
+                    click.echo(f'bench: [{label}] {name:<20} p50 {statistics.median(timings):8.3f} ms  '
+                               f'p95 {p95:8.3f} ms  {index_name}: {used}  ({plan})')
+
+        run('indexed')
+        if compare:
+            with engine.begin() as conn:
+                for index_name in ('ix_results_user_played', 'ix_results_user_outcome', 'ix_users_total_xp'):
+                    conn.exec_driver_sql(f'DROP INDEX IF EXISTS {index_name}')
+                conn.exec_driver_sql('ANALYZE')
+            run('no index')
+    finally:
+        engine.dispose()
+        if tmpdir:
+            import shutil
+            shutil.rmtree(tmpdir, ignore_errors=True)
 
 
 _achievements_seeded = False
@@ -1219,6 +2483,7 @@ def ensure_achievements_seed():
                 ach = Achievement(id=next_id, code=code, title=title, description=desc, mode=m, threshold=t)
                 next_id += 1
                 to_create.append(ach)
+                existing_codes.add(code)
 
     # Cross-mode and special achievements
     extra_achievements = [
@@ -1250,6 +2515,7 @@ def ensure_achievements_seed():
             ach = Achievement(id=next_id, code=code, title=title, description=desc, mode=m, threshold=t)
             next_id += 1
             to_create.append(ach)
+            existing_codes.add(code)
 
     if to_create:
         db.session.add_all(to_create)
@@ -1274,183 +2540,1644 @@ def ensure_achievements_seed():
             updated = True
     if updated:
         db.session.commit()
+    if to_create or updated:
+        reference_data.invalidate()
+
+
+# ---- Reference data cache ----
+# skills, achievements and shop_items only change when a seed function or an
+# admin edits them, yet results, the dashboard and the shop read them on every
+# request. reference_data keeps an immutable snapshot of all three catalogs,
+# loaded with three queries on first use, and hot paths read only that. Writers
+# call reference_data.invalidate() after committing: it bumps the version and
+# the next reader loads a fresh snapshot. Edits made outside this process
+# (psql, a CLI command) show up within REFERENCE_RELOAD_SEC.
+
+REFERENCE_RELOAD_SEC = float(os.environ.get('REFERENCE_RELOAD_SEC', '600'))
+
+SkillRef = namedtuple('SkillRef', 'id standard_code name strand difficulty')
+AchievementRef = namedtuple('AchievementRef', 'id code title description mode threshold icon')
+ShopItemRef = namedtuple('ShopItemRef', 'id code name description category rarity price icon data_json')
+
+
+class ReferenceSnapshot:
+    """One consistent view of the catalogs, never mutated after construction
+    (treat data_json dicts as read-only too)."""
+
+    def __init__(self, version, skills, achievements, shop_items):
+        self.version = version
+        self.skills = tuple(sorted(skills, key=lambda s: s.standard_code))
+        self.skill_id_by_code = {s.standard_code: s.id for s in self.skills}
+        # Per-mode first, cross-mode (NULL mode) last, matching Postgres ORDER BY mode
+        self.achievements = tuple(sorted(
+            achievements, key=lambda a: (a.mode is None, a.mode or '', a.threshold, a.id)))
+        self.cross_mode_achievements = tuple(a for a in self.achievements if a.mode is None)
+        by_mode = defaultdict(list)
+        for a in self.achievements:
+            if a.mode is not None:
+                by_mode[a.mode].append(a)
+        self.achievements_by_mode = {m: tuple(v) for m, v in by_mode.items()}
+        self.shop_items = tuple(sorted(shop_items, key=lambda i: (i.category, i.price, i.id)))
+        self.shop_items_by_id = {i.id: i for i in self.shop_items}
+
+    def shop_item(self, item_id):
+        try:
+            return self.shop_items_by_id.get(int(item_id))
+        except (TypeError, ValueError):
+            return None
+
+
+class ReferenceData:
+    """Process-wide read-through cache of ReferenceSnapshot, versioned so an
+    invalidate() that lands while a load is in flight still forces a reload."""
+
+    def __init__(self, reload_sec=REFERENCE_RELOAD_SEC):
+        self.reload_sec = reload_sec
+        self.version = 0
+        self._snapshot = None
+        self._loaded_at = None
+        self.metrics = {
+            'reads': 0,
+            'loads': 0,
+            'invalidations': 0,
+            'last_load_ms': None,
+        }
 
+    def get(self):
+        snap = self._snapshot
+        if (snap is None or snap.version != self.version
+                or time.monotonic() - self._loaded_at >= self.reload_sec):
+            snap = self._load()
+        self.metrics['reads'] += 1
+        return snap
+
+    def _load(self):
+        t0 = time.perf_counter()
+        version = self.version
+        conn = db.session.connection()
+        skills = [SkillRef(int(r[0]), *r[1:]) for r in conn.execute(select(
+            Skill.id, Skill.standard_code, Skill.name, Skill.strand, Skill.difficulty))]
+        achievements = [AchievementRef(int(r[0]), r[1], r[2], r[3], r[4], int(r[5]), r[6]) for r in conn.execute(select(
+            Achievement.id, Achievement.code, Achievement.title, Achievement.description,
+            Achievement.mode, Achievement.threshold, Achievement.icon))]
+        shop_items = [ShopItemRef(int(r[0]), *r[1:6], int(r[6]), r[7], r[8]) for r in conn.execute(select(
+            ShopItem.id, ShopItem.code, ShopItem.name, ShopItem.description, ShopItem.category,
+            ShopItem.rarity, ShopItem.price, ShopItem.icon, ShopItem.data_json))]
+        snap = ReferenceSnapshot(version, skills, achievements, shop_items)
+        if not (skills and achievements and shop_items) and self.metrics['loads'] == 0:
+            print('[WARN] Skill/achievement/shop catalogs are empty; run `flask bootstrap`.')
+        self._snapshot = snap
+        self._loaded_at = time.monotonic()
+        self.metrics['loads'] += 1
+        self.metrics['last_load_ms'] = round((time.perf_counter() - t0) * 1000, 2)
+        return snap
+
+    def invalidate(self):
+        """Catalog rows changed (seeded or edited): load afresh on next read."""
+        self.version += 1
+        self.metrics['invalidations'] += 1
+
+    def snapshot_metrics(self):
+        m = dict(self.metrics)
+        m['version'] = self.version
+        snap = self._snapshot
+        m['loaded_version'] = snap.version if snap else None
+        m['skills'] = len(snap.skills) if snap else None
+        m['achievements'] = len(snap.achievements) if snap else None
+        m['shop_items'] = len(snap.shop_items) if snap else None
+        return m
+
+
+reference_data = ReferenceData()
+
+
+# ---- Per-user rolling stats (user_stats) ----
+
+def classify_result(mode, game_name, outcome, details_json):
+    """Return (mode_bucket, challenge_type, correct) for a result.
+
+    mode_bucket merges 'line' into 'plane' like the dashboard does; correct is
+    True/False when details or the outcome give a clear signal, else None."""
+    det = details_json if isinstance(details_json, dict) else {}
+    # canonical mode: map synonyms, then merge 'line' into 'plane' bucket
+    base_mode = canonicalize_mode(mode or '')
+    cmode = 'plane' if base_mode in ('line', 'plane') else (base_mode or 'unknown')
+    # challenge type
+    ctype = det.get('challenge_type')
+    if not ctype:
+        # infer from mode/game_name
+        if mode == 'line' or (cmode == 'plane' and 'line' in (game_name or '').lower()):
+            ctype = 'line'
+        elif cmode == 'plane' and 'vertex' in (game_name or '').lower():
+            ctype = 'vertex'
+        elif cmode == 'ratios':
+            ctype = 'ratio'
+        else:
+            ctype = cmode
+    # correctness
+    if det.get('correct') is True:
+        corr = True
+    elif det.get('correct') is False:
+        corr = False
+    elif outcome in SUCCESS_OUTCOMES:
+        corr = True
+    elif (outcome or '').lower() in INCORRECT_OUTCOMES:
+        corr = False
+    else:
+        corr = None
+    return cmode, str(ctype)[:64], corr
 
-@app.post('/api/results')
-@require_auth
-def record_result():
-    ensure_achievements_seed()
-    body = request.get_json(silent=True) or {}
 
-    # Per-user rate limit (anti-grinding)
-    now_ts = time.monotonic()
-    last_ts = _last_result_at.get(g.user_id, 0)
-    if now_ts - last_ts < RESULT_RATE_LIMIT_SEC:
-        return jsonify({
-            'error': 'rate_limited',
-            'retry_after': round(RESULT_RATE_LIMIT_SEC - (now_ts - last_ts), 2),
-        }), 429
+def result_stat_delta(user_id, mode, game_name, outcome, score, details_json, played_on):
+    """Describe one result as a user_stats row (counts of 1/0) ready to insert or merge."""
+    _, ctype, corr = classify_result(mode, game_name, outcome, details_json)
+    is_success = outcome in SUCCESS_OUTCOMES
+    score = float(score) if score is not None else None
+    return {
+        'user_id': user_id,
+        'mode': canonicalize_mode(mode),
+        'challenge_type': ctype,
+        'total': 1,
+        'correct': int(corr is True),
+        'incorrect': int(corr is False),
+        'successes': int(is_success),
+        'completed': int(is_success or outcome is None),
+        'scored': int(score is not None),
+        'score_sum': score or 0,
+        'score_max': score,
+        'success_run': int(is_success),
+        'last_played_on': played_on,
+    }
 
-    mode = canonicalize_mode(body.get('mode'))
-    if mode == 'unknown' or mode not in MODE_SYNONYMS:
-        return jsonify({'error': 'invalid_mode'}), 400
 
-    game_name_raw = (body.get('game_name') or mode)
-    game_name = (str(game_name_raw)[:120]).strip() or mode
+def merge_stat_delta(stat, delta):
+    """Fold a result_stat_delta() into a UserStat instance, in result order."""
+    for col in ('total', 'correct', 'incorrect', 'successes', 'completed', 'scored'):
+        setattr(stat, col, (getattr(stat, col) or 0) + delta[col])
+    stat.score_sum = float(stat.score_sum or 0) + delta['score_sum']
+    if delta['score_max'] is not None and (stat.score_max is None or delta['score_max'] > float(stat.score_max)):
+        stat.score_max = delta['score_max']
+    # a delta whose results were all successes extends the run; otherwise its
+    # trailing successes start a new one
+    if delta['success_run'] == delta['total']:
+        stat.success_run = (stat.success_run or 0) + delta['success_run']
+    else:
+        stat.success_run = delta['success_run']
+    if delta['last_played_on'] is not None:
+        stat.last_played_on = delta['last_played_on']
+
+
+def combine_stat_deltas(deltas):
+    """Merge result_stat_delta()s given in result order into one delta per
+    user_stats key, so a batch costs one upsert per key."""
+    merged = {}
+    for delta in deltas:
+        key = (delta['mode'], delta['challenge_type'])
+        acc = merged.get(key)
+        if acc is None:
+            merged[key] = dict(delta)
+            continue
+        for col in ('total', 'correct', 'incorrect', 'successes', 'completed', 'scored', 'score_sum'):
+            acc[col] += delta[col]
+        if delta['score_max'] is not None and (acc['score_max'] is None or delta['score_max'] > acc['score_max']):
+            acc['score_max'] = delta['score_max']
+        acc['success_run'] = acc['success_run'] + 1 if delta['success_run'] else 0
+        if delta['last_played_on'] is not None and (
+                acc['last_played_on'] is None or delta['last_played_on'] > acc['last_played_on']):
+            acc['last_played_on'] = delta['last_played_on']
+    return list(merged.values())
+
+
+def upsert_insert(model):
+    """Dialect INSERT that supports ON CONFLICT DO UPDATE, or None if the
+    current dialect has no upsert (callers fall back to read-modify-write)."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as _insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as _insert
+    else:
+        return None
+    return _insert(model.__table__)
+
+
+def apply_stat_delta(delta):
+    """Add a (possibly combined) delta to its rollup row inside the caller's transaction."""
+    stmt = upsert_insert(UserStat)
+    if stmt is None:
+        stat = UserStat.query.filter_by(
+            user_id=delta['user_id'], mode=delta['mode'], challenge_type=delta['challenge_type']
+        ).first()
+        if stat is None:
+            db.session.add(UserStat(**delta))
+        else:
+            merge_stat_delta(stat, delta)
+        return
 
-    outcome = (body.get('outcome') or '').strip().lower() or None
-    if outcome not in CANONICAL_OUTCOMES:
-        return jsonify({'error': 'invalid_outcome'}), 400
+    t = UserStat.__table__.c
+    ex = stmt.excluded
+    stmt = stmt.values(**delta).on_conflict_do_update(
+        index_elements=['user_id', 'mode', 'challenge_type'],
+        set_={
+            'total': t.total + ex.total,
+            'correct': t.correct + ex.correct,
+            'incorrect': t.incorrect + ex.incorrect,
+            'successes': t.successes + ex.successes,
+            'completed': t.completed + ex.completed,
+            'scored': t.scored + ex.scored,
+            'score_sum': t.score_sum + ex.score_sum,
+            'score_max': case(
+                (t.score_max.is_(None), ex.score_max),
+                (ex.score_max > t.score_max, ex.score_max),
+                else_=t.score_max,
+            ),
+            'success_run': case((ex.success_run == ex.total, t.success_run + ex.success_run),
+                                else_=ex.success_run),
+            'last_played_on': ex.last_played_on,
+            'updated_at': func.now(),
+        },
+    )
+    db.session.execute(stmt)
+
+
+def record_daily_activity(user_id, day, xp, games=1, games_by_mode=None, wins_by_mode=None,
+                          zone=datetime.timezone.utc):
+    """Add results' XP, game count and per-mode quest counts to the user's
+    bucket for local `day` in `zone` (caller commits). Returns the day's quest counters
+    (before, after) this write; `before` is None when the bucket predates
+    quest_json and had to be recounted from game_results.
+
+    The quest counters are read-modify-write, so the row is read FOR UPDATE
+    (a no-op on SQLite, whose writers are serialized anyway)."""
+    games_by_mode = games_by_mode or {}
+    wins_by_mode = wins_by_mode or {}
+    prev = db.session.query(DailyActivity.games, DailyActivity.quest_json).filter_by(
+        user_id=user_id, day=day).with_for_update().first()
+    if prev is not None and prev.quest_json is None and prev.games:
+        # This batch's game_results rows are already flushed, so the recount includes them
+        before, after = None, quest_counters_for_day(user_id, day, zone)
+    else:
+        before = quest_counters_from_json(prev.quest_json if prev else None, prev.games if prev else 0)
+        after = add_quest_plays(before, games_by_mode, wins_by_mode)
+    quest_json = {'games': after['games_by_mode'], 'wins': after['wins_by_mode']}
+
+    stmt = upsert_insert(DailyActivity)
+    if stmt is None:
+        bucket = DailyActivity.query.filter_by(user_id=user_id, day=day).first()
+        if bucket is None:
+            db.session.add(DailyActivity(user_id=user_id, day=day, xp=xp, games=games, quest_json=quest_json))
+        else:
+            bucket.xp += xp
+            bucket.games += games
+            bucket.quest_json = quest_json
+        return before, after
+    t = DailyActivity.__table__.c
+    db.session.execute(stmt.values(
+        user_id=user_id, day=day, xp=xp, games=games, quest_json=quest_json,
+    ).on_conflict_do_update(
+        index_elements=['user_id', 'day'],
+        set_={'xp': t.xp + stmt.excluded.xp, 'games': t.games + stmt.excluded.games,
+              'quest_json': stmt.excluded.quest_json},
+    ))
+    return before, after
+
+
+def _details_json_columns():
+    """SQL expressions extracting details_json.challenge_type and the JSON type
+    of details_json.correct ('true'/'false' for booleans), or None when the
+    dialect has no JSON path support. SQLAlchemy renders the path lookups as
+    json_extract() on SQLite and ->> / -> on Postgres."""
+    dialect = db.session.get_bind().dialect.name
+    col = GameResult.details_json
+    if dialect == 'sqlite':
+        # json_extract returns a number for a numeric challenge_type; client data, so cast
+        return cast(col['challenge_type'].as_string(), String), func.json_type(col, '$.correct')
+    if dialect == 'postgresql':
+        return col['challenge_type'].as_string(), case(
+            (func.json_typeof(col['correct']) == 'boolean', col['correct'].as_string()),
+        )
+    return None
+
+
+def _grouped_details(ctype, correct_type):
+    """Rebuild the minimal details dict classify_result() needs from extracted columns."""
+    det = {'challenge_type': ctype}
+    if correct_type in ('true', 'false'):
+        det['correct'] = correct_type == 'true'
+    return det
+
+
+def aggregate_user_stats(user_id, batch_size=2000):
+    """Compute a user's user_stats rows (transient, not added to the session)
+    from game_results.
+
+    On SQLite/Postgres the counts are a GROUP BY over JSON-extracted
+    challenge_type/correct, so details_json blobs never leave the database; the
+    current success run comes from a newest-first scan of narrow rows that stops
+    as soon as every key has seen a non-success. Other dialects stream full rows
+    with yield_per and fold them in Python. Memory stays proportional to the
+    number of (mode, challenge) keys either way."""
+    extracted = _details_json_columns()
+    if extracted is None:
+        stats = {}
+        rows = db.session.query(
+            GameResult.mode, GameResult.game_name, GameResult.outcome,
+            GameResult.score, GameResult.details_json, GameResult.played_at,
+        ).filter(GameResult.user_id == user_id).order_by(GameResult.id).execution_options(yield_per=batch_size)
+        for mode, game_name, outcome, score, details, played_at in rows:
+            delta = result_stat_delta(user_id, mode, game_name, outcome, score, details,
+                                      played_at.date() if played_at else None)
+            key = (delta['mode'], delta['challenge_type'])
+            if key in stats:
+                merge_stat_delta(stats[key], delta)
+            else:
+                stats[key] = UserStat(**delta)
+        return list(stats.values())
+
+    ctype_col, correct_col = extracted
+    groups = db.session.query(
+        GameResult.mode, GameResult.game_name, GameResult.outcome, ctype_col, correct_col,
+        func.count(GameResult.id), func.count(GameResult.score),
+        func.sum(GameResult.score), func.max(GameResult.score), func.max(GameResult.played_at),
+    ).filter(GameResult.user_id == user_id).group_by(
+        GameResult.mode, GameResult.game_name, GameResult.outcome, ctype_col, correct_col,
+    ).all()
 
-    # Validate and clamp score
-    score = body.get('score')
-    if score is not None:
-        try:
-            score = float(score)
-            if not math.isfinite(score):
-                raise ValueError
-        except (TypeError, ValueError):
-            return jsonify({'error': 'invalid_score'}), 400
-        score = max(0.0, min(score, MODE_MAX_SCORE.get(mode, DEFAULT_MAX_SCORE)))
+    stats = {}
+    for mode, game_name, outcome, ctype, corr_type, n, scored, score_sum, score_max, last_at in groups:
+        delta = result_stat_delta(user_id, mode, game_name, outcome, None,
+                                  _grouped_details(ctype, corr_type), None)
+        key = (delta['mode'], delta['challenge_type'])
+        stat = stats.get(key)
+        if stat is None:
+            stat = stats[key] = UserStat(user_id=user_id, mode=key[0], challenge_type=key[1],
+                                         total=0, correct=0, incorrect=0, successes=0, completed=0,
+                                         scored=0, score_sum=0, score_max=None, success_run=0)
+        for col in ('total', 'correct', 'incorrect', 'successes', 'completed'):
+            setattr(stat, col, getattr(stat, col) + delta[col] * int(n))
+        stat.scored += int(scored or 0)
+        stat.score_sum = float(stat.score_sum) + float(score_sum or 0)
+        if score_max is not None and (stat.score_max is None or float(score_max) > float(stat.score_max)):
+            stat.score_max = float(score_max)
+        last_on = last_at.date() if last_at else None
+        if last_on is not None and (stat.last_played_on is None or last_on > stat.last_played_on):
+            stat.last_played_on = last_on
+
+    # Current success run per key: walk newest-first until each key breaks
+    open_keys = set(stats)
+    tail = db.session.query(
+        GameResult.mode, GameResult.game_name, GameResult.outcome, ctype_col,
+    ).filter(GameResult.user_id == user_id).order_by(GameResult.id.desc()).execution_options(yield_per=batch_size)
+    for mode, game_name, outcome, ctype in tail:
+        if not open_keys:
+            break
+        _, key_ctype, _ = classify_result(mode, game_name, outcome, {'challenge_type': ctype})
+        key = (canonicalize_mode(mode), key_ctype)
+        if key not in open_keys:
+            continue
+        if outcome in SUCCESS_OUTCOMES:
+            stats[key].success_run += 1
+        else:
+            open_keys.discard(key)
+    return list(stats.values())
+
+
+def rebuild_user_stats(user_id):
+    """Replace a user's user_stats rows with a fresh aggregate of their
+    game_results. Returns the new rows; caller commits."""
+    UserStat.query.filter_by(user_id=user_id).delete(synchronize_session=False)
+    stats = aggregate_user_stats(user_id)
+    db.session.add_all(stats)
+    return stats
+
+
+@app.cli.command('backfill-user-stats')
+@click.option('--all', 'rebuild_all', is_flag=True,
+              help='Rebuild every user, not only users who have results but no user_stats rows yet.')
+def backfill_user_stats_command(rebuild_all):
+    """Build the user_stats rollup from existing game_results history."""
+    q = db.session.query(GameResult.user_id).distinct()
+    if not rebuild_all:
+        q = q.filter(~exists().where(UserStat.user_id == GameResult.user_id))
+    user_ids = [r[0] for r in q.all()]
+    keys = 0
+    for uid in user_ids:
+        keys += len(rebuild_user_stats(uid))
+        db.session.commit()
+    click.echo(f'user_stats: rebuilt {len(user_ids)} users ({keys} rows)')
+
+
+def _with_user_zones(rows, zones):
+    """Yield result rows (user_id first) after filling `zones` {user_id: tzinfo}
+    for every user in each fetched chunk, one user_timezones query per chunk."""
+    for chunk in rows.partitions():
+        new = {row[0] for row in chunk} - zones.keys()
+        found = user_timezones(list(new))
+        zones.update((uid, zone_for(found.get(uid))) for uid in new)
+        yield from chunk
+
+
+def rebuild_daily_activity(start=None, end=None, rebuild_all=False):
+    """Rebuild daily_activity XP and quest buckets for local days in
+    [start, end) (either open) from game_results, in each user's class-local
+    days. Only fills (user, day) buckets that have no row unless `rebuild_all`.
+    Returns how many buckets were written; caller commits.
+
+    With `rebuild_all` the old rows are deleted before game_results is read:
+    on Postgres a concurrent record_daily_activity then waits on the deleted
+    rows and adds its delta after this commits, instead of being overwritten
+    by a scan that missed its result."""
+    existing = DailyActivity.query
+    if start is not None:
+        existing = existing.filter(DailyActivity.day >= start)
+    if end is not None:
+        existing = existing.filter(DailyActivity.day < end)
+    if rebuild_all:
+        existing.delete(synchronize_session=False)
+    q = db.session.query(
+        GameResult.user_id, GameResult.played_at, GameResult.mode, GameResult.outcome, GameResult.score,
+    )
+    # a day wider on each side: local days east/west of UTC straddle UTC midnight
+    if start is not None:
+        q = q.filter(GameResult.played_at >= utc_day_range(start - datetime.timedelta(days=1))[0])
+    if end is not None:
+        q = q.filter(GameResult.played_at < utc_day_range(end)[1])
+    zones = {}
+    buckets = defaultdict(lambda: [0, 0, defaultdict(int), defaultdict(int)])
+    rows = db.session.execute(q.statement, execution_options={'yield_per': 5000})
+    for uid, played_at, mode, outcome, score in _with_user_zones(rows, zones):
+        if played_at.tzinfo is None:  # SQLite returns naive UTC
+            played_at = played_at.replace(tzinfo=datetime.timezone.utc)
+        day = played_at.astimezone(zones[uid]).date()
+        if (start is not None and day < start) or (end is not None and day >= end):
+            continue
+        b = buckets[(uid, day)]
+        b[0] += compute_xp_earned(outcome, score)
+        b[1] += 1
+        mode = canonicalize_mode(mode)
+        b[2][mode] += 1
+        if outcome in SUCCESS_OUTCOMES:
+            b[3][mode] += 1
+    if not rebuild_all:
+        # rows record_result already wrote are live counters; leave them alone
+        for key in existing.with_entities(DailyActivity.user_id, DailyActivity.day):
+            buckets.pop(tuple(key), None)
+    db.session.add_all(DailyActivity(user_id=uid, day=day, xp=xp, games=n,
+                                     quest_json={'games': dict(played), 'wins': dict(won)})
+                       for (uid, day), (xp, n, played, won) in buckets.items())
+    return len(buckets)
+
+
+@app.cli.command('backfill-daily-activity')
+@click.option('--days', default=7, show_default=True, help='How many recent days to rebuild.')
+@click.option('--all', 'rebuild_all', is_flag=True,
+              help='Overwrite existing rows too, not only fill (user, day) buckets that have none.')
+def backfill_daily_activity_command(days, rebuild_all):
+    """Rebuild daily_activity XP and quest buckets for recent days from game_results,
+    in each user's class-local days."""
+    start = utc_today() - datetime.timedelta(days=days - 1)
+    rebuilt = rebuild_daily_activity(start, rebuild_all=rebuild_all)
+    db.session.commit()
+    click.echo(f'daily_activity: rebuilt {rebuilt} buckets since {start.isoformat()}')
+
+
+@app.cli.command('backfill-streaks')
+@click.option('--all', 'rebuild_all', is_flag=True, help='Rebuild every user, not just those never backfilled.')
+def backfill_streaks_command(rebuild_all):
+    """Rebuild persisted streaks and activity calendars from game_results."""
+    q = User.query.filter(exists().where(GameResult.user_id == User.id))
+    if not rebuild_all:
+        q = q.filter(User.last_active_date.is_(None))
+    users = q.all()
+    zones = user_timezones([int(u.id) for u in users])
+    for i in range(0, len(users), 500):
+        rebuild_users_activity(users[i:i + 500], zones)
+        db.session.commit()
+    click.echo(f'streaks: rebuilt {len(users)} users')
 
-    duration_ms = body.get('duration_ms')
-    if duration_ms is not None:
-        try:
-            duration_ms = max(0, min(int(duration_ms), 24 * 60 * 60 * 1000))
-        except (TypeError, ValueError):
-            duration_ms = None
 
-    room_pin = body.get('room_pin')
-    if room_pin is not None:
-        room_pin = str(room_pin)[:32]
+# ---- Monthly partitions and retention ----
+# game_results and events are range-partitioned by month on Postgres (migration
+# a4e9c2f17d35): day and week filters through played_between() only touch the
+# partitions they span, and old months are detached or dropped whole. SQLite
+# has no partitioning, so apply_retention() moves old months out of the live
+# table into per-month tables in a separate archive database file. Either way
+# the live tables, and the vacuum and backup work they cause, stay bounded by
+# the retention window. Rebuilds from history only see retained rows
+# afterwards: backfill-user-stats --all undercounts, and recompute-mastery
+# --apply keeps the stored snapshot of any pair missing evidence.
 
-    activity_id = body.get('activity_id')
+PARTITIONED_TABLES = {'game_results': 'played_at', 'events': 'timestamp'}
+PARTITION_MONTHS_AHEAD = 3
+RETENTION_MONTHS = int(os.environ.get('RETENTION_MONTHS', '12'))
+RETENTION_ARCHIVE_PATH = os.environ.get('RETENTION_ARCHIVE_PATH') or os.path.join(app.instance_path, 'archive.db')
 
-    details_json = body.get('details_json') or body.get('details')
-    if details_json is not None:
-        try:
-            import json as _json_mod
-            if len(_json_mod.dumps(details_json)) > MAX_DETAILS_BYTES:
-                details_json = None  # silently drop oversized payloads
-        except (TypeError, ValueError):
-            details_json = None
 
-    # Stamp rate limit AFTER validation passes so failed payloads don't lock the user out
-    _last_result_at[g.user_id] = now_ts
+def add_months(month, n):
+    """First day of the month `n` months after `month`'s (negative goes back)."""
+    index = month.year * 12 + month.month - 1 + n
+    return datetime.date(index // 12, index % 12 + 1, 1)
 
-    r = GameResult(
-        user_id=g.user_id,
-        mode=mode,
-        game_name=game_name,
-        outcome=outcome,
-        score=score,
-        duration_ms=duration_ms,
-        room_pin=room_pin,
-        activity_id=activity_id,
-        details_json=details_json,
+
+def partition_name(table, month):
+    return f'{table}_y{month.year}m{month.month:02d}'
+
+
+def _partition_month(table, name):
+    """The month a partition_name() refers to, or None for any other name."""
+    prefix = table + '_y'
+    if not name.startswith(prefix):
+        return None
+    try:
+        year, month = name[len(prefix):].split('m')
+        return datetime.date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def is_partitioned(table):
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return False
+    return db.session.execute(text(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t)'), {'t': table}).first() is not None
+
+
+def _pg_partitions(table):
+    """{month: name} for the monthly partitions attached to `table`."""
+    names = db.session.execute(text(
+        'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+        'WHERE i.inhparent = to_regclass(:t)'), {'t': table}).scalars()
+    out = {}
+    for name in names:
+        month = _partition_month(table, name)
+        if month is not None:
+            out[month] = name
+    return out
+
+
+def _month_bounds(month):
+    return f"'{month.isoformat()} 00:00:00+00'", f"'{add_months(month, 1).isoformat()} 00:00:00+00'"
+
+
+def _default_partition_months(table):
+    """Months with rows in `table`'s default partition, or None if it has none."""
+    default = f'{table}_default'
+    if db.session.execute(text('SELECT to_regclass(:t)'), {'t': default}).scalar() is None:
+        return None
+    key = PARTITIONED_TABLES[table]
+    return {m.date() for m in db.session.execute(text(
+        f'SELECT DISTINCT date_trunc(\'month\', "{key}" AT TIME ZONE \'UTC\') FROM {default}')).scalars()}
+
+
+def _create_partition(table, month, has_default):
+    """Create `table`'s partition for `month` in the caller's transaction.
+    Postgres refuses to add a partition while the default partition holds
+    rows in its range, so with a default partition the month's rows are
+    first moved out of it into a standalone table that is then attached."""
+    name = partition_name(table, month)
+    start, end = _month_bounds(month)
+    if not has_default:
+        db.session.execute(text(f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM ({start}) TO ({end})'))
+        return
+    key = PARTITIONED_TABLES[table]
+    default = f'{table}_default'
+    in_month = f'"{key}" >= {start} AND "{key}" < {end}'
+    db.session.execute(text(f'LOCK TABLE {default} IN EXCLUSIVE MODE'))  # writes wait; reads go on
+    db.session.execute(text(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+    db.session.execute(text(f'INSERT INTO {name} SELECT * FROM {default} WHERE {in_month}'))
+    db.session.execute(text(f'DELETE FROM {default} WHERE {in_month}'))
+    db.session.execute(text(f'ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})'))
+
+
+def ensure_partitions(months_ahead=PARTITION_MONTHS_AHEAD, today=None):
+    """Create missing monthly partitions from the current month through
+    `months_ahead` months out, plus any month whose rows fell into the default
+    partition because its partition didn't exist yet (those rows move into
+    the new partition). Postgres only; returns the names created."""
+    this_month = (today or utc_today()).replace(day=1)
+    created = []
+    for table in PARTITIONED_TABLES:
+        if not is_partitioned(table):
+            continue
+        existing = _pg_partitions(table)
+        in_default = _default_partition_months(table)
+        wanted = {add_months(this_month, n) for n in range(months_ahead + 1)} | (in_default or set())
+        for start in sorted(wanted):
+            if start in existing:
+                continue
+            _create_partition(table, start, in_default is not None)
+            db.session.commit()  # one month per transaction keeps the default partition's lock short
+            created.append(partition_name(table, start))
+    db.session.commit()
+    return created
+
+
+# Deploys run ensure-partitions, but months can pass without one, so the
+# render.yaml cron job (or any scheduler) runs it daily as well. Request paths
+# never do: creating a partition takes locks and DDL that don't belong in a
+# result submission. Rows for a month nobody created land in the default
+# partition until the next run moves them out.
+
+
+def _played_before(column, day):
+    dialect_name = db.session.get_bind().dialect.name
+    if dialect_name == 'sqlite':
+        column = type_coerce(column, String)
+    return column < _timestamp_bound(day, dialect_name)
+
+
+def roll_up_before_retention(cutoff):
+    """Bring the incrementally maintained rollups (user_stats, total_xp,
+    persisted streaks, daily_activity buckets) up to date for results played
+    before `cutoff`, so nothing they summarize is lost when those rows leave
+    game_results. Returns (users rebuilt, daily_activity buckets filled)."""
+    users = User.query.filter(exists().where(
+        GameResult.user_id == User.id, _played_before(GameResult.played_at, cutoff),
+    )).filter(or_(
+        ~exists().where(UserStat.user_id == User.id),
+        User.total_xp.is_(None),
+        User.last_active_date.is_(None),
+    )).all()
+    zones = user_timezones([int(u.id) for u in users])
+    for user in users:
+        if not UserStat.query.filter_by(user_id=user.id).first():
+            rebuild_user_stats(user.id)
+        if user.total_xp is None:
+            user.total_xp = _recompute_total_xp(user.id)
+        if user.last_active_date is None:
+            rebuild_user_activity(user, zones.get(int(user.id)))
+        db.session.commit()
+    buckets = rebuild_daily_activity(end=cutoff)
+    db.session.commit()
+    return len(users), buckets
+
+
+def _archive_table(table, month, schema=None):
+    """Column-for-column copy of `table` for one archived month (no indexes or
+    foreign keys: archives are read in bulk, not probed)."""
+    return db.Table(
+        partition_name(table.name, month), db.MetaData(),
+        *[db.Column(c.name, c.type, primary_key=c.primary_key, autoincrement=False) for c in table.columns],
+        schema=schema,
     )
-    db.session.add(r)
 
-    # Award coins
+
+def apply_retention(table_name, cutoff, mode='archive'):
+    """Take rows of `table_name` from months before `cutoff` out of the live table.
+
+    Partitioned Postgres tables detach ('archive': the partition stays as a
+    standalone table to dump and drop later) or drop whole partitions.
+    Otherwise rows move one month per transaction into per-month tables
+    ('archive'; on SQLite inside the RETENTION_ARCHIVE_PATH database) or are
+    deleted ('drop'). Returns [(month, rows or None for whole partitions)]."""
+    done = []
+    if is_partitioned(table_name):
+        for month, name in sorted(_pg_partitions(table_name).items()):
+            if add_months(month, 1) > cutoff:
+                continue
+            if mode == 'archive':
+                db.session.execute(text(f'ALTER TABLE {table_name} DETACH PARTITION {name}'))
+            else:
+                db.session.execute(text(f'DROP TABLE {name}'))
+            db.session.commit()
+            done.append((month, None))
+        return done
+
+    table = db.metadata.tables[table_name]
+    column = table.c[PARTITIONED_TABLES[table_name]]
+    dialect_name = db.engine.dialect.name
+    sqlite = dialect_name == 'sqlite'
+    bounded = type_coerce(column, String) if sqlite else column
+    cutoff_bound = _timestamp_bound(cutoff, dialect_name)
+    db.session.commit()
+    with db.engine.connect() as conn:
+        if sqlite and mode == 'archive':
+            # must precede the first statement: SQLite can't ATTACH inside a transaction
+            conn.exec_driver_sql('ATTACH DATABASE ? AS archive', (RETENTION_ARCHIVE_PATH,))
+        try:
+            while True:
+                # each pass empties the oldest remaining month, so this jumps over gaps
+                oldest = conn.execute(select(func.min(column)).where(bounded < cutoff_bound)).scalar()
+                if oldest is None:
+                    break
+                if isinstance(oldest, str):
+                    oldest = datetime.datetime.fromisoformat(oldest)
+                month = oldest.date().replace(day=1)
+                end = add_months(month, 1)
+                in_month = and_(bounded >= _timestamp_bound(month, dialect_name),
+                                bounded < _timestamp_bound(min(end, cutoff), dialect_name))
+                if mode == 'archive':
+                    archive = _archive_table(table, month, schema='archive' if sqlite else None)
+                    archive.create(conn, checkfirst=True)
+                    conn.execute(archive.insert().from_select(
+                        [c.name for c in table.columns], select(*table.columns).where(in_month)))
+                moved = conn.execute(table.delete().where(in_month)).rowcount
+                conn.commit()
+                done.append((month, moved))
+        finally:
+            if sqlite and mode == 'archive':
+                conn.rollback()
+                conn.exec_driver_sql('DETACH DATABASE archive')
+    return done
+
+
+@app.cli.command('ensure-partitions')
+@click.option('--ahead', default=PARTITION_MONTHS_AHEAD, show_default=True,
+              help='Months past the current one to pre-create.')
+def ensure_partitions_command(ahead):
+    """Create upcoming monthly partitions for game_results and events (Postgres)."""
+    created = ensure_partitions(ahead)
+    click.echo(f'partitions: created {len(created)}' + (f" ({', '.join(created)})" if created else ''))
+
+
+@app.cli.command('apply-retention')
+@click.option('--keep-months', default=RETENTION_MONTHS, show_default=True,
+              help='Months of raw rows to keep live, counting the current one.')
+@click.option('--mode', type=click.Choice(['archive', 'drop']), default='archive', show_default=True)
+@click.option('--table', 'tables', multiple=True, type=click.Choice(list(PARTITIONED_TABLES)),
+              help='Limit to these tables (default: all).')
+def apply_retention_command(keep_months, mode, tables):
+    """Roll old raw rows into the per-user rollups, then archive or drop them."""
+    cutoff = add_months(utc_today(), -(max(1, keep_months) - 1))
+    ensure_partitions()
+    users, buckets = roll_up_before_retention(cutoff)
+    click.echo(f'retention: rollups rebuilt for {users} users, {buckets} daily_activity buckets filled')
+    for table_name in tables or PARTITIONED_TABLES:
+        done = apply_retention(table_name, cutoff, mode)
+        verb = 'archived' if mode == 'archive' else 'dropped'
+        rows = sum(n for _, n in done if n is not None)
+        click.echo(f'retention: {table_name} {verb} {len(done)} months before {cutoff.isoformat()} ({rows} rows)')
+
+
+# ---- Mastery replay ----
+# The mastery model is a recurrence over each (user, skill)'s results in play
+# order. replay_mastery() evaluates it for every pair at once: events are
+# grouped into per-pair sequences and step k advances every sequence that has
+# a k-th event in one vectorized NumPy operation, so the Python loop runs
+# (longest sequence) times instead of once per result. Because mastery_step()
+# rounds to 3 decimals, each step is a lookup in a 1001-entry transition table
+# built from mastery_step() itself, which keeps the replay bit-for-bit equal to
+# the online updates.
+
+def _mastery_history(batch_size=20000):
+    """Yield (user_id, result id, mode, challenge_type, ratio_mode, correct, outcome)
+    for every result in id order, extracting only the details_json fields the
+    standards mapping reads. Runs on the Core connection: ORM row processing
+    would cost more than the replay itself."""
+    conn = db.session.connection()
+    extracted = _details_json_columns()
+    if extracted is None:
+        rows = conn.execute(select(
+            GameResult.user_id, GameResult.id, GameResult.mode,
+            GameResult.outcome, GameResult.details_json,
+        ).order_by(GameResult.id).execution_options(yield_per=batch_size))
+        for uid, result_id, mode, outcome, det in rows:
+            det = det if isinstance(det, dict) else {}
+            correct = det.get('correct')
+            yield (uid, result_id, mode, det.get('challenge_type', ''), det.get('ratio_mode', ''),
+                   correct if isinstance(correct, bool) else None, outcome)
+        return
+    ctype_col, correct_col = extracted
+    rows = conn.execute(select(
+        GameResult.user_id, GameResult.id, GameResult.mode, ctype_col,
+        GameResult.details_json['ratio_mode'].as_string(), correct_col, GameResult.outcome,
+    ).order_by(GameResult.id).execution_options(yield_per=batch_size))
+    for uid, result_id, mode, ctype, ratio_mode, corr_type, outcome in rows:
+        correct = corr_type == 'true' if corr_type in ('true', 'false') else None
+        yield uid, result_id, mode, ctype or '', ratio_mode or '', correct, outcome
+
+
+def replay_mastery(learn_rate=MASTERY_LEARN_RATE, slip_rate=MASTERY_SLIP_RATE, prior=MASTERY_PRIOR):
+    """Recompute every MasterySnapshot from the full game_results history under
+    the given parameters, exactly as update_mastery_for_results would have
+    built them one result at a time. Returns {(user_id, skill_id): (mastery_prob,
+    se, opportunities, last_evidence_at)}; nothing is written."""
+    import numpy as np
+
+    ensure_standards_seed()
+    # Results collapse to a few shapes (mode, challenge, correctness); each shape
+    # maps to the skill ids it practices, so rows only store a shape index.
+    shapes = {}
+    shape_skills, shape_correct = [], []
+    uids, shape_of, result_ids = [], [], []
+    for uid, result_id, mode, ctype, ratio_mode, correct, outcome in _mastery_history():
+        key = (mode, ctype, ratio_mode, correct, outcome)
+        shape = shapes.get(key)
+        if shape is None:
+            shape = -1
+            is_correct = correct is True or outcome in SUCCESS_OUTCOMES
+            if is_correct or correct is False or (outcome or '').lower() in INCORRECT_OUTCOMES:
+                det = {'challenge_type': ctype, 'ratio_mode': ratio_mode}
+                skill_ids = [sid for sid in (get_standard_skill_id(code) for code in
+                             resolve_standards_for_result(canonicalize_mode(mode), det)) if sid]
+                if skill_ids:
+                    shape = len(shape_skills)
+                    shape_skills.append(skill_ids)
+                    shape_correct.append(is_correct)
+            shapes[key] = shape
+        if shape >= 0:
+            uids.append(uid)
+            shape_of.append(shape)
+            result_ids.append(result_id)
+    if not uids:
+        return {}
+
+    # Expand each result into one event per practiced skill
+    shape_of = np.asarray(shape_of, dtype=np.int64)
+    lengths = np.array([len(ids) for ids in shape_skills], dtype=np.int64)
+    flat_skills = np.concatenate([np.asarray(ids, dtype=np.int64) for ids in shape_skills])
+    per_row = lengths[shape_of]
+    row = np.repeat(np.arange(len(shape_of)), per_row)
+    within = np.arange(len(row)) - np.repeat(np.cumsum(per_row) - per_row, per_row)
+    skills = flat_skills[(np.cumsum(lengths) - lengths)[shape_of[row]] + within]
+    users = np.asarray(uids, dtype=np.int64)[row]
+    flags = np.asarray(shape_correct, dtype=np.int64)[shape_of[row]]
+
+    # Group events by (user, skill); the stable sort keeps play order within a group
+    keys, group = np.unique(users * (int(skills.max()) + 1) + skills, return_inverse=True)
+    order = np.argsort(group, kind='stable')
+    group, flags, row = group[order], flags[order], row[order]
+    counts = np.bincount(group)
+    starts = np.cumsum(counts) - counts
+    step = np.arange(len(group)) - starts[group]
+
+    # Mastery in thousandths: the first event starts from the prior, every later
+    # one is a table lookup on (correct, current value)
+    first = np.array([round(mastery_step(prior, c, learn_rate, slip_rate) * 1000) for c in (False, True)])
+    table = np.array([[round(mastery_step(m / 1000, c, learn_rate, slip_rate) * 1000) for m in range(1001)]
+                      for c in (False, True)])
+    state = first[flags[starts]]
+    by_step = np.argsort(step, kind='stable')
+    bounds = np.cumsum(np.bincount(step))
+    for k in range(1, len(bounds)):
+        idx = by_step[bounds[k - 1]:bounds[k]]
+        g = group[idx]
+        state[g] = table[flags[idx], state[g]]
+
+    # last_evidence_at: played_at of each pair's final result, one IN query per chunk
+    last_ids = np.asarray(result_ids, dtype=np.int64)[row[starts + counts - 1]].tolist()
+    wanted = sorted(set(last_ids))
+    played = {}
+    for i in range(0, len(wanted), 5000):
+        played.update(db.session.query(GameResult.id, GameResult.played_at).filter(
+            GameResult.id.in_(wanted[i:i + 5000])).all())
+    se_of = {}
+    key_users = users[order][starts].tolist()
+    key_skills = skills[order][starts].tolist()
+    state, counts = state.tolist(), counts.tolist()
+    out = {}
+    for i in range(len(keys)):
+        n = counts[i]
+        if n not in se_of:
+            se_of[n] = mastery_se(n)
+        out[(key_users[i], key_skills[i])] = (state[i] / 1000, se_of[n], n, played.get(last_ids[i]))
+    return out
+
+
+def _stored_mastery():
+    """{(user_id, skill_id): (snapshot id, mastery_prob, opportunities)} for every stored snapshot."""
+    return {
+        (int(uid), int(sid)): (int(snap_id), float(prob or 0), int(n or 0))
+        for snap_id, uid, sid, prob, n in db.session.query(
+            MasterySnapshot.id, MasterySnapshot.user_id, MasterySnapshot.skill_id,
+            MasterySnapshot.mastery_prob, MasterySnapshot.opportunities)
+    }
+
+
+def incomplete_mastery_pairs(replayed, stored):
+    """Stored pairs whose history the replay didn't fully see: no results left,
+    or fewer opportunities than the snapshot counted (apply-retention archived
+    or dropped the older results). Their stored snapshot is the only record of
+    that evidence, so replays leave them alone."""
+    return {key for key, (_id, _prob, n) in stored.items()
+            if key not in replayed or replayed[key][2] < n}
+
+
+def diff_mastery(replayed, limit=10):
+    """Compare replayed snapshots against the stored ones."""
+    stored = _stored_mastery()
+    current = {key: prob for key, (_id, prob, _n) in stored.items()}
+    incomplete = incomplete_mastery_pairs(replayed, stored)
+    moves = []
+    for key, values in replayed.items():
+        before = current.get(key)
+        if before is not None and key not in incomplete and values[0] != before:
+            moves.append((values[0] - before, key, before, values[0]))
+    moves.sort(key=lambda m: -abs(m[0]))
+    return {
+        'replayed': len(replayed),
+        'stored': len(current),
+        'added': sum(1 for key in replayed if key not in current),
+        'removed': sum(1 for key in current if key not in replayed),
+        'incomplete': len(incomplete),
+        'changed': len(moves),
+        'mean_abs_change': round(sum(abs(m[0]) for m in moves) / len(moves), 4) if moves else 0.0,
+        'mastered_80': (sum(1 for v in current.values() if v >= 0.8),
+                        sum(1 for v in replayed.values() if v[0] >= 0.8)),
+        'top_moves': moves[:limit],
+    }
+
+
+def store_replayed_mastery(replayed, chunk=5000):
+    """Replace stored mastery_snapshots with replayed values, except pairs
+    whose history is incomplete (see incomplete_mastery_pairs), which keep
+    their snapshot. Returns how many were kept. Caller commits."""
+    stored = _stored_mastery()
+    incomplete = incomplete_mastery_pairs(replayed, stored)
+    table = MasterySnapshot.__table__
+    stale_ids = [stored[key][0] for key in replayed if key in stored and key not in incomplete]
+    for i in range(0, len(stale_ids), chunk):
+        db.session.execute(table.delete().where(table.c.id.in_(stale_ids[i:i + chunk])))
+    rows = [
+        {'user_id': uid, 'skill_id': sid, 'mastery_prob': prob, 'se': se,
+         'opportunities': n, 'last_evidence_at': last_at}
+        for (uid, sid), (prob, se, n, last_at) in replayed.items() if (uid, sid) not in incomplete
+    ]
+    for i in range(0, len(rows), chunk):
+        db.session.execute(table.insert(), rows[i:i + chunk])
+    return len(incomplete)
+
+
+@app.cli.command('recompute-mastery')
+@click.option('--learn-rate', default=MASTERY_LEARN_RATE, show_default=True, type=float)
+@click.option('--slip-rate', default=MASTERY_SLIP_RATE, show_default=True, type=float)
+@click.option('--prior', default=MASTERY_PRIOR, show_default=True, type=float)
+@click.option('--top', default=10, show_default=True, help='How many of the largest changes to list.')
+@click.option('--apply', 'apply_changes', is_flag=True, help='Replace stored snapshots (default: report only).')
+def recompute_mastery_command(learn_rate, slip_rate, prior, top, apply_changes):
+    """Replay all game_results under new mastery parameters and diff against stored snapshots."""
+    t0 = time.perf_counter()
+    replayed = replay_mastery(learn_rate, slip_rate, prior)
+    elapsed = time.perf_counter() - t0
+    d = diff_mastery(replayed, top)
+    click.echo(f"mastery: replayed {d['replayed']} snapshots in {elapsed:.2f}s "
+               f"(stored {d['stored']}, +{d['added']} new, {d['removed']} without history, "
+               f"{d['incomplete']} kept: history incomplete)")
+    click.echo(f"mastery: {d['changed']} changed, mean |delta| {d['mean_abs_change']}, "
+               f">=0.8 mastered {d['mastered_80'][0]} -> {d['mastered_80'][1]}")
+    for delta, (uid, sid), before, after in d['top_moves']:
+        click.echo(f'  user {uid} skill {sid}: {before:.3f} -> {after:.3f} ({delta:+.3f})')
+    if apply_changes:
+        kept = store_replayed_mastery(replayed)
+        db.session.commit()
+        click.echo(f'mastery: stored replayed snapshots ({kept} with incomplete history left as they were)')
+
+
+# ---- Columnar export ----
+# export_chunks() streams game_results or events to Parquet, Arrow IPC or CSV
+# for analysts. Rows come off a Core select on a dedicated connection with
+# stream_results (a server-side cursor on Postgres) and are encoded one record
+# batch of EXPORT_BATCH_ROWS at a time, so memory stays at one batch whatever
+# the table size and no ORM objects are built. details_json.challenge_type and
+# .correct are flattened into columns in SQL; the rest of the blob goes out as
+# JSON text. Parquet and Arrow need pyarrow, which is imported lazily; CSV
+# always works.
+
+EXPORT_BATCH_ROWS = int(os.environ.get('EXPORT_BATCH_ROWS', '10000'))
+EXPORT_FORMATS = {
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrows'),
+    'csv': ('text/csv', 'csv'),
+}
+# Output columns and their Arrow kinds, in order
+EXPORT_COLUMNS = {
+    'game_results': [
+        ('id', 'int'), ('user_id', 'int'), ('mode', 'str'), ('game_name', 'str'),
+        ('outcome', 'str'), ('score', 'float'), ('duration_ms', 'int'), ('room_pin', 'str'),
+        ('activity_id', 'int'), ('played_at', 'time'), ('challenge_type', 'str'),
+        ('correct', 'bool'), ('details_json', 'str'),
+    ],
+    'events': [
+        ('id', 'int'), ('user_id', 'int'), ('session_id', 'int'), ('event_type', 'str'),
+        ('activity_id', 'int'), ('skill_id', 'int'), ('room_pin', 'str'), ('role', 'str'),
+        ('timestamp', 'time'), ('duration_ms', 'int'), ('payload_json', 'str'),
+    ],
+}
+
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def export_select(table_name, class_id=None, since=None, until=None):
+    """Core select producing EXPORT_COLUMNS[table_name] in id order. class_id limits
+    rows to that class's members; since/until are inclusive UTC days."""
+    if table_name == 'game_results':
+        t = GameResult
+        extracted = _details_json_columns()
+        ctype_col, correct_col = extracted if extracted else (null(), null())
+        stmt = select(
+            t.id, t.user_id, t.mode, t.game_name, t.outcome, t.score, t.duration_ms, t.room_pin,
+            t.activity_id, t.played_at, ctype_col, correct_col, cast(t.details_json, db.Text),
+        )
+        ts_col = t.played_at
+    else:
+        t = Event
+        stmt = select(
+            t.id, t.user_id, t.session_id, t.event_type, t.activity_id, t.skill_id, t.room_pin,
+            t.role, t.timestamp, t.duration_ms, cast(t.payload_json, db.Text),
+        )
+        ts_col = t.timestamp
+    if class_id is not None:
+        stmt = stmt.where(t.user_id.in_(
+            select(ClassMembership.user_id).where(ClassMembership.class_id == class_id)))
+    if since is not None or until is not None:
+        start = since or datetime.date(1970, 1, 1)
+        end = until + datetime.timedelta(days=1) if until else utc_today() + datetime.timedelta(days=1)
+        stmt = stmt.where(played_between(ts_col, start, end))
+    return stmt.order_by(t.id)
+
+
+def _export_batches(conn, stmt, table_name, batch_size):
+    """Yield each fetched batch as a list of column lists, normalized for encoding."""
+    kinds = [kind for _, kind in EXPORT_COLUMNS[table_name]]
+    flatten_details = table_name == 'game_results' and _details_json_columns() is None
+    result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(stmt)
+    for rows in result.partitions():
+        cols = [list(c) for c in zip(*rows)]
+        if flatten_details:
+            # No JSON path support: pull challenge_type/correct out in Python
+            import json as _json_mod
+            for i, raw in enumerate(cols[12]):
+                det = _json_mod.loads(raw) if raw else None
+                det = det if isinstance(det, dict) else {}
+                cols[10][i] = det.get('challenge_type')
+                cols[11][i] = det['correct'] if isinstance(det.get('correct'), bool) else None
+        for i, kind in enumerate(kinds):
+            if kind == 'float':
+                cols[i] = [None if v is None else float(v) for v in cols[i]]
+            elif kind == 'str':
+                cols[i] = [v if v is None or isinstance(v, str) else str(v) for v in cols[i]]
+            elif kind == 'bool' and not flatten_details:
+                cols[i] = [{'true': True, 'false': False}.get(v) for v in cols[i]]
+        yield cols
+
+
+class _ExportSink:
+    """Write-only file object collecting encoded bytes until drain() hands them on."""
+
+    closed = False
+
+    def __init__(self):
+        self._chunks = []
+        self._pos = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._chunks.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def writable(self):
+        return True
+
+    def drain(self):
+        out = b''.join(self._chunks)
+        self._chunks.clear()
+        return out
+
+
+def _arrow_schema(pa, table_name):
+    types = {'int': pa.int64(), 'str': pa.string(), 'float': pa.float64(),
+             'bool': pa.bool_(), 'time': pa.timestamp('us', tz='UTC')}
+    return pa.schema([(name, types[kind]) for name, kind in EXPORT_COLUMNS[table_name]])
+
+
+def export_chunks(table_name, fmt, class_id=None, since=None, until=None, batch_size=EXPORT_BATCH_ROWS):
+    """Yield the encoded export of `table_name` as bytes, one chunk per record
+    batch (Parquet row group / Arrow record batch / CSV block) plus header and
+    footer. Runs on its own connection so the caller's session is untouched."""
+    stmt = export_select(table_name, class_id, since, until)
+    with db.engine.connect() as conn:
+        batches = _export_batches(conn, stmt, table_name, batch_size)
+        if fmt == 'csv':
+            import csv, io
+            buf = io.StringIO()
+            writer = csv.writer(buf)
+            writer.writerow([name for name, _ in EXPORT_COLUMNS[table_name]])
+            for cols in batches:
+                writer.writerows(zip(*cols))
+                yield buf.getvalue().encode('utf-8')
+                buf.seek(0)
+                buf.truncate()
+            if buf.tell():
+                yield buf.getvalue().encode('utf-8')
+            return
+
+        import pyarrow as pa
+        schema = _arrow_schema(pa, table_name)
+        sink = _ExportSink()
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(sink, schema, compression='zstd')
+        else:
+            writer = pa.ipc.new_stream(sink, schema)
+        for cols in batches:
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(cols, schema)], schema=schema))
+            yield sink.drain()
+        writer.close()
+        yield sink.drain()
+
+
+def _parse_export_day(value):
+    if not value:
+        return None
+    return datetime.date.fromisoformat(value)
+
+
+@app.get('/api/export/<table_name>')
+@require_auth
+def api_export(table_name):
+    """Stream game_results or events as Parquet/Arrow/CSV.
+
+    ?format=parquet|arrow|csv (default parquet, or csv without pyarrow);
+    ?class_id=N limits to one class's students; ?since/?until=YYYY-MM-DD are
+    inclusive UTC days. Teachers may export their own classes; admins anything."""
+    if table_name not in EXPORT_COLUMNS:
+        return jsonify({'error': 'unknown_table'}), 404
+    fmt = (request.args.get('format') or ('parquet' if pyarrow_available() else 'csv')).strip().lower()
+    if fmt not in EXPORT_FORMATS:
+        return jsonify({'error': 'invalid_format'}), 400
+    if fmt != 'csv' and not pyarrow_available():
+        return jsonify({'error': 'format_unavailable'}), 400
+    class_id = request.args.get('class_id')
+    try:
+        class_id = int(class_id) if class_id is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid_class_id'}), 400
+    try:
+        since = _parse_export_day(request.args.get('since'))
+        until = _parse_export_day(request.args.get('until'))
+    except ValueError:
+        return jsonify({'error': 'invalid_date'}), 400
+
+    if not _can_manage_class(g.user_id, g.role, class_id):
+        return jsonify({'error': 'forbidden'}), 403
+    db.session.add(AccessLog(user_id=g.user_id, class_id=class_id, action=f'export_{table_name}_{fmt}'))
+    db.session.commit()
+
+    mimetype, ext = EXPORT_FORMATS[fmt]
+    filename = f"{table_name}{f'_class{class_id}' if class_id is not None else ''}.{ext}"
+    return Response(
+        stream_with_context(export_chunks(table_name, fmt, class_id, since, until)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+
+
+@app.cli.command('export-data')
+@click.argument('table_name', type=click.Choice(list(EXPORT_COLUMNS)))
+@click.argument('out', type=click.Path(dir_okay=False, writable=True))
+@click.option('--format', 'fmt', type=click.Choice(list(EXPORT_FORMATS)), default='parquet', show_default=True)
+@click.option('--class-id', type=int, help='Only rows from this class\'s members.')
+@click.option('--since', type=click.DateTime(['%Y-%m-%d']), help='First UTC day to include.')
+@click.option('--until', type=click.DateTime(['%Y-%m-%d']), help='Last UTC day to include.')
+@click.option('--batch-size', default=EXPORT_BATCH_ROWS, show_default=True, help='Rows per record batch.')
+def export_data_command(table_name, out, fmt, class_id, since, until, batch_size):
+    """Stream game_results or events to a Parquet, Arrow IPC or CSV file."""
+    if fmt != 'csv' and not pyarrow_available():
+        raise click.ClickException(f'{fmt} export needs pyarrow; install it or use --format csv')
+    t0 = time.perf_counter()
+    written = 0
+    with open(out, 'wb') as fh:
+        for chunk in export_chunks(table_name, fmt, class_id, since and since.date(),
+                                   until and until.date(), max(1, batch_size)):
+            fh.write(chunk)
+            written += len(chunk)
+    click.echo(f'export: {table_name} -> {out} ({fmt}, {written} bytes, {time.perf_counter() - t0:.2f}s)')
+
+
+# ---- Achievement evaluation ----
+# Every rule reads from one counters row (see compute_achievement_counters), so a
+# submission costs one query for which candidates are already unlocked plus at
+# most one aggregate query, instead of a COUNT/DISTINCT/ORDER BY per cross-mode
+# code. The candidates themselves come from the cached achievement catalog.
+
+def achievement_rule_kind(ach):
+    """Classify an achievement into the counter it is checked against."""
+    if ach.mode is not None:
+        return 'mode'
+    code = ach.code or ''
+    if code.startswith('explore_'):
+        return 'explore'
+    if code.startswith('total_') or code == 'first_game':
+        return 'total'
+    if code.startswith('streak_'):
+        return 'streak'
+    if code.startswith('accuracy_'):
+        return 'accuracy'
+    if code.startswith('mastery_'):
+        return 'mastery'
+    return None
+
+
+def compute_achievement_counters(user_id, mode, kinds):
+    """Compute every counter the given rule kinds need in a single SELECT.
+
+    Totals come from the user_stats rollup; success_run (across all modes) and
+    the mastery counts are added as scalar subqueries only when requested.
+    """
+    cols = [
+        func.sum(UserStat.total).label('total_games'),
+        func.sum(UserStat.successes).label('successes'),
+        func.sum(UserStat.completed).label('completed'),
+        func.sum(case((UserStat.mode == mode, UserStat.completed), else_=0)).label('completed_mode'),
+        func.count(func.distinct(UserStat.mode)).label('modes_played'),
+    ]
+    if 'streak' in kinds:
+        # Current run of successes = results newer than the last non-success
+        success = list(SUCCESS_OUTCOMES)
+        prior = aliased(GameResult)
+        last_break = db.session.query(func.coalesce(func.max(prior.id), 0)).filter(
+            prior.user_id == user_id,
+            or_(prior.outcome.is_(None), prior.outcome.notin_(success)),
+        ).scalar_subquery()
+        cols.append(db.session.query(func.count(GameResult.id)).filter(
+            GameResult.user_id == user_id,
+            GameResult.id > last_break,
+        ).scalar_subquery().label('success_run'))
+    if 'mastery' in kinds:
+        for label, pct in (('mastery_70', 0.7), ('mastery_80', 0.8)):
+            cols.append(db.session.query(func.count(MasterySnapshot.id)).filter(
+                MasterySnapshot.user_id == user_id,
+                MasterySnapshot.mastery_prob >= pct,
+            ).scalar_subquery().label(label))
+    row = db.session.query(*cols).filter(UserStat.user_id == user_id).one()
+    return {k: int(v or 0) for k, v in row._mapping.items()}
+
+
+def achievement_rule_met(ach, kind, counters):
+    """Check one achievement against precomputed counters (no queries)."""
+    thr = int(ach.threshold)
+    if kind == 'mode':
+        return counters['completed_mode'] >= thr
+    if kind == 'explore':
+        return counters['modes_played'] >= thr
+    if kind == 'total':
+        return counters['completed'] >= thr
+    if kind == 'streak':
+        return counters['success_run'] >= thr
+    if kind == 'accuracy':
+        try:
+            pct = int(ach.code.split('_')[1])
+        except (IndexError, ValueError):
+            return False
+        total = counters['total_games']
+        return total >= thr and (counters['successes'] / total) * 100 >= pct
+    if kind == 'mastery':
+        return (counters['mastery_70'] if thr <= 3 else counters['mastery_80']) >= thr
+    return False
+
+
+def evaluate_achievements(user_id, mode, outcome):
+    """Unlock any achievements the user now qualifies for. Adds UserAchievement
+    rows to the session (caller commits) and returns the newly unlocked list."""
+    # Per-mode tiers only advance on a completed/successful play
+    ref = reference_data.get()
+    candidates = list(ref.cross_mode_achievements)
+    if outcome in SUCCESS_OUTCOMES or outcome is None:
+        candidates += ref.achievements_by_mode.get(mode, ())
+    if not candidates:
+        return []
+    unlocked = {aid for (aid,) in db.session.query(UserAchievement.achievement_id).filter(
+        UserAchievement.user_id == user_id,
+        UserAchievement.achievement_id.in_([a.id for a in candidates]),
+    )}
+
+    rules = [(a, achievement_rule_kind(a)) for a in candidates if a.id not in unlocked]
+    rules = [(a, k) for a, k in rules if k is not None]
+    if not rules:
+        return []
+
+    counters = compute_achievement_counters(user_id, mode, {k for _, k in rules})
+    newly_unlocked = []
+    for a, kind in rules:
+        if achievement_rule_met(a, kind, counters):
+            db.session.add(UserAchievement(user_id=user_id, achievement_id=a.id))
+            newly_unlocked.append({'code': a.code, 'title': a.title, 'threshold': a.threshold, 'name': a.title})
+    return newly_unlocked
+
+
+@app.cli.command('bench-achievements')
+@click.option('--results', 'n_results', default=5000, show_default=True, help='History seeded for the bench user.')
+@click.option('--submissions', default=500, show_default=True, help='evaluate_achievements calls per scenario.')
+def bench_achievements_command(n_results, submissions):
+    """Queries and latency of evaluate_achievements for a user with a long history.
+
+    Seeds a throwaway user inside one transaction that is rolled back at the
+    end, so it is safe against any database, and times two scenarios: nothing
+    unlocked yet, and every achievement already unlocked (rules skipped)."""
+    import random
+    import statistics
+    import uuid
+    rng = random.Random(3)
+    modes = [m for m in DASHBOARD_MODES if reference_data.get().achievements_by_mode.get(m)] or ['plane']
+    outcomes = ['win', 'completed', 'lose', 'incorrect']
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    try:
+        user = User(google_sub=f'bench-achievements-{uuid.uuid4().hex}', role='student')
+        db.session.add(user)
+        db.session.flush()
+        uid = user.id
+        start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=180)
+        db.session.execute(GameResult.__table__.insert(), [{
+            'user_id': uid, 'mode': m, 'game_name': m, 'outcome': rng.choice(outcomes), 'score': rng.randint(0, 100),
+            'played_at': start + datetime.timedelta(minutes=i * 50),
+        } for i, m in ((i, rng.choice(modes)) for i in range(n_results))])
+        rebuild_user_stats(uid)
+        db.session.flush()
+        click.echo(f'bench: user {uid} with {n_results} results, {len(modes)} modes')
+
+        def run(label):
+            timings, queries = [], []
+            for _ in range(submissions):
+                mode, outcome = rng.choice(modes), rng.choice(outcomes)
+                nested = db.session.begin_nested()  # undo this call's unlocks
+                statements.clear()
+                event.listen(db.engine, 'before_cursor_execute', count)
+                try:
+                    t = time.perf_counter()
+                    evaluate_achievements(uid, mode, outcome)
+                    db.session.flush()
+                    timings.append((time.perf_counter() - t) * 1000)
+                finally:
+                    event.remove(db.engine, 'before_cursor_execute', count)
+                reads = sum(1 for st in statements if st.lstrip().upper().startswith('SELECT'))
+                queries.append((reads, sum(1 for st in statements if st.lstrip().upper().startswith('INSERT'))))
+                nested.rollback()
+            timings.sort()
+            p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+            reads = [r for r, _w in queries]
+            click.echo(f'bench: [{label}] {statistics.mean(reads):.2f} SELECTs/submission (max {max(reads)}), '
+                       f'{statistics.mean(w for _r, w in queries):.2f} unlock INSERTs  '
+                       f'p50 {statistics.median(timings):.3f} ms  p95 {p95:.3f} ms')
+
+        run('nothing unlocked')
+        db.session.add_all(UserAchievement(user_id=uid, achievement_id=a.id) for a in reference_data.get().achievements)
+        db.session.flush()
+        run('all unlocked')
+    finally:
+        db.session.rollback()
+
+
+def parse_result_submission(body):
+    """Validate a /api/results payload. Returns (submission, None) with the
+    normalized fields, or (None, error_code)."""
+    mode = canonicalize_mode(body.get('mode'))
+    if mode == 'unknown' or mode not in MODE_SYNONYMS:
+        return None, 'invalid_mode'
+
+    game_name_raw = (body.get('game_name') or mode)
+    game_name = (str(game_name_raw)[:120]).strip() or mode
+
+    outcome = (body.get('outcome') or '').strip().lower() or None
+    if outcome not in CANONICAL_OUTCOMES:
+        return None, 'invalid_outcome'
+
+    # Validate and clamp score
+    score = body.get('score')
+    if score is not None:
+        try:
+            score = float(score)
+            if not math.isfinite(score):
+                raise ValueError
+        except (TypeError, ValueError):
+            return None, 'invalid_score'
+        score = max(0.0, min(score, MODE_MAX_SCORE.get(mode, DEFAULT_MAX_SCORE)))
+
+    duration_ms = body.get('duration_ms')
+    if duration_ms is not None:
+        try:
+            duration_ms = max(0, min(int(duration_ms), 24 * 60 * 60 * 1000))
+        except (TypeError, ValueError):
+            duration_ms = None
+
+    room_pin = body.get('room_pin')
+    if room_pin is not None:
+        room_pin = str(room_pin)[:32]
+
+    activity_id = body.get('activity_id')
+
+    details_json = body.get('details_json') or body.get('details')
+    if details_json is not None:
+        try:
+            import json as _json_mod
+            if len(_json_mod.dumps(details_json)) > MAX_DETAILS_BYTES:
+                details_json = None  # silently drop oversized payloads
+        except (TypeError, ValueError):
+            details_json = None
+
+    return {
+        'mode': mode,
+        'game_name': game_name,
+        'outcome': outcome,
+        'score': score,
+        'duration_ms': duration_ms,
+        'room_pin': room_pin,
+        'activity_id': activity_id,
+        'details_json': details_json,
+    }, None
+
+
+def parse_client_timestamp(value, now):
+    """(aware UTC datetime, None) for an ISO-8601 string or epoch milliseconds,
+    or (None, error_code). Missing means now; future times clamp to now."""
+    if value is None:
+        return now, None
+    try:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            at = datetime.datetime.fromtimestamp(value / 1000, datetime.timezone.utc)
+        else:
+            at = datetime.datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+            if at.tzinfo is None:
+                at = at.replace(tzinfo=datetime.timezone.utc)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return None, 'invalid_played_at'
+    if (now - at).total_seconds() > RESULT_MAX_AGE_SEC:
+        return None, 'stale_result'
+    return min(at.astimezone(datetime.timezone.utc), now), None
+
+
+def take_result_volume(user_id, n, now_ts):
+    """Count `n` results against the user's volume window. Returns 0 when
+    allowed, else the seconds until the window resets (nothing is counted)."""
+    window = _result_volume.get(user_id)
+    if window is None or now_ts - window[0] >= RESULT_VOLUME_WINDOW_SEC:
+        window = _result_volume[user_id] = [now_ts, 0]
+    if window[1] + n > RESULT_VOLUME_MAX:
+        return window[0] + RESULT_VOLUME_WINDOW_SEC - now_ts
+    window[1] += n
+    return 0
+
+
+def result_rewards(outcome, score):
+    """(coins, xp) earned by one result; pure, so queued submissions can answer
+    before anything is written."""
     coins_earned = COINS_PER_GAME
     if outcome in SUCCESS_OUTCOMES:
         coins_earned += COINS_SUCCESS_BONUS
     if score is not None:
         coins_earned += max(0, int(float(score) * COINS_SCORE_FACTOR))
-    # Increment denormalized total_xp (replaces full table scan in compute_xp_and_level)
-    xp_earned = compute_xp_earned(outcome, score)
-    user = User.query.get(g.user_id)
+    return coins_earned, compute_xp_earned(outcome, score)
+
+
+def apply_result(user_id, sub, played_at=None, ingest_key=None):
+    """Write one validated submission: the game_results row, rollups, coins/XP,
+    streak and mastery. Runs inside the caller's transaction (caller commits).
+    `played_at` (aware UTC) defaults to now; queued results pass their
+    submission time so late application doesn't shift them to another day,
+    and their queue `ingest_key` so a replay can be recognized."""
+    if played_at is None:
+        played_at = datetime.datetime.now(datetime.timezone.utc)
+    r = GameResult(user_id=user_id, played_at=played_at, ingest_key=ingest_key, **sub)
+    db.session.add(r)
+    user, coins_earned, _xp, standards_practiced, quests_completed = apply_result_effects(
+        user_id, [(sub, played_at)], received_at=played_at)
+    return r, user, coins_earned, standards_practiced, quests_completed
+
+
+def apply_results(user_id, items, received_at=None, ingest_keys=None):
+    """Write a batch of validated (submission, played_at) pairs, oldest first,
+    with one executemany insert, storing `ingest_keys` (parallel to items, or
+    None) for replay detection. Caller commits; see apply_result_effects()."""
+    keys = ingest_keys or [None] * len(items)
+    db.session.execute(GameResult.__table__.insert(), [
+        dict(sub, user_id=user_id, played_at=played_at, ingest_key=key)
+        for (sub, played_at), key in zip(items, keys)
+    ])
+    return apply_result_effects(user_id, items, received_at)
+
+
+def apply_result_effects(user_id, items, received_at=None):
+    """Fold (submission, played_at) pairs, oldest first, into the user's
+    rollups, coins/XP, streak and mastery with one write per table (per stats
+    key / day). Returns (user, coins_earned, xp_earned, standards practiced,
+    daily quests completed today).
+
+    Daily buckets, quests and the streak are credited to the local day the
+    server received the results (`received_at`, default now), not to the
+    client-reported played_at: offline plays synced in one backdated batch
+    must not build a streak or add XP to days whose leaderboards have closed.
+    game_results keeps the client's played_at."""
+    deltas = combine_stat_deltas([
+        result_stat_delta(user_id, sub['mode'], sub['game_name'], sub['outcome'], sub['score'],
+                          sub['details_json'], played_at.date())
+        for sub, played_at in items
+    ])
+    for delta in deltas:
+        apply_stat_delta(delta)
+
+    # Award coins; increment denormalized total_xp (replaces full table scan in compute_xp_and_level)
+    # Daily buckets, quests and the streak all use the class-local day of receipt
+    tz_name = user_timezones([user_id]).get(user_id)
+    zone = zone_for(tz_name)
+    received_at = received_at or datetime.datetime.now(datetime.timezone.utc)
+    credit_day = received_at.astimezone(zone).date()
+    coins_earned = xp_earned = 0
+    games_by_mode, wins_by_mode = defaultdict(int), defaultdict(int)
+    mastery_results = []
+    for sub, _played_at in items:
+        coins, xp = result_rewards(sub['outcome'], sub['score'])
+        coins_earned += coins
+        xp_earned += xp
+        games_by_mode[sub['mode']] += 1  # sub['mode'] is already canonical
+        if sub['outcome'] in SUCCESS_OUTCOMES:
+            wins_by_mode[sub['mode']] += 1
+        det = sub['details_json'] or {}
+        is_correct = det.get('correct') is True or sub['outcome'] in SUCCESS_OUTCOMES
+        is_incorrect = det.get('correct') is False or (sub['outcome'] or '').lower() in INCORRECT_OUTCOMES
+        if is_correct or is_incorrect:
+            mastery_results.append((sub['mode'], sub['details_json'], is_correct))
+    quests_completed = []
+    before, after = record_daily_activity(user_id, credit_day, xp_earned, len(items), games_by_mode, wins_by_mode, zone)
+    if credit_day == local_today(tz_name) and before is not None:
+        quests_completed = newly_completed_quests(before, after, credit_day)
+
+    user = User.query.get(user_id)
     if user:
         user.coins = (user.coins or 0) + coins_earned
         user.total_xp = (user.total_xp or 0) + xp_earned
-    # Invalidate leaderboard cache since the rankings can shift
-    _leaderboard_cache['expires_at'] = 0
-
+        for _item in items:
+            mark_user_active(user, credit_day)
     # Update standards mastery
-    det = details_json or {}
-    is_correct = det.get('correct') is True or outcome in SUCCESS_OUTCOMES
-    is_incorrect = det.get('correct') is False or (outcome or '').lower() in {'incorrect', 'fail', 'wrong', 'lose', 'lost'}
-    standards_practiced = []
-    if is_correct or is_incorrect:
-        standards_practiced = update_mastery_for_result(g.user_id, mode, details_json, is_correct)
+    standards_practiced = update_mastery_for_results(user_id, mastery_results) if mastery_results else []
+    return user, coins_earned, xp_earned, standards_practiced, quests_completed
 
-    db.session.commit()
 
-    # Unlock achievements if thresholds met
-    newly_unlocked = []
-    unlocked_ids = {ua.achievement_id for ua in UserAchievement.query.filter_by(user_id=g.user_id).all()}
+@app.post('/api/results')
+@require_auth
+def record_result():
+    body = request.get_json(silent=True) or {}
 
-    if outcome in SUCCESS_OUTCOMES or outcome is None:
-        # count completed/success tasks in this mode for user
-        q = db.session.query(func.count(GameResult.id)).filter(
-            GameResult.user_id == g.user_id,
-            GameResult.mode == mode,
-            (GameResult.outcome == None) | (GameResult.outcome.in_(list(SUCCESS_OUTCOMES)))
-        )
-        total_completed = int(q.scalar() or 0)
-        # candidate achievements for this mode
-        achs = Achievement.query.filter_by(mode=mode).all()
-        for a in achs:
-            if a.threshold <= total_completed and a.id not in unlocked_ids:
-                ua = UserAchievement(user_id=g.user_id, achievement_id=a.id)
-                db.session.add(ua)
-                unlocked_ids.add(a.id)
-                newly_unlocked.append({'code': a.code, 'title': a.title, 'threshold': a.threshold, 'name': a.title})
-
-    # Cross-mode achievements (always check — some don't require success)
-    cross_achs = Achievement.query.filter(Achievement.mode.is_(None)).all()
-    for a in cross_achs:
-        if a.id in unlocked_ids:
-            continue
-        met = False
-        if a.code.startswith('explore_'):
-            modes_played = db.session.query(GameResult.mode).filter_by(user_id=g.user_id).distinct().count()
-            met = modes_played >= a.threshold
-        elif a.code.startswith('total_') or a.code == 'first_game':
-            total_all = db.session.query(func.count(GameResult.id)).filter(
-                GameResult.user_id == g.user_id,
-                (GameResult.outcome == None) | (GameResult.outcome.in_(list(SUCCESS_OUTCOMES)))
-            ).scalar() or 0
-            met = int(total_all) >= a.threshold
-        elif a.code.startswith('streak_'):
-            recent = GameResult.query.filter_by(user_id=g.user_id)\
-                .order_by(GameResult.played_at.desc())\
-                .limit(a.threshold + 5).all()
-            streak = 0
-            for rr in recent:
-                if rr.outcome in SUCCESS_OUTCOMES:
-                    streak += 1
-                else:
-                    break
-            met = streak >= a.threshold
-        elif a.code.startswith('accuracy_'):
-            try:
-                pct = int(a.code.split('_')[1])
-            except (IndexError, ValueError):
-                continue
-            total_games = db.session.query(func.count(GameResult.id)).filter_by(user_id=g.user_id).scalar() or 0
-            if int(total_games) >= a.threshold:
-                successes = db.session.query(func.count(GameResult.id)).filter(
-                    GameResult.user_id == g.user_id,
-                    GameResult.outcome.in_(list(SUCCESS_OUTCOMES))
-                ).scalar() or 0
-                met = (int(successes) / int(total_games)) * 100 >= pct
-        elif a.code.startswith('mastery_'):
-            mastery_pct = 0.7 if a.threshold <= 3 else 0.8
-            snapshots = MasterySnapshot.query.filter_by(user_id=g.user_id).all()
-            by_skill = {}
-            for s in snapshots:
-                if s.skill_id not in by_skill or s.id > by_skill[s.skill_id].id:
-                    by_skill[s.skill_id] = s
-            high_count = sum(1 for s in by_skill.values() if float(s.mastery_prob or 0) >= mastery_pct)
-            met = high_count >= a.threshold
-        if met:
-            db.session.add(UserAchievement(user_id=g.user_id, achievement_id=a.id))
-            unlocked_ids.add(a.id)
-            newly_unlocked.append({'code': a.code, 'title': a.title, 'threshold': a.threshold, 'name': a.title})
+    # Per-user rate limit (anti-grinding)
+    now_ts = time.monotonic()
+    last_ts = _last_result_at.get(g.user_id, 0)
+    if now_ts - last_ts < RESULT_RATE_LIMIT_SEC:
+        return jsonify({
+            'error': 'rate_limited',
+            'retry_after': round(RESULT_RATE_LIMIT_SEC - (now_ts - last_ts), 2),
+        }), 429
 
-        if newly_unlocked:
-            db.session.commit()
+    sub, error = parse_result_submission(body)
+    if error:
+        return jsonify({'error': error}), 400
+    wait = take_result_volume(g.user_id, 1, now_ts)
+    if wait:
+        return jsonify({'error': 'rate_limited', 'retry_after': round(wait, 2)}), 429
+
+    # Stamp rate limit AFTER validation passes so failed payloads don't lock the user out
+    _last_result_at[g.user_id] = now_ts
+
+    if RESULT_INGEST_MODE == 'queue':
+        # Write-behind: append durably and answer from the in-memory reward math;
+        # mastery and achievements arrive later as a 'result_processed' socket event.
+        coins_earned, xp_earned = result_rewards(sub['outcome'], sub['score'])
+        result_queue.append(g.user_id, sub)
+        ensure_result_queue_worker()
+        return jsonify({
+            'ok': True,
+            'queued': True,
+            'id': None,
+            'new_achievements': [],
+            'coins_earned': coins_earned,
+            'xp_earned': xp_earned,
+            'total_coins': None,
+            'standards': [],
+            'quests_completed': [],
+        })
+
+    r, user, coins_earned, standards_practiced, quests_completed = apply_result(g.user_id, sub)
+    new_total_xp = int(user.total_xp) if user else None
+    new_streak = int(user.current_streak) if user else None
+
+    db.session.commit()
+    # Move the player within the in-memory leaderboard (O(log n) search)
+    if new_total_xp is not None:
+        leaderboard_index.update(int(g.user_id), new_total_xp, new_streak)
+    class_analytics_cache.invalidate_user(int(g.user_id))
+
+    # Unlock achievements if thresholds met
+    newly_unlocked = evaluate_achievements(g.user_id, sub['mode'], sub['outcome'])
+    if newly_unlocked:
+        db.session.commit()
 
     return jsonify({
         'ok': True,
@@ -1459,14 +4186,401 @@ def record_result():
         'coins_earned': coins_earned,
         'total_coins': int(user.coins) if user else 0,
         'standards': standards_practiced,
+        'quests_completed': quests_completed,
     })
 
 
-@app.get('/api/dashboard')
+@app.post('/api/results/batch')
 @require_auth
-def api_dashboard():
-    ensure_achievements_seed()
-    uid = g.user_id
+def record_results_batch():
+    """Submit up to RESULT_BATCH_MAX results (each with an optional client
+    `played_at`) in one request: one insert, one commit, and rewards, streak
+    and mastery applied once for the whole batch. Invalid entries are skipped
+    and reported by index.
+
+    An entry may carry a client `key` (unique per user, e.g. a UUID made when
+    the play finished). It is stored as the result's ingest_key, so when a
+    client resends a batch whose response it never saw, entries already
+    recorded are skipped and reported in `duplicates` instead of counted
+    twice."""
+    body = request.get_json(silent=True) or {}
+    entries = body.get('results')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'error': 'invalid_batch'}), 400
+    if len(entries) > RESULT_BATCH_MAX:
+        return jsonify({'error': 'batch_too_large', 'max': RESULT_BATCH_MAX}), 400
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    items, keys, indexes, rejected = [], [], [], []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            rejected.append({'index': i, 'error': 'invalid_result'})
+            continue
+        sub, error = parse_result_submission(entry)
+        if error is None:
+            played_at, error = parse_client_timestamp(entry.get('played_at'), now)
+        key = entry.get('key')
+        if error is None and key is not None and not (isinstance(key, str) and 0 < len(key) <= RESULT_KEY_MAX):
+            error = 'invalid_key'
+        if error:
+            rejected.append({'index': i, 'error': error})
+            continue
+        items.append((sub, played_at))
+        keys.append(f'batch:{int(g.user_id)}:{key}' if key is not None else None)
+        indexes.append(i)
+    if not items:
+        return jsonify({'error': 'invalid_batch', 'rejected': rejected}), 400
+
+    # Resent entries: keys already in game_results, or repeated within this batch
+    sent = [k for k in keys if k]
+    seen = {k for (k,) in db.session.query(GameResult.ingest_key).filter(
+        GameResult.ingest_key.in_(sent))} if sent else set()
+    duplicates, fresh = [], []
+    for index, item, key in zip(indexes, items, keys):
+        if key and key in seen:
+            duplicates.append(index)
+            continue
+        if key:
+            seen.add(key)
+        fresh.append((item, key))
+    if not fresh:
+        return jsonify({'ok': True, 'accepted': 0, 'rejected': rejected, 'duplicates': duplicates,
+                        'new_achievements': [], 'coins_earned': 0, 'xp_earned': 0,
+                        'standards': [], 'quests_completed': []})
+    fresh.sort(key=lambda pair: pair[0][1])  # streak and mastery replay in play order
+    items = [item for item, _ in fresh]
+
+    wait = take_result_volume(g.user_id, len(items), time.monotonic())
+    if wait:
+        return jsonify({'error': 'rate_limited', 'retry_after': round(wait, 2)}), 429
+
+    user, coins_earned, xp_earned, standards_practiced, quests_completed = apply_results(
+        g.user_id, items, now, [key for _, key in fresh])
+    new_total_xp = int(user.total_xp) if user else None
+    new_streak = int(user.current_streak) if user else None
+    from sqlalchemy.exc import IntegrityError
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the same keyed entry committed by a concurrent resend since the check
+        db.session.rollback()
+        return jsonify({'error': 'duplicate_batch'}), 409
+    if new_total_xp is not None:
+        leaderboard_index.update(int(g.user_id), new_total_xp, new_streak)
+    class_analytics_cache.invalidate_user(int(g.user_id))
+
+    # Check achievements once per mode played, as a completed play if any was
+    outcomes = {}
+    for sub, _ in items:
+        if sub['mode'] not in outcomes or sub['outcome'] in SUCCESS_OUTCOMES or sub['outcome'] is None:
+            outcomes[sub['mode']] = sub['outcome']
+    newly_unlocked = []
+    for mode, outcome in outcomes.items():
+        newly_unlocked += evaluate_achievements(g.user_id, mode, outcome)
+    if newly_unlocked:
+        db.session.commit()
+
+    return jsonify({
+        'ok': True,
+        'accepted': len(items),
+        'rejected': rejected,
+        'duplicates': duplicates,
+        'new_achievements': newly_unlocked,
+        'coins_earned': coins_earned,
+        'xp_earned': xp_earned,
+        'total_coins': int(user.coins) if user else 0,
+        'standards': standards_practiced,
+        'quests_completed': quests_completed,
+    })
+
+
+# ---- Write-behind result ingestion ----
+# With RESULT_INGEST_MODE=queue, /api/results only validates and appends to a
+# local SQLite (WAL) queue; a background greenlet applies queued results in
+# batched transactions and tells each player over Socket.IO. Each entry carries
+# a random ingest_key that is stored on its game_results row, so an entry that
+# was committed but not yet deleted from the queue (crash, failed delete) is
+# recognized and skipped on the next drain instead of being applied twice.
+# An entry that fails to apply on its own stays queued and is retried with
+# exponential backoff; after RESULT_QUEUE_MAX_ATTEMPTS it moves to the
+# failed_results table in the same file (`flask drain-result-queue
+# --retry-failed` queues those again), so an accepted submission is never
+# silently dropped.
+#
+# The queue file is only as durable as the disk under it. On hosts with an
+# ephemeral filesystem (Render's free plan wipes instance/ on every deploy),
+# run `flask drain-result-queue` before a redeploy or restart, or point
+# RESULT_QUEUE_PATH at a persistent disk; otherwise unapplied entries are lost.
+
+class ResultQueue:
+    """Durable FIFO of validated submissions in a local SQLite file. One
+    autocommitted connection; sqlite3 calls don't yield under eventlet, so
+    greenlets never interleave inside a statement."""
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = None
+
+    def _db(self):
+        if self._conn is None:
+            import sqlite3
+            conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=FULL')  # an acknowledged submission survives power loss
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS pending_results ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, '
+                'payload TEXT NOT NULL, played_at TEXT NOT NULL, ingest_key TEXT, '
+                'attempts INTEGER NOT NULL DEFAULT 0, retry_at REAL)'
+            )
+            columns = {row[1] for row in conn.execute('PRAGMA table_info(pending_results)')}
+            for name, ddl in (('ingest_key', 'TEXT'), ('attempts', 'INTEGER NOT NULL DEFAULT 0'),
+                              ('retry_at', 'REAL')):
+                if name not in columns:
+                    conn.execute(f'ALTER TABLE pending_results ADD COLUMN {name} {ddl}')  # older queue file
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS failed_results ('
+                'id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL, payload TEXT NOT NULL, '
+                'played_at TEXT NOT NULL, ingest_key TEXT, attempts INTEGER NOT NULL, '
+                'error TEXT, failed_at TEXT NOT NULL)'
+            )
+            self._conn = conn
+        return self._conn
+
+    def append(self, user_id, sub, played_at=None):
+        import json as _json_mod
+        import uuid
+        played_at = played_at or datetime.datetime.now(datetime.timezone.utc)
+        # random rather than the row id: ids restart if the queue file is replaced
+        self._db().execute(
+            'INSERT INTO pending_results (user_id, payload, played_at, ingest_key) VALUES (?, ?, ?, ?)',
+            (int(user_id), _json_mod.dumps(sub), played_at.isoformat(), uuid.uuid4().hex),
+        )
+
+    def peek(self, limit):
+        """Oldest `limit` entries not waiting out a retry backoff, as
+        (id, user_id, submission, played_at, ingest_key)."""
+        import json as _json_mod
+        rows = self._db().execute(
+            'SELECT id, user_id, payload, played_at, ingest_key FROM pending_results '
+            'WHERE retry_at IS NULL OR retry_at <= ? ORDER BY id LIMIT ?', (time.time(), limit)
+        ).fetchall()
+        return [(qid, uid, _json_mod.loads(payload), datetime.datetime.fromisoformat(played_at), key)
+                for qid, uid, payload, played_at, key in rows]
+
+    def delete(self, ids):
+        for i in range(0, len(ids), 500):
+            chunk = ids[i:i + 500]
+            self._db().execute(f"DELETE FROM pending_results WHERE id IN ({','.join('?' * len(chunk))})", chunk)
+
+    def record_failure(self, qid, error, max_attempts):
+        """Count a failed attempt at entry `qid`: back it off, or after
+        `max_attempts` move it to failed_results. Returns True if moved."""
+        conn = self._db()
+        conn.execute('UPDATE pending_results SET attempts = attempts + 1, '
+                     'retry_at = ? + min(300, 1 << attempts) WHERE id = ?', (time.time(), qid))
+        row = conn.execute('SELECT attempts FROM pending_results WHERE id = ?', (qid,)).fetchone()
+        if row is None or row[0] < max_attempts:
+            return False
+        conn.execute('BEGIN')
+        conn.execute(
+            'INSERT OR REPLACE INTO failed_results (id, user_id, payload, played_at, ingest_key, attempts, error, failed_at) '
+            'SELECT id, user_id, payload, played_at, ingest_key, attempts, ?, ? FROM pending_results WHERE id = ?',
+            (str(error)[:2000], datetime.datetime.now(datetime.timezone.utc).isoformat(), qid))
+        conn.execute('DELETE FROM pending_results WHERE id = ?', (qid,))
+        conn.execute('COMMIT')
+        return True
+
+    def requeue_failed(self):
+        """Move every failed_results entry back into the queue for another try."""
+        conn = self._db()
+        conn.execute('BEGIN')
+        moved = conn.execute(
+            'INSERT INTO pending_results (user_id, payload, played_at, ingest_key) '
+            'SELECT user_id, payload, played_at, ingest_key FROM failed_results ORDER BY id').rowcount
+        conn.execute('DELETE FROM failed_results')
+        conn.execute('COMMIT')
+        return moved
+
+    def failed_count(self):
+        return self._db().execute('SELECT COUNT(*) FROM failed_results').fetchone()[0]
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM pending_results').fetchone()[0]
+
+
+result_queue = ResultQueue(RESULT_QUEUE_PATH)
+_result_worker_started = False
+
+# A Socket.IO emit to a room nobody is in is dropped, and a result can finish
+# processing before the player's page has completed its socket handshake. So
+# result_processed payloads for a user with no live connection wait here and
+# are handed to that user's next authenticated connect.
+RESULT_OUTBOX_MAX = 50         # per user; oldest dropped first
+RESULT_OUTBOX_TTL_SEC = 300
+_result_outbox = {}  # user_id -> [(monotonic, payload), ...]
+
+
+def _user_connected(user_id):
+    return next(socketio.server.manager.get_participants('/', user_room(user_id)), None) is not None
+
+
+def deliver_result_processed(user_id, payload):
+    uid = int(user_id)
+    if _user_connected(uid):
+        socketio.emit('result_processed', payload, to=user_room(uid))
+        return
+    now = time.monotonic()
+    for stale in [k for k, v in _result_outbox.items() if v[-1][0] < now - RESULT_OUTBOX_TTL_SEC]:
+        del _result_outbox[stale]
+    held = _result_outbox.setdefault(uid, [])
+    held.append((now, payload))
+    del held[:-RESULT_OUTBOX_MAX]
+
+
+def flush_result_outbox(user_id, sid):
+    """Send payloads held for `user_id` to the socket that just connected."""
+    held = _result_outbox.pop(int(user_id), None)
+    if not held:
+        return
+    cutoff = time.monotonic() - RESULT_OUTBOX_TTL_SEC
+    for ts, payload in held:
+        if ts >= cutoff:
+            socketio.emit('result_processed', payload, to=sid)
+
+
+def drain_result_queue(limit=None):
+    """Apply up to `limit` queued results in one transaction and delete them
+    from the queue, then evaluate achievements and notify each player (best
+    effort: a failure there never replays the results). Entries whose ingest_key is already in game_results
+    were applied by an earlier drain and are skipped. If the batch fails,
+    entries are retried one per transaction so a single bad payload can't
+    wedge the queue; ones that still fail stay queued with a backoff (see
+    ResultQueue.record_failure). Returns how many entries were applied or skipped."""
+    entries = result_queue.peek(limit or RESULT_QUEUE_BATCH)
+    if not entries:
+        return 0
+    with app.app_context():
+        keys = [key for *_rest, key in entries if key]
+        done = {k for (k,) in db.session.query(GameResult.ingest_key).filter(
+            GameResult.ingest_key.in_(keys))} if keys else set()
+        pending = [e for e in entries if not e[4] or e[4] not in done]
+        if len(pending) < len(entries):
+            print(f'[WARN] result queue: skipping {len(entries) - len(pending)} entries already applied')
+
+        def apply(uid, sub, played_at, key):
+            r, user, coins_earned, standards, quests = apply_result(uid, sub, played_at, key)
+            # read totals before commit expires the user row
+            totals = (int(user.total_xp), int(user.current_streak), int(user.coins)) if user else None
+            return uid, sub, r, coins_earned, standards, quests, totals
+
+        applied = []
+        consumed = [e[0] for e in entries if e[4] and e[4] in done]
+        try:
+            for _qid, uid, sub, played_at, key in pending:
+                applied.append(apply(uid, sub, played_at, key))
+            db.session.commit()
+            consumed += [e[0] for e in pending]
+        except Exception:
+            db.session.rollback()
+            applied = []
+            for qid, uid, sub, played_at, key in pending:
+                try:
+                    item = apply(uid, sub, played_at, key)
+                    db.session.commit()
+                    applied.append(item)
+                    consumed.append(qid)
+                except Exception as e:
+                    db.session.rollback()
+                    if result_queue.record_failure(qid, e, RESULT_QUEUE_MAX_ATTEMPTS):
+                        print(f'[WARN] queued result {qid} for user {uid} moved to failed_results: {e}')
+                    else:
+                        print(f'[WARN] queued result {qid} for user {uid} failed, will retry: {e}')
+        result_ids = [int(item[2].id) for item in applied]  # before anything below can expire them
+        result_queue.delete(consumed)
+
+        deliveries = []
+        for (uid, sub, _r, coins_earned, standards, quests, totals), result_id in zip(applied, result_ids):
+            if totals is not None:
+                leaderboard_index.update(int(uid), totals[0], totals[1])
+            class_analytics_cache.invalidate_user(int(uid))
+            try:
+                new_achievements = evaluate_achievements(uid, sub['mode'], sub['outcome'])
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                print(f'[WARN] achievements for queued result {result_id} failed: {e}')
+                new_achievements = []
+            deliveries.append((uid, {
+                'id': result_id,
+                'new_achievements': new_achievements,
+                'coins_earned': coins_earned,
+                'total_coins': totals[2] if totals else 0,
+                'standards': standards,
+                'quests_completed': quests,
+            }))
+    for uid, payload in deliveries:
+        try:
+            deliver_result_processed(uid, payload)
+        except Exception as e:
+            print(f'[WARN] result_processed for user {uid} not sent: {e}')
+    return len(consumed)
+
+
+def _result_queue_worker():
+    while True:
+        try:
+            drained = drain_result_queue()
+        except Exception as e:
+            print(f'[WARN] result queue drain failed: {e}')
+            drained = 0
+        socketio.sleep(0 if drained else RESULT_QUEUE_IDLE_SEC)
+
+
+def ensure_result_queue_worker():
+    """Start the drain greenlet on first use (not at import, so CLI commands
+    don't spawn it). It also picks up entries left over from a previous run."""
+    global _result_worker_started
+    if not _result_worker_started:
+        _result_worker_started = True
+        socketio.start_background_task(_result_queue_worker)
+
+
+@app.cli.command('drain-result-queue')
+@click.option('--retry-failed', is_flag=True, help='Queue entries from failed_results again first.')
+def drain_result_queue_command(retry_failed):
+    """Apply every queued result now: before a deploy switches ingest mode, and
+    before any redeploy or restart on an ephemeral disk (the queue file goes with it)."""
+    if retry_failed:
+        click.echo(f'result queue: requeued {result_queue.requeue_failed()} failed entries')
+    total = 0
+    while True:
+        drained = drain_result_queue()
+        if not drained:
+            break
+        total += drained
+    click.echo(f'result queue: applied {total} entries')
+    waiting, failed = len(result_queue), result_queue.failed_count()
+    if waiting or failed:
+        click.echo(f'[WARN] result queue: {waiting} entries waiting to retry, {failed} in failed_results')
+
+
+DASHBOARD_MODES = ['plane', 'battleship', 'memewars', 'ratios', 'memedash']
+
+
+def _score_or_none(v):
+    return float(v) if v is not None else None
+
+
+def build_dashboard(uid):
+    """Assemble the /api/dashboard payload with a fixed number of queries
+    (user, class timezone, recent, user_stats, achievements, daily_activity
+    for quests, equipped items, mastery snapshots) regardless of history or
+    catalog size; tests/test_dashboard_queries.py pins the count."""
+    user = User.query.get(uid)
+    tz_name = user_timezones([uid]).get(uid)
+    today = local_today(tz_name)
+
     # Recent results
     recent = [
         {
@@ -1480,122 +4594,69 @@ def api_dashboard():
         for gr in GameResult.query.filter_by(user_id=uid).order_by(GameResult.played_at.desc()).limit(25).all()
     ]
 
-    # Per-mode aggregates (totals, wins, scores) using SQL, then enrich with accuracy and challenge breakdown in Python
-    modes = ['plane', 'battleship', 'memewars', 'ratios', 'memedash']
-    per_mode = {m: {
-        'total_games': int(db.session.query(func.count(GameResult.id)).filter(
-            GameResult.user_id == uid,
-            GameResult.mode.in_(canonical_mode_group(m))
-        ).scalar() or 0),
-        'wins_or_completed': int(db.session.query(func.count(GameResult.id)).filter(
-            GameResult.user_id == uid,
-            GameResult.mode.in_(canonical_mode_group(m)),
-            GameResult.outcome.in_(list(SUCCESS_OUTCOMES))
-        ).scalar() or 0),
-        'avg_score': (lambda v: float(v) if v is not None else None)(db.session.query(func.avg(GameResult.score)).filter(
-            GameResult.user_id == uid,
-            GameResult.mode.in_(canonical_mode_group(m)),
-            GameResult.score != None
-        ).scalar()),
-        'best_score': (lambda v: float(v) if v is not None else None)(db.session.query(func.max(GameResult.score)).filter(
-            GameResult.user_id == uid,
-            GameResult.mode.in_(canonical_mode_group(m)),
-            GameResult.score != None
-        ).scalar()),
-    } for m in modes}
-
-    # Accuracy and challenge-type breakdown
-    rows = GameResult.query.filter_by(user_id=uid).all()
-    # helpers
-    def classify(gr):
-        det = gr.details_json or {}
-        # canonical mode: map synonyms, then merge 'line' into 'plane' bucket
-        base_mode = canonicalize_mode(gr.mode or '')
-        cmode = 'plane' if base_mode in ('line', 'plane') else (base_mode or 'unknown')
-        # challenge type
-        ctype = det.get('challenge_type')
-        if not ctype:
-            # infer from mode/game_name
-            if gr.mode == 'line' or (cmode == 'plane' and 'line' in (gr.game_name or '').lower()):
-                ctype = 'line'
-            elif cmode == 'plane' and 'vertex' in (gr.game_name or '').lower():
-                ctype = 'vertex'
-            elif cmode == 'ratios':
-                ctype = 'ratio'
-            else:
-                ctype = cmode
-        # correctness
-        if det.get('correct') is True:
-            corr = True
-        elif det.get('correct') is False:
-            corr = False
-        else:
-            if gr.outcome in SUCCESS_OUTCOMES:
-                corr = True
-            elif (gr.outcome or '').lower() in {'incorrect','fail','wrong','lose','lost'}:
-                corr = False
-            else:
-                corr = None
-        return cmode, ctype, corr
-
-    # aggregate
-    by_mode = {m: {'correct': 0, 'incorrect': 0, 'by_challenge': {}} for m in modes}
-    for gr in rows:
-        cmode, ctype, corr = classify(gr)
-        if cmode not in by_mode:
-            by_mode[cmode] = {'correct': 0, 'incorrect': 0, 'by_challenge': {}}
-        bm = by_mode[cmode]
-        bc = bm['by_challenge'].setdefault(ctype, {'correct': 0, 'incorrect': 0})
-        if corr is True:
-            bm['correct'] += 1
-            bc['correct'] += 1
-        elif corr is False:
-            bm['incorrect'] += 1
-            bc['incorrect'] += 1
-
-    # finalize accuracy
-    for m, stats in by_mode.items():
-        tot = stats['correct'] + stats['incorrect']
-        stats['accuracy'] = (stats['correct'] / tot) if tot > 0 else None
-        # carry into per_mode
-        if m in per_mode:
-            per_mode[m]['correct'] = int(stats['correct'])
-            per_mode[m]['incorrect'] = int(stats['incorrect'])
-            per_mode[m]['accuracy'] = float(stats['accuracy']) if stats['accuracy'] is not None else None
-            # challenge breakdown with accuracy
-            per_mode[m]['by_challenge'] = {}
-            for ct, s in stats['by_challenge'].items():
-                t = s['correct'] + s['incorrect']
-                acc = (s['correct']/t) if t>0 else None
-                per_mode[m]['by_challenge'][ct] = {
-                    'correct': int(s['correct']),
-                    'incorrect': int(s['incorrect']),
-                    'accuracy': float(acc) if acc is not None else None,
-                    'total': int(t),
-                }
-
-    # Achievements with progress info
-    all_achs = Achievement.query.order_by(Achievement.mode, Achievement.threshold).all()
-    unlocked = {ua.achievement_id: ua.unlocked_at for ua in UserAchievement.query.filter_by(user_id=uid).all()}
-
-    # Pre-compute per-mode completed counts toward achievements.
-    # Single GROUP BY query (replaces N separate COUNTs per mode).
-    relevant_modes = sorted({a.mode for a in all_achs})
-    raw_counts = dict(db.session.query(
-        GameResult.mode, func.count(GameResult.id)
-    ).filter(
-        GameResult.user_id == uid,
-        (GameResult.outcome == None) | (GameResult.outcome.in_(list(SUCCESS_OUTCOMES)))
-    ).group_by(GameResult.mode).all())
-    progress_counts = {}
-    for m in relevant_modes:
-        modes_list = canonical_mode_group(m)
-        progress_counts[m] = sum(int(raw_counts.get(mm, 0) or 0) for mm in modes_list)
+    # Per-mode aggregates, accuracy and challenge breakdown all come from the
+    # user_stats rollup (one row per mode/challenge_type).
+    stats = UserStat.query.filter_by(user_id=uid).all()
+    if not stats and (user is None or user.total_xp != 0):
+        # History not backfilled yet (see backfill-user-stats): aggregate it for
+        # this read only; a GET doesn't write
+        stats = aggregate_user_stats(uid)
+    by_mode = {m: {'total_games': 0, 'wins_or_completed': 0, 'scored': 0, 'score_sum': 0.0,
+                   'best_score': None, 'correct': 0, 'incorrect': 0, 'by_challenge': {}}
+               for m in DASHBOARD_MODES}
+    completed_by_mode = {}
+    for st in stats:
+        completed_by_mode[st.mode] = completed_by_mode.get(st.mode, 0) + int(st.completed or 0)
+        bucket = 'plane' if st.mode in ('line', 'plane') else st.mode
+        bm = by_mode.get(bucket)
+        if bm is None:
+            continue
+        bm['total_games'] += int(st.total or 0)
+        bm['wins_or_completed'] += int(st.successes or 0)
+        bm['scored'] += int(st.scored or 0)
+        bm['score_sum'] += float(st.score_sum or 0)
+        if st.score_max is not None and (bm['best_score'] is None or float(st.score_max) > bm['best_score']):
+            bm['best_score'] = float(st.score_max)
+        bm['correct'] += int(st.correct or 0)
+        bm['incorrect'] += int(st.incorrect or 0)
+        bc = bm['by_challenge'].setdefault(st.challenge_type, {'correct': 0, 'incorrect': 0})
+        bc['correct'] += int(st.correct or 0)
+        bc['incorrect'] += int(st.incorrect or 0)
+
+    per_mode = {}
+    for m, bm in by_mode.items():
+        tot = bm['correct'] + bm['incorrect']
+        by_challenge = {}
+        for ct, s in bm['by_challenge'].items():
+            t = s['correct'] + s['incorrect']
+            by_challenge[ct] = {
+                'correct': int(s['correct']),
+                'incorrect': int(s['incorrect']),
+                'accuracy': float(s['correct'] / t) if t > 0 else None,
+                'total': int(t),
+            }
+        per_mode[m] = {
+            'total_games': bm['total_games'],
+            'wins_or_completed': bm['wins_or_completed'],
+            'avg_score': (bm['score_sum'] / bm['scored']) if bm['scored'] else None,
+            'best_score': _score_or_none(bm['best_score']),
+            'correct': bm['correct'],
+            'incorrect': bm['incorrect'],
+            'accuracy': (bm['correct'] / tot) if tot > 0 else None,
+            'by_challenge': by_challenge,
+        }
 
+    # Achievements with progress info (catalog from memory, unlock times per user)
+    ref = reference_data.get()
+    unlocked_at_by_id = dict(db.session.query(UserAchievement.achievement_id, UserAchievement.unlocked_at).filter(
+        UserAchievement.user_id == uid).all())
+    progress_counts = {}
     achievements = []
-    for a in all_achs:
-        unlocked_at = unlocked.get(a.id)
-        current = progress_counts.get(a.mode, 0)
+    for a in ref.achievements:
+        unlocked_at = unlocked_at_by_id.get(a.id)
+        if a.mode not in progress_counts:
+            progress_counts[a.mode] = sum(completed_by_mode.get(mm, 0) for mm in canonical_mode_group(a.mode))
+        current = progress_counts[a.mode]
         thr = int(a.threshold)
         percent = (current / thr) if thr > 0 else 0.0
         if percent > 1:
@@ -1614,46 +4675,45 @@ def api_dashboard():
             'unlocked_at': unlocked_at.isoformat() if unlocked_at else None
         })
 
-    # XP and level
+    # XP and level (reads the already-loaded user from the identity map)
     xp_data = compute_xp_and_level(uid)
     xp_data['title'] = get_level_title(xp_data['level'])
 
-    # Streak and daily goal
-    streak_data = compute_streak_and_daily(uid)
-
-    # Daily quests
-    quest_data = compute_quest_progress(uid)
+    # Daily quests, then streak + daily goal from the persisted columns
+    quest_data = compute_quest_progress(uid, today=today, tz_name=tz_name)
+    streak_data = compute_streak_and_daily(user, today)
+    activity_data = activity_calendar(user, today) if user else None
 
     # Coins balance
-    user = User.query.get(uid)
     coins = int(user.coins or 0) if user else 0
 
     # Equipped cosmetics
     equipped_items = {}
     if user:
-        equipped = UserItem.query.filter_by(user_id=uid, equipped=True).all()
-        for ui in equipped:
-            item = ShopItem.query.get(ui.item_id)
-            if item:
-                equipped_items[item.category] = {
-                    'code': item.code,
-                    'name': item.name,
-                    'icon': item.icon,
-                    'data': item.data_json,
-                }
+        equipped = db.session.query(UserItem.item_id).filter(
+            UserItem.user_id == uid,
+            UserItem.equipped == True
+        ).all()
+        for (item_id,) in equipped:
+            item = ref.shop_item(item_id)
+            if item is None:
+                continue
+            equipped_items[item.category] = {
+                'code': item.code,
+                'name': item.name,
+                'icon': item.icon,
+                'data': item.data_json,
+            }
 
     # Standards mastery
-    ensure_standards_seed()
-    all_skills = Skill.query.order_by(Skill.standard_code).all()
-    snapshots = {ms.skill_id: ms for ms in MasterySnapshot.query.filter_by(user_id=uid).all()}
+    snaps = {int(snap.skill_id): snap for snap in MasterySnapshot.query.filter_by(user_id=uid).all()}
     standards_out = []
     strands_summary = {}
-    for sk in all_skills:
-        snap = snapshots.get(sk.id)
+    for sk in reference_data.get().skills:
+        snap = snaps.get(sk.id)
         mastery = float(snap.mastery_prob) if snap else 0.0
         opps = int(snap.opportunities) if snap else 0
-        cat_entry = next((s for s in STANDARDS_CATALOG if s['code'] == sk.standard_code), {})
-        grade = cat_entry.get('grade', 5)
+        grade = STANDARDS_BY_CODE.get(sk.standard_code, {}).get('grade', 5)
         standards_out.append({
             'code': sk.standard_code,
             'name': sk.name,
@@ -1681,94 +4741,641 @@ def api_dashboard():
             'avg_mastery': round(avg, 3),
         })
 
-    return jsonify({
+    return {
         'recent': recent,
         'per_mode': per_mode,
         'achievements': achievements,
         'xp': xp_data,
         'streak': streak_data,
+        'activity_calendar': activity_data,
         'quests': quest_data,
         'coins': coins,
         'equipped': equipped_items,
         'standards': standards_out,
         'strands': strands_out,
-    })
+    }
 
 
-def _build_leaderboard_entries():
-    """Compute the full sorted leaderboard. Pulled out of /api/leaderboard so the
-    cache layer can call it once per TTL window."""
-    user_ids = [r[0] for r in db.session.query(GameResult.user_id).distinct().all()]
-    entries = []
-    for uid in user_ids:
-        xp = compute_xp_and_level(uid)
-        user = User.query.get(uid)
-        name = (user.display_name if user and user.display_name else None) or f'Player {uid}'
-        streak = compute_streak_and_daily(uid)
-
-        # Check for equipped cosmetics
-        custom_title = None
-        frame_data = None
-        equipped_cosmetics = UserItem.query.filter_by(user_id=uid, equipped=True).all()
-        for ui in equipped_cosmetics:
-            item = ShopItem.query.get(ui.item_id)
-            if item and item.category == 'title':
-                custom_title = item.name
-            elif item and item.category == 'avatar_frame':
-                frame_data = item.data_json
-
-        entries.append({
-            'user_id': int(uid),
-            'display_name': name,
-            'total_xp': xp['total_xp'],
-            'level': xp['level'],
-            'title': custom_title or get_level_title(xp['level']),
-            'streak': streak['streak'],
-            'frame': frame_data,
-        })
+@app.get('/api/dashboard')
+@require_auth
+def api_dashboard():
+    return jsonify(build_dashboard(g.user_id))
+
+
+LEADERBOARD_MAX_LIMIT = 50
+
+
+def _leaderboard_query():
+    """Users joined to their equipped title and avatar frame. Ranked users are
+    those with XP, i.e. everyone who has submitted at least one result."""
+    equipped = db.session.query(
+        UserItem.user_id, ShopItem.category, ShopItem.name, ShopItem.data_json,
+    ).join(ShopItem, ShopItem.id == UserItem.item_id).filter(UserItem.equipped == True).subquery()
+    title = equipped.alias('equipped_title')
+    frame = equipped.alias('equipped_frame')
+    return db.session.query(
+        User.id, User.display_name, User.total_xp, title.c.name, frame.c.data_json,
+    ).outerjoin(
+        title, and_(title.c.user_id == User.id, title.c.category == 'title'),
+    ).outerjoin(
+        frame, and_(frame.c.user_id == User.id, frame.c.category == 'avatar_frame'),
+    ).filter(User.total_xp > 0)
+
+
+def _backfill_missing_total_xp():
+    """Legacy users with results but NULL total_xp would be invisible to the
+    ranked query; compute theirs once (normally finds nobody)."""
+    missing = [r[0] for r in db.session.query(User.id).filter(
+        User.total_xp.is_(None),
+        exists().where(GameResult.user_id == User.id),
+    ).all()]
+    for uid in missing:
+        User.query.get(uid).total_xp = _recompute_total_xp(uid)
+    if missing:
+        try:
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+
+
+def _leaderboard_entry(user_id, total_xp, display_name, custom_title, frame_data, streak, rank):
+    xp = xp_level_info(int(total_xp or 0))
+    return {
+        'user_id': int(user_id),
+        'display_name': display_name or f'Player {user_id}',
+        'total_xp': xp['total_xp'],
+        'level': xp['level'],
+        'title': custom_title or get_level_title(xp['level']),
+        'streak': streak,
+        'frame': frame_data,
+        'rank': rank,
+    }
+
+
+def _activity_for_users(user_ids):
+    """(current streak, played today) per user id from the persisted streak columns,
+    judged against each user's local date."""
+    if not user_ids:
+        return {}
+    zones = user_timezones(user_ids)
+    rows = db.session.query(User.id, User.current_streak, User.last_active_date).filter(
+        User.id.in_(user_ids)
+    ).all()
+    out = {}
+    for uid, current, last in rows:
+        today = local_today(zones.get(int(uid)))
+        out[int(uid)] = (streak_as_of(current, last, today), last == today)
+    return out
+
+
+class LeaderboardIndex:
+    """In-process ranking of every player by total_xp.
+
+    Ranks are kept as a bisect-maintained list of (-total_xp, user_id), so
+    moving a player after a result and looking up anyone's rank are binary
+    searches. Profiles (name, equipped title/frame, streak) are cached per user
+    and fetched only for shown ids that aren't cached yet; update() stores a
+    cached profile's new streak in place, and invalidate() drops it when cosmetics
+    or the name change. One process only: writes from other workers show up at
+    the next reconciliation rebuild.
+    """
+
+    def __init__(self, reconcile_sec=LEADERBOARD_RECONCILE_SEC):
+        self.reconcile_sec = reconcile_sec
+        self._keys = []       # sorted (-total_xp, user_id)
+        self._xp = {}         # user_id -> total_xp
+        self._profiles = {}   # user_id -> [display_name, custom_title, frame, streak, played_today]
+        self._built_at = None
+        self._built_on = None  # cached streaks are only valid for the (UTC) day they were read
+        self.metrics = {
+            'requests': 0,
+            'hits': 0,
+            'rebuilds': 0,
+            'profile_fetches': 0,
+            'last_rebuild_ms': None,
+            'total_rebuild_ms': 0.0,
+        }
 
-    entries.sort(key=lambda e: e['total_xp'], reverse=True)
-    for i, e in enumerate(entries):
-        e['rank'] = i + 1
-    return entries
+    def __len__(self):
+        return len(self._keys)
+
+    def ensure_fresh(self):
+        """Rebuild on cold start, after the reconcile interval, or at a new day.
+        Returns True when a rebuild ran."""
+        if (self._built_at is not None
+                and time.monotonic() - self._built_at < self.reconcile_sec
+                and self._built_on == utc_today()):
+            return False
+        self.rebuild()
+        return True
+
+    def rebuild(self):
+        t0 = time.perf_counter()
+        _backfill_missing_total_xp()
+        rows = db.session.query(User.id, User.total_xp).filter(User.total_xp > 0).all()
+        self._xp = {int(uid): int(xp) for uid, xp in rows}
+        self._keys = sorted((-xp, uid) for uid, xp in self._xp.items())
+        self._profiles.clear()
+        self._built_at = time.monotonic()
+        self._built_on = utc_today()
+        ms = (time.perf_counter() - t0) * 1000
+        self.metrics['rebuilds'] += 1
+        self.metrics['last_rebuild_ms'] = round(ms, 2)
+        self.metrics['total_rebuild_ms'] += ms
+
+    def update(self, user_id, total_xp, streak=None):
+        """Record a new result: move the user to their new total_xp position and,
+        if given, store their current streak (they played today)."""
+        old = self._xp.pop(user_id, None)
+        if old is not None:
+            i = bisect_left(self._keys, (-old, user_id))
+            if i < len(self._keys) and self._keys[i] == (-old, user_id):
+                del self._keys[i]
+        if total_xp > 0:
+            self._xp[user_id] = total_xp
+            insort(self._keys, (-total_xp, user_id))
+        profile = self._profiles.get(user_id)
+        if profile is not None and streak is not None:
+            profile[3] = streak
+            profile[4] = True
+
+    def invalidate(self, user_id):
+        """Forget a user's cached profile (cosmetics or name changed)."""
+        self._profiles.pop(user_id, None)
+
+    def rank(self, user_id):
+        xp = self._xp.get(user_id)
+        if xp is None:
+            return None
+        return bisect_left(self._keys, (-xp, user_id)) + 1
+
+    def _fill(self, user_ids):
+        missing = [uid for uid in user_ids if uid not in self._profiles]
+        if not missing:
+            return False
+        self.metrics['profile_fetches'] += 1
+        rows = _leaderboard_query().filter(User.id.in_(missing)).all()
+        activity = _activity_for_users(missing)
+        for uid, display_name, _xp, custom_title, frame_data in rows:
+            streak, played_today = activity.get(uid, (0, False))
+            self._profiles[int(uid)] = [display_name, custom_title, frame_data, streak, played_today]
+        return True
+
+    def _entry(self, user_id, rank):
+        display_name, custom_title, frame_data, streak, _ = self._profiles[user_id]
+        return _leaderboard_entry(user_id, self._xp[user_id], display_name, custom_title,
+                                  frame_data, streak, rank)
+
+    def board(self, limit, user_id=None):
+        """Top `limit` entries and, if user_id is ranked, that user's entry."""
+        rebuilt = self.ensure_fresh()
+        top_ids = [uid for _, uid in self._keys[:limit]]
+        wanted = top_ids + ([user_id] if user_id in self._xp and user_id not in top_ids else [])
+        fetched = self._fill(wanted)
+        self.metrics['requests'] += 1
+        if not (rebuilt or fetched):
+            self.metrics['hits'] += 1
+        entries = [self._entry(uid, i + 1) for i, uid in enumerate(top_ids) if uid in self._profiles]
+        mine = None
+        if user_id in self._profiles and user_id in self._xp:
+            mine = self._entry(user_id, self.rank(user_id))
+        return entries, mine
+
+    def snapshot_metrics(self):
+        m = dict(self.metrics)
+        m['hit_ratio'] = round(m['hits'] / m['requests'], 3) if m['requests'] else None
+        m['avg_rebuild_ms'] = round(m['total_rebuild_ms'] / m['rebuilds'], 2) if m['rebuilds'] else None
+        m['total_rebuild_ms'] = round(m['total_rebuild_ms'], 2)
+        m['players'] = len(self)
+        return m
+
+
+leaderboard_index = LeaderboardIndex()
+
+
+LEADERBOARD_PERIODS = ('all', 'today', 'week')
+
+
+def leaderboard_period_start(period, today=None):
+    """First day included in a windowed leaderboard (weeks start Monday).
+    daily_activity is keyed by class-local day, so class boards pass the
+    class's local `today`; see user_period_start for the global board."""
+    today = today or utc_today()
+    if period == 'today':
+        return today
+    if period == 'week':
+        return today - datetime.timedelta(days=today.weekday())
+    return None
+
+
+def user_period_start(period):
+    """First daily_activity day in each user's own window, for the global
+    board: a user's buckets are keyed by their class-local day (see
+    user_timezones), so their window starts at their local today rather than
+    UTC's. A SQL expression over DailyActivity.user_id when some zone's start
+    differs from UTC's right now, else the plain UTC start."""
+    utc_start = leaderboard_period_start(period)
+    zones = db.session.query(Class.timezone).filter(Class.timezone.isnot(None)).distinct()
+    starts = {tz: leaderboard_period_start(period, local_today(tz)) for (tz,) in zones}
+    starts = {tz: day for tz, day in starts.items() if day != utc_start}
+    if not starts:
+        return utc_start
+    user_tz = select(Class.timezone).join(
+        ClassMembership, ClassMembership.class_id == Class.id
+    ).where(
+        ClassMembership.user_id == DailyActivity.user_id,
+        Class.timezone.isnot(None),
+    ).order_by(ClassMembership.joined_at).limit(1).scalar_subquery()
+    return case(starts, value=user_tz, else_=utc_start)
+
+
+def scoped_leaderboard(limit, period='all', class_id=None, user_id=None):
+    """Leaderboard limited to a class and/or a time window.
+
+    Windowed XP sums the daily_activity buckets inside the window (at most 7
+    per user); class scope joins class_memberships and shows the per-class
+    display name. Returns (entries, my_entry, total_players)."""
+    today = local_today(class_timezone(class_id)) if class_id is not None and period != 'all' else None
+    start = leaderboard_period_start(period, today)
+    if start is not None and class_id is None:
+        start = user_period_start(period)
+    if start is None:
+        ranked = db.session.query(User.id.label('user_id'), User.total_xp.label('xp')).filter(User.total_xp > 0)
+        if class_id is not None:
+            ranked = ranked.join(ClassMembership, and_(
+                ClassMembership.user_id == User.id, ClassMembership.class_id == class_id))
+    else:
+        ranked = db.session.query(
+            DailyActivity.user_id.label('user_id'), func.sum(DailyActivity.xp).label('xp'),
+        ).filter(DailyActivity.day >= start)
+        if class_id is not None:
+            ranked = ranked.join(ClassMembership, and_(
+                ClassMembership.user_id == DailyActivity.user_id, ClassMembership.class_id == class_id))
+        ranked = ranked.group_by(DailyActivity.user_id).having(func.sum(DailyActivity.xp) > 0)
+    ranked = ranked.subquery()
+
+    top = db.session.query(ranked.c.user_id, ranked.c.xp).order_by(
+        ranked.c.xp.desc(), ranked.c.user_id).limit(limit).all()
+    total_players = db.session.query(func.count()).select_from(ranked).scalar() or 0
+
+    scores = {int(uid): int(xp) for uid, xp in top}
+    ranks = {int(uid): i + 1 for i, (uid, _) in enumerate(top)}
+    if user_id is not None and user_id not in scores:
+        mine = db.session.query(ranked.c.xp).filter(ranked.c.user_id == user_id).scalar()
+        if mine is not None:
+            ahead = db.session.query(func.count()).select_from(ranked).filter(or_(
+                ranked.c.xp > mine, and_(ranked.c.xp == mine, ranked.c.user_id < user_id),
+            )).scalar() or 0
+            scores[user_id] = int(mine)
+            ranks[user_id] = int(ahead) + 1
+
+    profiles = {}
+    if scores:
+        q = _leaderboard_query().filter(User.id.in_(list(scores)))
+        if class_id is not None:
+            q = q.add_columns(ClassMembership.display_name).outerjoin(ClassMembership, and_(
+                ClassMembership.user_id == User.id, ClassMembership.class_id == class_id))
+        for row in q.all():
+            profiles[int(row[0])] = row
+    activity = _activity_for_users(list(profiles))
+
+    def entry(uid):
+        row = profiles[uid]
+        name = (row[5] if len(row) > 5 else None) or row[1]
+        e = _leaderboard_entry(uid, row[2], name, row[3], row[4], activity.get(uid, (0, False))[0], ranks[uid])
+        if start is not None:
+            e['period_xp'] = scores[uid]
+        return e
+
+    entries = [entry(int(uid)) for uid, _ in top if int(uid) in profiles]
+    my_entry = entry(user_id) if user_id in scores and user_id in profiles else None
+    return entries, my_entry, int(total_players)
+
+
+def _can_view_class(user_id, class_id):
+    if user_id is None:
+        return False
+    if db.session.query(Class.id).filter(Class.id == class_id, Class.teacher_id == user_id).first():
+        return True
+    return db.session.query(ClassMembership.id).filter_by(class_id=class_id, user_id=user_id).first() is not None
 
 
 @app.get('/api/leaderboard')
 def api_leaderboard():
     """Top XP earners. Auth optional — includes caller's rank if token provided.
-    Cached for LEADERBOARD_CACHE_TTL_SEC; invalidated eagerly by record_result."""
-    limit = min(int(request.args.get('limit', 20)), 50)
 
-    now_ts = time.monotonic()
-    if _leaderboard_cache['data'] is not None and now_ts < _leaderboard_cache['expires_at']:
-        entries = _leaderboard_cache['data']
-    else:
-        entries = _build_leaderboard_entries()
-        _leaderboard_cache['data'] = entries
-        _leaderboard_cache['expires_at'] = now_ts + LEADERBOARD_CACHE_TTL_SEC
+    ?period=today|week ranks by XP earned in that UTC window; ?class_id=N limits
+    the board to one class (caller must be its teacher or a member). The global
+    all-time board is served from leaderboard_index; see LeaderboardIndex."""
+    limit = min(int(request.args.get('limit', 20)), LEADERBOARD_MAX_LIMIT)
+    period = (request.args.get('period') or 'all').strip().lower()
+    if period not in LEADERBOARD_PERIODS:
+        return jsonify({'error': 'invalid_period'}), 400
+    class_id = request.args.get('class_id')
+    if class_id is not None:
+        try:
+            class_id = int(class_id)
+        except (TypeError, ValueError):
+            return jsonify({'error': 'invalid_class_id'}), 400
 
     # Include caller's rank if authenticated
-    my_rank = None
-    auth = request.headers.get('Authorization', '')
-    if auth.startswith('Bearer '):
-        try:
-            token = auth.split(' ', 1)[1]
-            claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            my_uid = claims.get('uid')
-            for e in entries:
-                if e['user_id'] == my_uid:
-                    my_rank = e
-                    break
-        except Exception:
-            pass
+    caller = optional_auth_user()
+    my_uid = caller.user_id if caller else None
+
+    if class_id is not None and not _can_view_class(my_uid, class_id):
+        return jsonify({'error': 'forbidden'}), 403
 
+    if period == 'all' and class_id is None:
+        entries, my_rank = leaderboard_index.board(limit, my_uid)
+        total_players = len(leaderboard_index)
+    else:
+        entries, my_rank, total_players = scoped_leaderboard(limit, period, class_id, my_uid)
     return jsonify({
-        'leaderboard': entries[:limit],
-        'total_players': len(entries),
+        'leaderboard': entries,
+        'total_players': total_players,
         'my_rank': my_rank,
+        'period': period,
+        'class_id': class_id,
     })
 
 
+# ---- Class analytics ----
+# A teacher's class view (mastery per standard, accuracy per mode, recent
+# activity, assignment progress) is built from the per-user rollups that are
+# already maintained on every result: mastery_snapshots, user_stats and
+# daily_activity, each grouped across the class's students in one query joined
+# through class_memberships. No student's game_results are rescanned, so the
+# cost scales with (skills + modes + days), not with class size times history.
+# Payloads are cached for CLASS_ANALYTICS_TTL_SEC and dropped as soon as any
+# member's result is committed; see ClassAnalyticsCache.
+
+CLASS_ANALYTICS_TTL_SEC = float(os.environ.get('CLASS_ANALYTICS_TTL_SEC', '60'))
+CLASS_ANALYTICS_DAYS = 14
+CLASS_ANALYTICS_MAX_DAYS = 90
+MASTERY_BINS = 10          # histogram bins of width 0.1 over mastery_prob
+MASTERY_BANDS = (('emerging', 0.0), ('developing', 0.4), ('mastered', 0.8))  # lower bounds
+
+
+def _can_manage_class(user_id, role, class_id):
+    """Teachers manage their own classes; admins manage every class."""
+    if role == 'admin':
+        return True
+    if role != 'teacher' or user_id is None or class_id is None:
+        return False
+    return db.session.query(Class.id).filter(Class.id == class_id, Class.teacher_id == user_id).first() is not None
+
+
+def mastery_band(p):
+    """Label of the highest MASTERY_BANDS lower bound at or below p."""
+    label = MASTERY_BANDS[0][0]
+    for name, lower in MASTERY_BANDS:
+        if p >= lower:
+            label = name
+    return label
+
+
+def _class_students(class_id):
+    return and_(ClassMembership.class_id == class_id, ClassMembership.role == 'student')
+
+
+def class_analytics(class_id, days=CLASS_ANALYTICS_DAYS, today=None):
+    """Aggregate one class's rollups over its local days. Returns (payload, student ids)."""
+    today = today or local_today(class_timezone(class_id))
+    start = today - datetime.timedelta(days=days - 1)
+    members = [int(uid) for (uid,) in db.session.query(ClassMembership.user_id).filter(
+        _class_students(class_id)).all()]
+    n = len(members)
+    member_join = (ClassMembership, and_(ClassMembership.user_id == MasterySnapshot.user_id,
+                                         _class_students(class_id)))
+
+    # Mastery: one row per (skill, 0.1-wide bin)
+    mastery_bin = case(*[(MasterySnapshot.mastery_prob >= i / MASTERY_BINS, i)
+                         for i in range(MASTERY_BINS - 1, 0, -1)], else_=0)
+    skills = {sk.id: (sk.standard_code, sk.name, sk.strand) for sk in reference_data.get().skills}
+    per_skill = {}
+    for sid, b, cnt, prob_sum, opps in db.session.query(
+        MasterySnapshot.skill_id, mastery_bin, func.count(MasterySnapshot.id),
+        func.sum(MasterySnapshot.mastery_prob), func.sum(MasterySnapshot.opportunities),
+    ).join(*member_join).filter(MasterySnapshot.opportunities > 0).group_by(MasterySnapshot.skill_id, mastery_bin):
+        s = per_skill.setdefault(int(sid), {'hist': [0] * MASTERY_BINS, 'sum': 0.0, 'opps': 0})
+        s['hist'][int(b)] += int(cnt)
+        s['sum'] += float(prob_sum or 0)
+        s['opps'] += int(opps or 0)
+    standards = []
+    for sid, (code, name, strand) in sorted(skills.items(), key=lambda kv: kv[1][0]):
+        s = per_skill.get(sid)
+        attempted = sum(s['hist']) if s else 0
+        bands = {label: 0 for label, _ in MASTERY_BANDS}
+        for i, count in enumerate(s['hist'] if s else ()):
+            bands[mastery_band(i / MASTERY_BINS)] += count
+        standards.append({
+            'code': code,
+            'name': name,
+            'strand': strand,
+            'grade': STANDARDS_BY_CODE.get(code, {}).get('grade', 5),
+            'attempted': attempted,
+            'not_started': max(0, n - attempted),
+            'avg_mastery': round(s['sum'] / attempted, 3) if attempted else None,
+            'opportunities': s['opps'] if s else 0,
+            'bands': bands,
+            'histogram': s['hist'] if s else [0] * MASTERY_BINS,
+        })
+
+    # Accuracy per mode (and challenge) from user_stats
+    per_mode = {}
+    for mode, ctype, players, total, correct, incorrect, successes, completed in db.session.query(
+        UserStat.mode, UserStat.challenge_type, func.count(func.distinct(UserStat.user_id)),
+        func.sum(UserStat.total), func.sum(UserStat.correct), func.sum(UserStat.incorrect),
+        func.sum(UserStat.successes), func.sum(UserStat.completed),
+    ).join(ClassMembership, and_(ClassMembership.user_id == UserStat.user_id, _class_students(class_id))
+           ).group_by(UserStat.mode, UserStat.challenge_type):
+        m = per_mode.setdefault(mode, {'mode': mode, 'players': 0, 'total_games': 0, 'correct': 0,
+                                       'incorrect': 0, 'successes': 0, 'completed': 0, 'by_challenge': {}})
+        m['players'] = max(m['players'], int(players))  # lower bound; a student may span challenges
+        m['total_games'] += int(total or 0)
+        m['correct'] += int(correct or 0)
+        m['incorrect'] += int(incorrect or 0)
+        m['successes'] += int(successes or 0)
+        m['completed'] += int(completed or 0)
+        answered = int(correct or 0) + int(incorrect or 0)
+        m['by_challenge'][ctype] = {
+            'players': int(players),
+            'total': int(total or 0),
+            'accuracy': (int(correct or 0) / answered) if answered else None,
+        }
+    modes = []
+    for m in sorted(per_mode.values(), key=lambda m: -m['total_games']):
+        answered = m['correct'] + m['incorrect']
+        m['accuracy'] = (m['correct'] / answered) if answered else None
+        modes.append(m)
+
+    # Activity over the window from daily_activity
+    da_filter = and_(DailyActivity.day >= start, DailyActivity.day <= today)
+    da_join = (ClassMembership, and_(ClassMembership.user_id == DailyActivity.user_id, _class_students(class_id)))
+    by_day = {day: (int(active), int(games or 0), int(xp or 0)) for day, active, games, xp in db.session.query(
+        DailyActivity.day, func.count(DailyActivity.user_id), func.sum(DailyActivity.games), func.sum(DailyActivity.xp),
+    ).join(*da_join).filter(da_filter).group_by(DailyActivity.day)}
+    active_students = db.session.query(func.count(func.distinct(DailyActivity.user_id))).join(
+        *da_join).filter(da_filter).scalar() or 0
+    activity_days = []
+    for i in range(days):
+        day = start + datetime.timedelta(days=i)
+        active, games, xp = by_day.get(day, (0, 0, 0))
+        activity_days.append({'day': day.isoformat(), 'active_students': active, 'games': games, 'xp': xp})
+
+    # Assignment progress: submissions per status, students who haven't started
+    assignments = {}
+    for aid, activity_id, due_at, status, subs, avg_score in db.session.query(
+        Assignment.id, Assignment.activity_id, Assignment.due_at, Submission.status,
+        func.count(Submission.id), func.avg(Submission.score),
+    ).outerjoin(Submission, Submission.assignment_id == Assignment.id).filter(
+        Assignment.class_id == class_id,
+    ).group_by(Assignment.id, Assignment.activity_id, Assignment.due_at, Submission.status):
+        a = assignments.setdefault(int(aid), {
+            'id': int(aid),
+            'activity_id': int(activity_id),
+            'due_at': due_at.isoformat() if due_at else None,
+            'by_status': {},
+            'submitted': 0,
+            'avg_score': None,
+        })
+        if status is None:
+            continue
+        a['by_status'][status] = int(subs)
+        a['submitted'] += int(subs)
+        if status == 'completed' and avg_score is not None:
+            a['avg_score'] = round(float(avg_score), 2)
+    for a in assignments.values():
+        a['not_started'] = max(0, n - a['submitted'])
+
+    return {
+        'class_id': class_id,
+        'students': n,
+        'generated_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'standards': standards,
+        'modes': modes,
+        'activity': {
+            'days': days,
+            'start': start.isoformat(),
+            'active_students': int(active_students),
+            'by_day': activity_days,
+        },
+        'assignments': sorted(assignments.values(), key=lambda a: a['id']),
+    }, members
+
+
+class ClassAnalyticsCache:
+    """Short-TTL cache of class_analytics() payloads keyed by (class_id, days).
+
+    Each cached class remembers its student ids, so a committed result from any
+    member drops that class's entries without a query (invalidate_user). Entries
+    otherwise expire after ttl_sec, which also bounds how long a roster change
+    goes unseen. One process only, like leaderboard_index.
+    """
+
+    def __init__(self, ttl_sec=CLASS_ANALYTICS_TTL_SEC):
+        self.ttl_sec = ttl_sec
+        self._entries = {}                  # (class_id, days) -> (expires_at, payload)
+        self._members = {}                  # class_id -> student ids of the cached build
+        self._classes = defaultdict(set)    # user_id -> cached class ids they belong to
+        self.metrics = {
+            'requests': 0,
+            'hits': 0,
+            'invalidations': 0,
+            'builds': 0,
+            'last_build_ms': None,
+            'total_build_ms': 0.0,
+        }
+
+    def get(self, class_id, days=CLASS_ANALYTICS_DAYS):
+        """Cached payload for the class, building it on a miss. Returns (payload, hit)."""
+        self.metrics['requests'] += 1
+        entry = self._entries.get((class_id, days))
+        if entry is not None and entry[0] > time.monotonic():
+            self.metrics['hits'] += 1
+            return entry[1], True
+        t0 = time.perf_counter()
+        payload, members = class_analytics(class_id, days)
+        ms = (time.perf_counter() - t0) * 1000
+        self.metrics['builds'] += 1
+        self.metrics['last_build_ms'] = round(ms, 2)
+        self.metrics['total_build_ms'] += ms
+        for uid in self._members.get(class_id, ()):
+            if uid not in members:
+                self._classes[uid].discard(class_id)
+        self._members[class_id] = set(members)
+        for uid in members:
+            self._classes[uid].add(class_id)
+        self._entries[(class_id, days)] = (time.monotonic() + self.ttl_sec, payload)
+        return payload, False
+
+    def invalidate_class(self, class_id):
+        stale = [key for key in self._entries if key[0] == class_id]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            self.metrics['invalidations'] += 1
+
+    def invalidate_user(self, user_id):
+        """A member's result was committed: drop every cached class they're in."""
+        for class_id in self._classes.get(user_id, ()):
+            self.invalidate_class(class_id)
+
+    def snapshot_metrics(self):
+        m = dict(self.metrics)
+        m['hit_ratio'] = round(m['hits'] / m['requests'], 3) if m['requests'] else None
+        m['avg_build_ms'] = round(m['total_build_ms'] / m['builds'], 2) if m['builds'] else None
+        m['total_build_ms'] = round(m['total_build_ms'], 2)
+        m['entries'] = len(self._entries)
+        return m
+
+
+class_analytics_cache = ClassAnalyticsCache()
+
+
+@app.get('/api/classes/<int:class_id>/analytics')
+@require_auth
+def api_class_analytics(class_id):
+    """Per-standard mastery distribution, per-mode accuracy, daily activity and
+    assignment progress for a class's students. ?days=N sets the activity
+    window (default 14, max 90). Teacher of the class or admin only."""
+    try:
+        days = max(1, min(int(request.args.get('days', CLASS_ANALYTICS_DAYS)), CLASS_ANALYTICS_MAX_DAYS))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'invalid_days'}), 400
+    if not _can_manage_class(g.user_id, g.role, class_id):
+        return jsonify({'error': 'forbidden'}), 403
+    payload, hit = class_analytics_cache.get(class_id, days)
+    return jsonify(dict(payload, cached=hit))
+
+
+@app.get('/api/metrics')
+@require_auth
+def api_metrics():
+    """In-process cache/queue metrics for operators (admin only)."""
+    if g.role != 'admin':
+        return jsonify({'error': 'forbidden'}), 403
+    return jsonify({
+        'leaderboard': leaderboard_index.snapshot_metrics(),
+        'events': event_buffer.snapshot_metrics(),
+        'class_analytics': class_analytics_cache.snapshot_metrics(),
+        'reference_data': reference_data.snapshot_metrics(),
+        'google_certs': google_certs.snapshot_metrics(),
+        'auth_tokens': auth_tokens.snapshot_metrics(),
+        'room_sync': room_sync.snapshot_metrics(),
+    })
+
+
+@app.post('/api/reference-data/reload')
+@require_auth
+def api_reload_reference_data():
+    """Drop the cached skills/achievements/shop catalogs after editing them (admin only)."""
+    if g.role != 'admin':
+        return jsonify({'error': 'forbidden'}), 403
+    reference_data.invalidate()
+    return jsonify({'ok': True, 'version': reference_data.version})
+
+
 @app.get('/dashboard')
 def dashboard_page():
     return render_template('dashboard.html')
@@ -1780,8 +5387,14 @@ RARITY_ORDER = {'common': 0, 'rare': 1, 'epic': 2, 'legendary': 3}
 RARITY_COLORS = {'common': '#9ca3af', 'rare': '#3b82f6', 'epic': '#a855f7', 'legendary': '#f59e0b'}
 
 
+_shop_seeded = False
+
 def ensure_shop_seed():
     """Seed the shop with starter items if empty."""
+    global _shop_seeded
+    if _shop_seeded:
+        return
+    _shop_seeded = True
     if ShopItem.query.first():
         return
 
@@ -1840,13 +5453,13 @@ def ensure_shop_seed():
 
     db.session.add_all(items)
     db.session.commit()
+    reference_data.invalidate()
 
 
 @app.get('/api/shop')
 @require_auth
 def api_shop():
     """Browse shop items with ownership/equipped status."""
-    ensure_shop_seed()
     uid = g.user_id
     user = User.query.get(uid)
     coins = int(user.coins or 0) if user else 0
@@ -1854,9 +5467,8 @@ def api_shop():
     # Get user's owned items
     owned = {ui.item_id: ui.equipped for ui in UserItem.query.filter_by(user_id=uid).all()}
 
-    all_items = ShopItem.query.order_by(ShopItem.category, ShopItem.price).all()
     items_out = []
-    for item in all_items:
+    for item in reference_data.get().shop_items:
         items_out.append({
             'id': int(item.id),
             'code': item.code,
@@ -1884,15 +5496,15 @@ def api_shop():
 @require_auth
 def api_shop_buy():
     """Purchase a shop item."""
-    ensure_shop_seed()
     body = request.get_json(silent=True) or {}
     item_id = body.get('item_id')
     if not item_id:
         return jsonify({'error': 'missing item_id'}), 400
 
-    item = ShopItem.query.get(item_id)
+    item = reference_data.get().shop_item(item_id)
     if not item:
         return jsonify({'error': 'item_not_found'}), 404
+    item_id = item.id
 
     user = User.query.get(g.user_id)
     if not user:
@@ -1942,9 +5554,10 @@ def api_shop_equip():
     if not item_id:
         return jsonify({'error': 'missing item_id'}), 400
 
-    item = ShopItem.query.get(item_id)
+    item = reference_data.get().shop_item(item_id)
     if not item:
         return jsonify({'error': 'item_not_found'}), 404
+    item_id = item.id
 
     ui = UserItem.query.filter_by(user_id=g.user_id, item_id=item_id).first()
     if not ui:
@@ -1952,9 +5565,10 @@ def api_shop_equip():
 
     if equip:
         # Unequip any other item in same category
-        category_items = db.session.query(UserItem).join(ShopItem).filter(
+        same_category = [i.id for i in reference_data.get().shop_items if i.category == item.category]
+        category_items = db.session.query(UserItem).filter(
             UserItem.user_id == g.user_id,
-            ShopItem.category == item.category,
+            UserItem.item_id.in_(same_category),
             UserItem.equipped == True
         ).all()
         for ci in category_items:
@@ -1964,6 +5578,8 @@ def api_shop_equip():
         ui.equipped = False
 
     db.session.commit()
+    # Titles and frames show on the leaderboard
+    leaderboard_index.invalidate(int(g.user_id))
 
     return jsonify({
         'ok': True,
@@ -1981,15 +5597,240 @@ def shop_page():
 @require_auth
 def api_my_theme():
     """Lightweight endpoint returning only the user's equipped board theme CSS vars."""
-    equipped = UserItem.query.filter_by(user_id=g.user_id, equipped=True).all()
-    for ui in equipped:
-        item = ShopItem.query.get(ui.item_id)
+    ref = reference_data.get()
+    equipped = db.session.query(UserItem.item_id).filter_by(user_id=g.user_id, equipped=True).all()
+    for (item_id,) in equipped:
+        item = ref.shop_item(item_id)
         if item and item.category == 'board_theme' and item.data_json:
             return jsonify({'theme': item.data_json, 'name': item.name})
     return jsonify({'theme': None})
 
 
+# ---- Room state sync ----
+# Accepted state updates used to be rebroadcast as the whole snapshot (every
+# player, meme and powerup) at up to 20 Hz. Clients that load static/state_sync.js
+# opt in with a `state_sync` event and then receive `state_patch` messages
+# instead: JSON-patch-style ops against the previous broadcast, stamped with a
+# per room/mode version. A client whose version doesn't match a patch's `base`
+# (it fell behind, or it was the sender of the previous update) asks for a full
+# snapshot with `request_state`. Clients that never opt in keep getting the full
+# `state_update` as before.
+#
+# Room states are replaced on every update and never mutated in place (see
+# handle_state_update), so the last broadcast can be held by reference and
+# unchanged subtrees shared with it are skipped by identity.
+
+ROOM_SYNC_MAX_OPS = int(os.environ.get('ROOM_SYNC_MAX_OPS', '256'))  # more than this: send the snapshot
+ROOM_SYNC_RECORD_DIR = os.environ.get('ROOM_SYNC_RECORD_DIR')  # record broadcasts for `flask bench-room-sync`
+
+patch_sync_sids = set()  # sids that opted into state_patch
+
+
+def _pointer_token(key):
+    return str(key).replace('~', '~0').replace('/', '~1')
+
+
+def state_diff(old, new, path='', ops=None):
+    """JSON-patch ops (add/replace/remove) turning `old` into `new`. Lists of
+    equal prefix are patched element-wise; the tail is added or removed."""
+    if ops is None:
+        ops = []
+    if old is new:
+        return ops
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key, value in new.items():
+            sub = f'{path}/{_pointer_token(key)}'
+            if key not in old:
+                ops.append({'op': 'add', 'path': sub, 'value': value})
+            else:
+                state_diff(old[key], value, sub, ops)
+        for key in old:
+            if key not in new:
+                ops.append({'op': 'remove', 'path': f'{path}/{_pointer_token(key)}'})
+    elif isinstance(old, list) and isinstance(new, list):
+        common = min(len(old), len(new))
+        for i in range(common):
+            state_diff(old[i], new[i], f'{path}/{i}', ops)
+        for i in range(common, len(new)):
+            ops.append({'op': 'add', 'path': f'{path}/{i}', 'value': new[i]})
+        for i in range(len(old) - 1, common - 1, -1):
+            ops.append({'op': 'remove', 'path': f'{path}/{i}'})
+    elif type(old) is not type(new) or old != new:  # 1 == True, but not in JSON
+        ops.append({'op': 'replace', 'path': path, 'value': new})
+    return ops
+
+
+class RoomStateSync:
+    """Version counter and last broadcast state per (room, mode)."""
+
+    def __init__(self, max_ops=ROOM_SYNC_MAX_OPS):
+        self.max_ops = max_ops
+        self._rooms = {}  # (room, mode) -> (version, state)
+        self.metrics = {
+            'broadcasts': 0,
+            'patches': 0,
+            'snapshots': 0,
+            'ops': 0,
+            'snapshot_requests': 0,
+        }
+
+    def advance(self, room, mode, state):
+        """Record `state` as the next broadcast. Returns (version, base, ops);
+        ops is None when a full snapshot should be sent instead."""
+        version, last = self._rooms.get((room, mode), (0, None))
+        ops = state_diff(last, state) if last is not None else None
+        if ops is not None and len(ops) > self.max_ops:
+            ops = None
+        self._rooms[(room, mode)] = (version + 1, state)
+        self.metrics['broadcasts'] += 1
+        if ops is None:
+            self.metrics['snapshots'] += 1
+        else:
+            self.metrics['patches'] += 1
+            self.metrics['ops'] += len(ops)
+        return version + 1, version, ops
+
+    def snapshot(self, room, mode):
+        """(version, state) of the last broadcast, or (0, None)."""
+        return self._rooms.get((room, mode), (0, None))
+
+    def snapshot_metrics(self):
+        m = dict(self.metrics)
+        m['rooms'] = len(self._rooms)
+        m['patch_clients'] = len(patch_sync_sids)
+        m['avg_ops'] = round(m['ops'] / m['patches'], 1) if m['patches'] else None
+        return m
+
+
+room_sync = RoomStateSync()
+
+
+def sync_room(room, patch):
+    """Socket.IO room for one room's patch or full-snapshot listeners."""
+    return f'{room}#patch' if patch else f'{room}#full'
+
+
+def _record_broadcast(room, mode, client_id, state):
+    import json
+    name = ''.join(c if c.isalnum() else '_' for c in f'{room}-{mode}')
+    with open(os.path.join(ROOM_SYNC_RECORD_DIR, f'{name}.jsonl'), 'a') as fh:
+        fh.write(json.dumps({'t': time.time(), 'room': room, 'mode': mode,
+                             'clientId': client_id, 'state': state}) + '\n')
+
+
+def broadcast_room_state(room, mode, client_id, state):
+    """Send an accepted state to the rest of the room: a patch to opted-in
+    clients, the full snapshot to everyone else."""
+    version, base, ops = room_sync.advance(room, mode, state)
+    if ROOM_SYNC_RECORD_DIR:
+        _record_broadcast(room, mode, client_id, state)
+    members = room_members.get(room, ())
+    if any(sid not in patch_sync_sids for sid in members):
+        emit('state_update', {'room': room, 'mode': mode, 'clientId': client_id, 'state': state},
+             room=sync_room(room, False), include_self=False)
+    if any(sid in patch_sync_sids for sid in members):
+        msg = {'room': room, 'mode': mode, 'clientId': client_id, 'version': version}
+        if ops is None:
+            msg['state'] = state
+        else:
+            msg['base'] = base
+            msg['ops'] = ops
+        emit('state_patch', msg, room=sync_room(room, True), include_self=False)
+
+
+def room_state_message(room, mode):
+    """Payload for a `state` reply. Patch clients get the last broadcast with
+    its version, so the next patch applies on top of exactly that."""
+    if request.sid in patch_sync_sids:
+        version, state = room_sync.snapshot(room, mode)
+        if state is None:
+            state = rooms_state[room].get(mode)
+        return {'room': room, 'mode': mode, 'state': state, 'version': version}
+    return {'room': room, 'mode': mode, 'state': rooms_state[room].get(mode)}
+
+
+@app.cli.command('bench-room-sync')
+@click.argument('recording', type=click.Path(exists=True, dir_okay=False))
+@click.option('--spectators', default=1, show_default=True,
+              help='Listeners that never send, besides the clients in the recording.')
+def bench_room_sync_command(recording, spectators):
+    """Replay a recorded room (ROOM_SYNC_RECORD_DIR) and compare the bytes each
+    listener receives as full-snapshot broadcasts against state_patch messages.
+
+    Every client in the recording plus `spectators` listens. A broadcast goes
+    to everyone but its sender, so a sender's copy stays one version behind and
+    the next patch it receives triggers a request_state; the `state` snapshot
+    that answers it is counted with the patch bytes, as in static/state_sync.js."""
+    import json
+    sync = RoomStateSync()
+    broadcasts = []
+    with open(recording) as fh:
+        for line in fh:
+            if line.strip():
+                broadcasts.append(json.loads(line))
+    if not broadcasts:
+        raise click.ClickException(f'no broadcasts in {recording}')
+    listeners = list(dict.fromkeys(rec.get('clientId') for rec in broadcasts))
+    listeners += [('spectator', n) for n in range(spectators)]
+    versions = dict.fromkeys(listeners, 0)  # each listener's copy, as state_sync.js tracks it
+    full_bytes = patch_bytes = resync_bytes = resyncs = 0
+    encode_sec = 0.0
+    for rec in broadcasts:
+        room, mode, client_id, state = rec['room'], rec['mode'], rec.get('clientId'), rec['state']
+        full = len(json.dumps({'room': room, 'mode': mode, 'clientId': client_id, 'state': state},
+                              separators=(',', ':')))
+        t0 = time.perf_counter()
+        version, base, ops = sync.advance(room, mode, state)
+        encode_sec += time.perf_counter() - t0
+        msg = {'room': room, 'mode': mode, 'clientId': client_id, 'version': version}
+        msg.update({'state': state} if ops is None else {'base': base, 'ops': ops})
+        patch = len(json.dumps(msg, separators=(',', ':')))
+        snapshot = None
+        for listener in listeners:
+            if listener == client_id:
+                continue  # include_self=False: the sender's copy falls behind
+            full_bytes += full
+            patch_bytes += patch
+            if ops is not None and versions[listener] != base:
+                if snapshot is None:
+                    request = {'room': room, 'mode': mode}
+                    reply = {'room': room, 'mode': mode, 'state': state, 'version': version}
+                    snapshot = (len(json.dumps(request, separators=(',', ':')))
+                                + len(json.dumps(reply, separators=(',', ':'))))
+                resync_bytes += snapshot
+                resyncs += 1
+            versions[listener] = version
+    span = max(broadcasts[-1]['t'] - broadcasts[0]['t'], 1e-9)
+    n = len(listeners)
+    total_patch = patch_bytes + resync_bytes
+    click.echo(f'room-sync: {len(broadcasts)} broadcasts over {span:.1f}s to {n} listeners '
+               f'({sync.metrics["snapshots"]} snapshots, avg {sync.snapshot_metrics()["avg_ops"]} ops/patch)')
+    click.echo(f'room-sync: full  {full_bytes:>10} bytes  {full_bytes / n / span / 1024:8.1f} KiB/s per listener')
+    click.echo(f'room-sync: patch {total_patch:>10} bytes  {total_patch / n / span / 1024:8.1f} KiB/s per listener '
+               f'({100.0 * (1 - total_patch / full_bytes):.1f}% less)')
+    click.echo(f'room-sync:   of which {resyncs} resyncs, {resync_bytes} bytes '
+               f'({100.0 * resync_bytes / max(total_patch, 1):.1f}% of patch traffic)')
+    click.echo(f'room-sync: diff cost {encode_sec / len(broadcasts) * 1e6:.0f} us/broadcast')
+
+
+@socketio.on('state_sync')
+def handle_state_sync(data):
+    """Client opts into state_patch messages (static/state_sync.js)."""
+    if (data or {}).get('protocol') != 'patch':
+        return
+    patch_sync_sids.add(request.sid)
+    for room, members in list(room_members.items()):
+        if request.sid in members:  # opted in after joining
+            leave_room(sync_room(room, False))
+            join_room(sync_room(room, True))
+
+
 # Socket.IO events
+def user_room(user_id):
+    """Socket.IO room holding every authenticated connection of one user."""
+    return f'user:{int(user_id)}'
+
+
 @socketio.on('connect')
 def handle_connect(auth):
     # Accept unauthenticated for now to avoid breaking existing clients; if token supplied, verify.
@@ -2001,9 +5842,11 @@ def handle_connect(auth):
         token = None
     if token:
         try:
-            claims = jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
-            request.environ['uid'] = claims.get('uid')
-            request.environ['role'] = claims.get('role')
+            request.environ['auth_user'] = auth_tokens.verify(token)
+            user = socket_user()
+            if user.user_id is not None:
+                join_room(user_room(user.user_id))  # per-user pushes (e.g. result_processed)
+                flush_result_outbox(user.user_id, request.sid)
         except Exception:
             # Reject if an invalid token was explicitly provided
             return False
@@ -2024,6 +5867,7 @@ def handle_join(data):
             pass
 
     join_room(room)
+    join_room(sync_room(room, request.sid in patch_sync_sids))
     room_members[room].add(request.sid)
 
     # Team role assignment (Battleship and Meme Wars): first joiner = 'A', second = 'B', others spectate
@@ -2042,9 +5886,9 @@ def handle_join(data):
     # Send current presence to room
     emit('presence', {'room': room, 'count': len(room_members[room])}, room=room)
     # Optionally send the current state to the new client
-    st = rooms_state[room].get(mode)
-    if st is not None:
-        emit('state', {'room': room, 'mode': mode, 'state': st})
+    msg = room_state_message(room, mode)
+    if msg['state'] is not None:
+        emit('state', msg)
 
 
 @socketio.on('leave')
@@ -2052,6 +5896,7 @@ def handle_leave(data):
     room = (data or {}).get('room') or request.args.get('room') or request.path or '/'
     mode = (data or {}).get('mode') or 'plane'
     leave_room(room)
+    leave_room(sync_room(room, request.sid in patch_sync_sids))
 
     # Free team role if applicable for Battleship or Meme Wars
     if (mode or '').lower() in ('battleship', 'memewars', 'meme-wars'):
@@ -2069,6 +5914,7 @@ def handle_leave(data):
 
 @socketio.on('disconnect')
 def handle_disconnect():
+    patch_sync_sids.discard(request.sid)
     # Remove from all rooms where present
     for room, members in list(room_members.items()):
         if request.sid in members:
@@ -2087,8 +5933,9 @@ def handle_disconnect():
 def handle_request_state(data):
     room = (data or {}).get('room') or request.args.get('room') or request.path or '/'
     mode = (data or {}).get('mode') or 'plane'
-    state = rooms_state[room].get(mode)
-    emit('state', {'room': room, 'mode': mode, 'state': state})
+    if request.sid in patch_sync_sids:
+        room_sync.metrics['snapshot_requests'] += 1
+    emit('state', room_state_message(room, mode))
 
 
 @socketio.on('state_update')
@@ -2159,7 +6006,7 @@ def handle_state_update(data):
         t = time.time()
         last_emit = float(last_emit_ts[room].get(mode) or 0.0)
         if (t - last_emit) >= EMIT_INTERVAL_MIN:
-            emit('state_update', {'room': room, 'mode': mode, 'clientId': client_id, 'state': out_state}, room=room, include_self=False)
+            broadcast_room_state(room, mode, client_id, out_state)
             last_emit_ts[room][mode] = t
         # always update last_state_ts to reflect owner activity
         last_state_ts[room][mode] = t
@@ -2232,4 +6079,7 @@ if __name__ == '__main__':
     # Use SocketIO server to enable WebSockets and listen on all interfaces for LAN access
     host = os.environ.get('HOST', '0.0.0.0')
     port = int(os.environ.get('PORT', '5000'))
+    with app.app_context():
+        ensure_dev_schema()
+        bootstrap_database()
     socketio.run(app, host=host, port=port, debug=True, allow_unsafe_werkzeug=True)
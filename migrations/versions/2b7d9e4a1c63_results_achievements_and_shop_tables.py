@@ -0,0 +1,118 @@
+"""results, achievements and shop tables; users display_name/coins/total_xp
+
+These used to exist only through db.create_all() and ALTER TABLE at app
+import. Databases that went through that already have them, so each table
+and column is created only when missing.
+
+Revision ID: 2b7d9e4a1c63
+Revises: e6c37f7b89ac
+Create Date: 2026-10-17 10:02:18.904455
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2b7d9e4a1c63'
+down_revision = 'e6c37f7b89ac'
+branch_labels = None
+depends_on = None
+
+BigInt = sa.BigInteger().with_variant(sa.Integer(), 'sqlite')
+
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+    user_columns = {c['name'] for c in inspector.get_columns('users')}
+    for column in (
+        sa.Column('display_name', sa.Text(), nullable=True),
+        sa.Column('coins', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('total_xp', sa.Integer(), nullable=True),
+    ):
+        if column.name not in user_columns:
+            op.add_column('users', column)
+
+    if 'game_results' not in existing:
+        op.create_table('game_results',
+        sa.Column('id', BigInt, autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('mode', sa.Text(), nullable=False),
+        sa.Column('game_name', sa.Text(), nullable=False),
+        sa.Column('outcome', sa.Text(), nullable=True),
+        sa.Column('score', sa.Numeric(10, 2), nullable=True),
+        sa.Column('duration_ms', sa.BigInteger(), nullable=True),
+        sa.Column('room_pin', sa.Text(), nullable=True),
+        sa.Column('activity_id', sa.BigInteger(), nullable=True),
+        sa.Column('details_json', sa.JSON(), nullable=True),
+        sa.Column('played_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.ForeignKeyConstraint(['activity_id'], ['activities.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id')
+        )
+        op.create_index('ix_results_user_mode', 'game_results', ['user_id', 'mode'], unique=False)
+    if 'achievements' not in existing:
+        op.create_table('achievements',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('code', sa.Text(), nullable=False),
+        sa.Column('title', sa.Text(), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('mode', sa.Text(), nullable=True),
+        sa.Column('threshold', sa.Integer(), nullable=False),
+        sa.Column('icon', sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('code')
+        )
+    if 'user_achievements' not in existing:
+        op.create_table('user_achievements',
+        sa.Column('id', BigInt, autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('achievement_id', sa.BigInteger(), nullable=False),
+        sa.Column('unlocked_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.ForeignKeyConstraint(['achievement_id'], ['achievements.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'achievement_id', name='uq_user_achievement_once')
+        )
+    if 'shop_items' not in existing:
+        op.create_table('shop_items',
+        sa.Column('id', BigInt, autoincrement=True, nullable=False),
+        sa.Column('code', sa.Text(), nullable=False),
+        sa.Column('name', sa.Text(), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('category', sa.Text(), nullable=False),
+        sa.Column('rarity', sa.Text(), nullable=False),
+        sa.Column('price', sa.Integer(), nullable=False),
+        sa.Column('icon', sa.Text(), nullable=True),
+        sa.Column('data_json', sa.JSON(), nullable=True),
+        sa.CheckConstraint("category IN ('title','board_theme','avatar_frame')", name='ck_shop_category'),
+        sa.CheckConstraint("rarity IN ('common','rare','epic','legendary')", name='ck_shop_rarity'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('code')
+        )
+    if 'user_items' not in existing:
+        op.create_table('user_items',
+        sa.Column('id', BigInt, autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('item_id', sa.BigInteger(), nullable=False),
+        sa.Column('equipped', sa.Boolean(), nullable=False),
+        sa.Column('acquired_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.ForeignKeyConstraint(['item_id'], ['shop_items.id'], ),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'item_id', name='uq_user_item_once')
+        )
+
+
+def downgrade():
+    op.drop_table('user_items')
+    op.drop_table('shop_items')
+    op.drop_table('user_achievements')
+    op.drop_table('achievements')
+    op.drop_index('ix_results_user_mode', table_name='game_results', if_exists=True)
+    op.drop_table('game_results')
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('total_xp')
+        batch_op.drop_column('coins')
+        batch_op.drop_column('display_name')
@@ -0,0 +1,32 @@
+"""hot query indexes: results by user/played_at and user/outcome, users by total_xp
+
+Revision ID: 3f1d2c9a7b10
+Revises: 5c8e41b2d9f7
+Create Date: 2026-10-16 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1d2c9a7b10'
+down_revision = '5c8e41b2d9f7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # if_not_exists: dev databases may already have these from db.create_all()
+    op.create_index('ix_results_user_played', 'game_results',
+                    ['user_id', sa.text('played_at DESC')], unique=False, if_not_exists=True)
+    op.create_index('ix_results_user_outcome', 'game_results',
+                    ['user_id', 'outcome'], unique=False, if_not_exists=True)
+    op.create_index('ix_users_total_xp', 'users',
+                    ['total_xp'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_users_total_xp', table_name='users', if_exists=True)
+    op.drop_index('ix_results_user_outcome', table_name='game_results', if_exists=True)
+    op.drop_index('ix_results_user_played', table_name='game_results', if_exists=True)
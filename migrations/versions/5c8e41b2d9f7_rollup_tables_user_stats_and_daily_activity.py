@@ -0,0 +1,63 @@
+"""rollup tables: user_stats and daily_activity
+
+Revision ID: 5c8e41b2d9f7
+Revises: 2b7d9e4a1c63
+Create Date: 2026-10-17 10:14:52.630118
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c8e41b2d9f7'
+down_revision = '2b7d9e4a1c63'
+branch_labels = None
+depends_on = None
+
+BigInt = sa.BigInteger().with_variant(sa.Integer(), 'sqlite')
+
+
+def upgrade():
+    # dev databases may already have these from db.create_all()
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+    if 'user_stats' not in existing:
+        op.create_table('user_stats',
+        sa.Column('id', BigInt, autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('mode', sa.Text(), nullable=False),
+        sa.Column('challenge_type', sa.Text(), nullable=False),
+        sa.Column('total', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('correct', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('incorrect', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('successes', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('completed', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('scored', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('score_sum', sa.Numeric(14, 2), server_default=sa.text('0'), nullable=False),
+        sa.Column('score_max', sa.Numeric(10, 2), nullable=True),
+        sa.Column('success_run', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('last_played_on', sa.Date(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('(CURRENT_TIMESTAMP)'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'mode', 'challenge_type', name='uq_user_stats_key')
+        )
+    if 'daily_activity' not in existing:
+        # quest_json arrives in d73b1f0e9a28
+        op.create_table('daily_activity',
+        sa.Column('id', BigInt, autoincrement=True, nullable=False),
+        sa.Column('user_id', sa.BigInteger(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('xp', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('games', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('user_id', 'day', name='uq_daily_activity_user_day')
+        )
+        op.create_index('ix_daily_activity_day', 'daily_activity', ['day'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_daily_activity_day', table_name='daily_activity', if_exists=True)
+    op.drop_table('daily_activity')
+    op.drop_table('user_stats')
@@ -0,0 +1,51 @@
+"""persisted streaks and activity bitmap on users, class timezone
+
+Revision ID: 8b52e0d4c6a1
+Revises: 3f1d2c9a7b10
+Create Date: 2026-10-16 14:05:22.402917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b52e0d4c6a1'
+down_revision = '3f1d2c9a7b10'
+branch_labels = None
+depends_on = None
+
+
+def _add_missing(table, *columns):
+    # app startup may already have added these (dev auto-migration); SQLite has
+    # no ADD COLUMN IF NOT EXISTS, so check the live schema instead
+    existing = {c['name'] for c in sa.inspect(op.get_bind()).get_columns(table)}
+    for column in columns:
+        if column.name not in existing:
+            op.add_column(table, column)
+
+
+def upgrade():
+    _add_missing(
+        'users',
+        sa.Column('current_streak', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('best_streak', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('last_active_date', sa.Date(), nullable=True),
+        sa.Column('last_active_games', sa.Integer(), server_default=sa.text('0'), nullable=False),
+        sa.Column('activity_bitmap', sa.LargeBinary(), nullable=True),
+    )
+    _add_missing('classes', sa.Column('timezone', sa.Text(), nullable=True))
+    op.create_index('ix_class_memberships_user', 'class_memberships', ['user_id'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_class_memberships_user', table_name='class_memberships', if_exists=True)
+    with op.batch_alter_table('classes', schema=None) as batch_op:
+        batch_op.drop_column('timezone')
+
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_column('activity_bitmap')
+        batch_op.drop_column('last_active_games')
+        batch_op.drop_column('last_active_date')
+        batch_op.drop_column('best_streak')
+        batch_op.drop_column('current_streak')
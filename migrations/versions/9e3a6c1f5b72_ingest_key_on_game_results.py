@@ -0,0 +1,33 @@
+"""ingest_key on game_results for idempotent result queue replays
+
+Revision ID: 9e3a6c1f5b72
+Revises: d73b1f0e9a28
+Create Date: 2026-10-17 11:20:06.331742
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e3a6c1f5b72'
+down_revision = 'd73b1f0e9a28'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the dev server's ensure_dev_schema() may already have added it
+    existing = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('game_results')}
+    if 'ingest_key' not in existing:
+        op.add_column('game_results', sa.Column('ingest_key', sa.Text(), nullable=True))
+    # played_at is in the key because unique indexes on the partitioned
+    # Postgres table must include the partition key
+    op.create_index('uq_results_ingest_key', 'game_results', ['ingest_key', 'played_at'],
+                    unique=True, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('uq_results_ingest_key', table_name='game_results', if_exists=True)
+    with op.batch_alter_table('game_results', schema=None) as batch_op:
+        batch_op.drop_column('ingest_key')
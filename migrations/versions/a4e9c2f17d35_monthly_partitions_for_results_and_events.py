@@ -0,0 +1,131 @@
+"""monthly range partitions for game_results and events (Postgres only)
+
+Revision ID: a4e9c2f17d35
+Revises: 8b52e0d4c6a1
+Create Date: 2026-10-16 23:02:11.540193
+
+"""
+import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a4e9c2f17d35'
+down_revision = '8b52e0d4c6a1'
+branch_labels = None
+depends_on = None
+
+
+# table -> (partition key, foreign keys, indexes); partitioned tables need the
+# key in the primary key, so (id, key) replaces (id)
+TABLES = {
+    'game_results': ('played_at', [
+        ('user_id', 'users'),
+        ('activity_id', 'activities'),
+    ], [
+        ('ix_results_user_mode', 'user_id, mode'),
+        ('ix_results_user_played', 'user_id, played_at DESC'),
+        ('ix_results_user_outcome', 'user_id, outcome'),
+    ]),
+    'events': ('timestamp', [
+        ('user_id', 'users'),
+        ('session_id', 'sessions'),
+        ('activity_id', 'activities'),
+        ('skill_id', 'skills'),
+    ], []),
+}
+MONTHS_AHEAD = 3
+
+
+def _next_month(day):
+    return (day.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def _rename_aside(table, new_name, indexes):
+    """Rename a table and its primary key index out of the way (index names are
+    schema-wide, so the replacement table couldn't create its own otherwise)."""
+    bind = op.get_bind()
+    op.execute(f'ALTER TABLE {table} RENAME TO {new_name}')
+    pkey = bind.execute(sa.text(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:t) AND contype = 'p'"),
+        {'t': new_name}).scalar()
+    if pkey:
+        op.execute(f'ALTER TABLE {new_name} RENAME CONSTRAINT {pkey} TO {new_name}_pkey')
+    for name, _cols in indexes:
+        op.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+def _partition(table, key, fkeys, indexes):
+    bind = op.get_bind()
+    partitioned = bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t)"), {'t': table}).first()
+    if partitioned:
+        return
+    old = f'{table}_unpartitioned'
+    _rename_aside(table, old, indexes)
+    op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+               f'PARTITION BY RANGE ("{key}")')
+    op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id, "{key}")')
+    for column, target in fkeys:
+        op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY ({column}) REFERENCES {target} (id)')
+    for name, cols in indexes:
+        op.execute(f'CREATE INDEX {name} ON {table} ({cols})')
+
+    # One partition per month from the oldest row through MONTHS_AHEAD, plus a
+    # default partition so an unexpected timestamp never fails an insert
+    oldest = bind.execute(sa.text(f'SELECT min("{key}") FROM {old}')).scalar()
+    month = (oldest.date() if oldest else datetime.date.today()).replace(day=1)
+    last = datetime.date.today().replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while month <= last:
+        end = _next_month(month)
+        op.execute(f"CREATE TABLE {table}_y{month.year}m{month.month:02d} PARTITION OF {table} "
+                   f"FOR VALUES FROM ('{month.isoformat()} 00:00:00+00') TO ('{end.isoformat()} 00:00:00+00')")
+        month = end
+    op.execute(f'CREATE TABLE {table}_default PARTITION OF {table} DEFAULT')
+
+    op.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+    seq = bind.execute(sa.text("SELECT pg_get_serial_sequence(:t, 'id')"), {'t': old}).scalar()
+    if seq:
+        op.execute(f'ALTER SEQUENCE {seq} OWNED BY {table}.id')
+    op.execute(f'DROP TABLE {old}')
+
+
+def _unpartition(table, key, fkeys, indexes):
+    bind = op.get_bind()
+    partitioned = bind.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(:t)"), {'t': table}).first()
+    if not partitioned:
+        return
+    old = f'{table}_partitioned'
+    _rename_aside(table, old, indexes)
+    op.execute(f'CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    op.execute(f'ALTER TABLE {table} ADD PRIMARY KEY (id)')
+    for column, target in fkeys:
+        op.execute(f'ALTER TABLE {table} ADD FOREIGN KEY ({column}) REFERENCES {target} (id)')
+    for name, cols in indexes:
+        op.execute(f'CREATE INDEX {name} ON {table} ({cols})')
+    op.execute(f'INSERT INTO {table} SELECT * FROM {old}')
+    seq = bind.execute(sa.text("SELECT pg_get_serial_sequence(:t, 'id')"), {'t': old}).scalar()
+    if seq:
+        op.execute(f'ALTER SEQUENCE {seq} OWNED BY {table}.id')
+    op.execute(f'DROP TABLE {old}')  # drops its partitions too
+
+
+def upgrade():
+    # SQLite has no declarative partitioning; `flask apply-retention` moves old
+    # months into per-month archive tables there instead
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, spec in TABLES.items():
+        _partition(table, *spec)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for table, spec in TABLES.items():
+        _unpartition(table, *spec)
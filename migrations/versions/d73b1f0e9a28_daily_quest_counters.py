@@ -0,0 +1,27 @@
+"""daily quest counters on daily_activity
+
+Revision ID: d73b1f0e9a28
+Revises: a4e9c2f17d35
+Create Date: 2026-10-16 23:48:37.215904
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd73b1f0e9a28'
+down_revision = 'a4e9c2f17d35'
+branch_labels = None
+depends_on = '5c8e41b2d9f7'  # creates daily_activity
+
+
+def upgrade():
+    # the dev server's ensure_dev_schema() may already have added it
+    existing = {c['name'] for c in sa.inspect(op.get_bind()).get_columns('daily_activity')}
+    if 'quest_json' not in existing:
+        op.add_column('daily_activity', sa.Column('quest_json', sa.JSON(), nullable=True))
+
+
+def downgrade():
+    op.drop_column('daily_activity', 'quest_json')
@@ -4511,6 +4511,7 @@
 
     if (typeof io !== 'undefined') {
       const socket = io();
+      window.StateSync?.install(socket);
 
       socket.on('connect', () => {
         setPresence(1, true);
@@ -129,6 +129,7 @@
 
     if (typeof io !== 'undefined') {
       socket = io();
+      window.StateSync?.install(socket);
       wireSocket();
     } else {
       setPresence(0, false);
@@ -53,6 +53,7 @@
 
   // Connection
   const socket = io();
+  window.StateSync?.install(socket);
   let clientId = Math.random().toString(36).slice(2, 10);
 
   // Shared state with room
@@ -0,0 +1,92 @@
+// Client side of the room state sync protocol (see "Room state sync" in app.py).
+//
+// StateSync.install(socket) opts the socket into `state_patch` messages, keeps a
+// versioned copy of each room/mode state, applies the patches to it and hands
+// the result to the page's existing `state_update` listeners, so game code
+// doesn't change. A patch whose base doesn't match our version (we fell behind,
+// or we sent the previous update ourselves) triggers a `request_state` for a
+// full snapshot; patches are ignored until it arrives.
+(function () {
+  function clone(v) {
+    return v == null ? v : JSON.parse(JSON.stringify(v));
+  }
+
+  function unescapeToken(t) {
+    return t.replace(/~1/g, '/').replace(/~0/g, '~');
+  }
+
+  function applyOps(doc, ops) {
+    for (const op of ops) {
+      if (op.path === '') { doc = op.value; continue; }
+      const parts = op.path.split('/').slice(1).map(unescapeToken);
+      let parent = doc;
+      for (let i = 0; i < parts.length - 1; i++) {
+        parent = parent[Array.isArray(parent) ? Number(parts[i]) : parts[i]];
+        if (parent == null || typeof parent !== 'object') throw new Error('bad patch path ' + op.path);
+      }
+      const last = parts[parts.length - 1];
+      if (Array.isArray(parent)) {
+        const idx = Number(last);
+        if (op.op === 'remove') parent.splice(idx, 1);
+        else if (op.op === 'add') parent.splice(idx, 0, op.value);
+        else parent[idx] = op.value;
+      } else if (op.op === 'remove') {
+        delete parent[last];
+      } else {
+        parent[last] = op.value;
+      }
+    }
+    return doc;
+  }
+
+  function install(socket) {
+    const mirrors = {}; // 'room|mode' -> { version, state, resyncing }
+    const keyOf = (msg) => msg.room + '|' + msg.mode;
+
+    function resync(msg) {
+      const k = keyOf(msg);
+      const m = mirrors[k] || (mirrors[k] = { version: -1, state: null });
+      if (m.resyncing) return;
+      m.resyncing = true;
+      socket.emit('request_state', { room: msg.room, mode: msg.mode });
+    }
+
+    // Registered before the page's own handlers, so the snapshot is copied
+    // before game code mutates it.
+    socket.on('connect', () => socket.emit('state_sync', { protocol: 'patch' }));
+    socket.on('state', (msg) => {
+      if (!msg || typeof msg.version !== 'number') return;
+      mirrors[keyOf(msg)] = { version: msg.version, state: clone(msg.state), resyncing: false };
+    });
+    socket.on('state_patch', (msg) => {
+      if (!msg) return;
+      const k = keyOf(msg);
+      let m = mirrors[k];
+      if ('state' in msg) {
+        m = mirrors[k] = { version: msg.version, state: clone(msg.state), resyncing: false };
+      } else if (!m || m.resyncing || m.version !== msg.base) {
+        resync(msg);
+        return;
+      } else {
+        try {
+          m.state = applyOps(m.state, msg.ops || []);
+          m.version = msg.version;
+        } catch (_) {
+          delete mirrors[k];
+          resync(msg);
+          return;
+        }
+      }
+      for (const fn of socket.listeners('state_update')) {
+        try {
+          fn({ room: msg.room, mode: msg.mode, clientId: msg.clientId, state: clone(m.state) });
+        } catch (e) {
+          console.error(e);
+        }
+      }
+    });
+    return socket;
+  }
+
+  window.StateSync = { install, applyOps };
+})();
@@ -444,10 +444,13 @@
     window.AdaptiveDifficulty.updateBadges(r.level);
   }
 
+  // Drill answers come faster than the per-result limit, so they are queued
+  // (kept across reloads and offline spells) and sent in batches.
   function recordToServer(correct, responseMs) {
-    if (!window.recordResult) return;
+    const send = window.queueResult || window.recordResult;
+    if (!send) return;
     const p = currentProblem;
-    window.recordResult({
+    Promise.resolve(send({
       mode: 'subitize',
       game_name: 'Subitize ' + (p.op.charAt(0).toUpperCase() + p.op.slice(1)),
       outcome: correct ? 'success' : 'incorrect',
@@ -461,7 +464,7 @@
         correct: correct,
         responseMs: responseMs,
       }
-    }).catch(() => {});
+    })).catch(() => {});
   }
 
   function checkAnswer() {
@@ -496,6 +499,7 @@
       }
       flash(splashSuccess, 1000);
       if (score >= GOAL) {
+        if (window.flushResults) window.flushResults();
         setTimeout(() => {
           showVictoryStats();
           victory.classList.add('show');
@@ -0,0 +1,36 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# app.py reads its configuration at import time, so point it at a scratch
+# SQLite database before the first import.
+_tmp = tempfile.mkdtemp(prefix='app-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(_tmp, "test.db")}'
+os.environ.setdefault('SECRET_KEY', 'test-secret')
+os.environ.setdefault('RESULT_QUEUE_PATH', os.path.join(_tmp, 'result_queue.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app():
+    app_module.app.config['TESTING'] = True
+    with app_module.app.app_context():
+        app_module.ensure_dev_schema()
+        app_module.bootstrap_database()
+    return app_module.app
+
+
+@pytest.fixture()
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture()
+def auth_header():
+    def make(user_id, role='student'):
+        return {'Authorization': 'Bearer ' + app_module.issue_token(user_id, role)}
+    return make
@@ -0,0 +1,90 @@
+"""Local stand-in for Google's signing-cert endpoint, for exercising ID token
+verification offline (tests/test_google_auth.py, `flask bench-login-storm`)."""
+import datetime
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+from google.auth import crypt, jwt as google_jwt
+
+GOOGLE_ISSUER = 'https://accounts.google.com'
+
+
+def _signing_key():
+    """(private key PEM, self-signed certificate PEM)."""
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'stand-in')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name)
+            .public_key(key.public_key()).serial_number(x509.random_serial_number())
+            .not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1))
+            .sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption()).decode()
+    return private_pem, cert.public_bytes(serialization.Encoding.PEM).decode()
+
+
+class StandInKeyServer:
+    """Local HTTP server publishing self-signed signing certs the way Google
+    does. rotate() swaps in a new key under a new kid, as Google does every
+    few days."""
+
+    def __init__(self, max_age=3600, delay_sec=0.0):
+        self._keys = {}  # kid -> (private PEM, cert PEM), all published
+        self.kid = None
+        self.fetches = 0
+        self.fail = False  # answer 503 while set
+        self.rotate()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.fetches += 1
+                if delay_sec:
+                    time.sleep(delay_sec)
+                if server.fail:
+                    self.send_response(503)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                body = json.dumps({kid: cert for kid, (_, cert) in server._keys.items()}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Cache-Control', f'public, max-age={max_age}')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/oauth2/v1/certs'
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def rotate(self):
+        """Publish a new signing key and sign with it from now on."""
+        self.kid = f'stand-in-{len(self._keys) + 1}'
+        self._keys[self.kid] = _signing_key()
+        return self.kid
+
+    def sign(self, audience, sub, lifetime_sec=3600, issuer=GOOGLE_ISSUER, kid=None):
+        kid = kid or self.kid
+        now = int(time.time())
+        signer = crypt.RSASigner.from_string(self._keys[kid][0], key_id=kid)
+        return google_jwt.encode(signer, {
+            'iss': issuer, 'aud': audience, 'sub': str(sub),
+            'iat': min(now, now + lifetime_sec), 'exp': now + lifetime_sec,
+            'given_name': f'Student {sub}',
+        }).decode()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,53 @@
+import time
+
+import jwt
+import pytest
+
+import app as app_module
+
+
+def _token(user_id, exp):
+    return jwt.encode({'uid': user_id, 'role': 'student', 'exp': exp},
+                      app_module.app.config['SECRET_KEY'], algorithm='HS256')
+
+
+def test_expired_token_is_rejected_on_a_cache_hit():
+    cache = app_module.AuthTokenCache(maxsize=8)
+    exp = int(time.time()) + 1
+    token = _token(7, exp)
+    assert cache.verify(token).user_id == 7
+    assert cache.verify(token).user_id == 7
+    assert cache.metrics['hits'] == 1
+
+    time.sleep(max(0.0, exp - time.time()) + 0.05)
+    with pytest.raises(jwt.ExpiredSignatureError):
+        cache.verify(token)
+    assert (cache.metrics['expired'], cache.metrics['rejected']) == (1, 1)
+    assert cache.snapshot_metrics()['size'] == 0
+
+
+def test_lru_evicts_the_least_recently_used_token_at_maxsize():
+    cache = app_module.AuthTokenCache(maxsize=2)
+    exp = int(time.time()) + 3600
+    first, second, third = (_token(uid, exp) for uid in (1, 2, 3))
+    cache.verify(first)
+    cache.verify(second)
+    cache.verify(first)  # now most recently used
+    cache.verify(third)
+    assert cache.metrics['evictions'] == 1
+    assert cache.snapshot_metrics()['size'] == 2
+
+    decodes = cache.metrics['decodes']
+    cache.verify(first)
+    cache.verify(third)
+    assert cache.metrics['decodes'] == decodes  # both still cached
+    cache.verify(second)
+    assert cache.metrics['decodes'] == decodes + 1  # evicted, decoded again
+
+
+def test_socket_connect_verifies_the_token(app):
+    good = app_module.socketio.test_client(app, auth={'token': app_module.issue_token(9, 'student')})
+    assert good.is_connected()
+    good.disconnect()
+    bad = app_module.socketio.test_client(app, auth={'token': _token(9, int(time.time()) - 60)})
+    assert not bad.is_connected()
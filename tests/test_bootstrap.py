@@ -0,0 +1,31 @@
+import app as app_module
+
+
+def test_bootstrap_reports_catalog_counts(app):
+    result = app.test_cli_runner().invoke(args=['bootstrap'])
+    assert result.exit_code == 0, result.output
+    assert f'{len(app_module.STANDARDS_CATALOG)} skills' in result.output
+
+
+def test_bootstrap_fails_when_a_seed_leaves_a_catalog_short(app, monkeypatch):
+    extra = dict(app_module.STANDARDS_CATALOG[0], code='TEST.UNSEEDED.1')
+    monkeypatch.setattr(app_module, 'STANDARDS_CATALOG', app_module.STANDARDS_CATALOG + [extra])
+    monkeypatch.setattr(app_module, 'ensure_standards_seed', lambda: None)
+    result = app.test_cli_runner().invoke(args=['bootstrap'])
+    assert result.exit_code == 1
+    assert 'skills' in result.output and 'incomplete' in result.output
+
+
+def test_seed_errors_propagate(app, monkeypatch):
+    def broken_commit():
+        raise RuntimeError('NOT NULL constraint failed: skills.id')
+
+    with app.app_context():
+        monkeypatch.setattr(app_module, '_standards_seeded', False)
+        monkeypatch.setattr(app_module, 'STANDARDS_CATALOG',
+                            app_module.STANDARDS_CATALOG + [dict(app_module.STANDARDS_CATALOG[0], code='TEST.UNSEEDED.2')])
+        monkeypatch.setattr(app_module.db.session, 'commit', broken_commit)
+        result = app.test_cli_runner().invoke(args=['bootstrap'])
+        app_module.db.session.rollback()
+    assert result.exit_code != 0
+    assert 'NOT NULL constraint failed' in str(result.exception)
@@ -0,0 +1,70 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+import app as app_module
+
+# user, class timezone, recent results, user_stats, achievements,
+# daily_activity (quests), equipped items, mastery snapshots
+DASHBOARD_QUERIES = 8
+
+
+@contextmanager
+def count_queries():
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engine = app_module.db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+
+
+def _make_user(user_id):
+    db = app_module.db
+    if db.session.get(app_module.User, user_id) is None:
+        db.session.add(app_module.User(id=user_id, google_sub=f'dash-{user_id}', role='student',
+                                       display_name=f'Dash {user_id}'))
+        db.session.commit()
+
+
+def _play(client, auth_header, user_id, n, mode='line'):
+    app_module.RESULT_RATE_LIMIT_SEC = 0
+    for i in range(n):
+        r = client.post('/api/results', headers=auth_header(user_id), json={
+            'mode': mode, 'outcome': 'win' if i % 2 else 'incorrect', 'score': 10 + i,
+            'details': {'challenge_type': mode, 'correct': bool(i % 2)},
+        })
+        assert r.status_code < 300, r.get_data(as_text=True)
+
+
+def _dashboard_queries(user_id):
+    with app_module.app.app_context():
+        app_module.build_dashboard(user_id)  # warm the reference-data caches
+        app_module.db.session.remove()
+        with count_queries() as statements:
+            app_module.build_dashboard(user_id)
+        app_module.db.session.remove()
+    return statements
+
+
+def test_dashboard_query_count_is_fixed(app, client, auth_header):
+    with app.app_context():
+        _make_user(9001)
+    _play(client, auth_header, 9001, 3)
+    statements = _dashboard_queries(9001)
+    assert len(statements) == DASHBOARD_QUERIES, '\n'.join(statements)
+
+
+def test_dashboard_query_count_does_not_grow_with_history(app, client, auth_header):
+    with app.app_context():
+        _make_user(9002)
+    _play(client, auth_header, 9002, 2)
+    before = len(_dashboard_queries(9002))
+    _play(client, auth_header, 9002, 20)
+    _play(client, auth_header, 9002, 5, mode='ratios')
+    assert len(_dashboard_queries(9002)) == before == DASHBOARD_QUERIES
@@ -0,0 +1,27 @@
+import app as app_module
+
+
+def test_oversized_payload_is_rejected(client, auth_header, monkeypatch):
+    monkeypatch.setattr(app_module, 'EVENT_PAYLOAD_MAX_BYTES', 64)
+    r = client.post('/events', headers=auth_header(8300),
+                    json={'event_type': 'shot', 'payload_json': {'blob': 'x' * 100}})
+    assert r.status_code == 400 and r.get_json()['error'] == 'payload_too_large'
+
+    r = client.post('/events', headers=auth_header(8300), json={'event_type': 'shot', 'payload_json': {'x': 1}})
+    assert r.status_code == 200
+
+
+def test_batch_skips_oversized_payloads(client, auth_header, monkeypatch):
+    monkeypatch.setattr(app_module, 'EVENT_PAYLOAD_MAX_BYTES', 64)
+    monkeypatch.setattr(app_module, 'ensure_event_flush_worker', lambda: None)
+    r = client.post('/events/batch', headers=auth_header(8300), json={'events': [
+        {'event_type': 'shot', 'payload_json': {'x': 1}},
+        {'event_type': 'shot', 'payload_json': ['y' * 100]},
+        {'event_type': 'shot', 'role': 'r' * 100},
+    ]})
+    assert r.status_code == 202
+    assert (r.get_json()['accepted'], r.get_json()['rejected']) == (2, 1)
+    with app_module.app.app_context():
+        app_module.event_buffer.flush()
+        roles = [e.role for e in app_module.Event.query.filter_by(user_id=8300, event_type='shot')]
+    assert max(len(role or '') for role in roles) == 32
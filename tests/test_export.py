@@ -0,0 +1,39 @@
+import io
+
+import pytest
+
+import app as app_module
+
+
+@pytest.fixture()
+def numeric_challenge_type(app):
+    db = app_module.db
+    with app.app_context():
+        if db.session.get(app_module.User, 9101) is None:
+            db.session.add(app_module.User(id=9101, google_sub='export-9101', role='student'))
+        r = app_module.GameResult(user_id=9101, mode='plane', game_name='plane', outcome='win',
+                                  details_json={'challenge_type': 5, 'correct': True})
+        db.session.add(r)
+        db.session.commit()
+        rid = int(r.id)
+    yield rid
+    with app.app_context():
+        app_module.GameResult.query.filter_by(id=rid).delete()
+        db.session.commit()
+
+
+@pytest.mark.parametrize('fmt', ['parquet', 'arrow', 'csv'])
+def test_export_handles_non_string_challenge_type(app, numeric_challenge_type, fmt):
+    if fmt != 'csv':
+        pytest.importorskip('pyarrow')
+    with app.app_context():
+        data = b''.join(app_module.export_chunks('game_results', fmt))
+    if fmt == 'csv':
+        assert ',5,True,' in data.decode('utf-8')
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    table = pq.read_table(io.BytesIO(data)) if fmt == 'parquet' else pa.ipc.open_stream(data).read_all()
+    rows = {r['id']: r for r in table.to_pylist()}
+    assert rows[numeric_challenge_type]['challenge_type'] == '5'
+    assert rows[numeric_challenge_type]['correct'] is True
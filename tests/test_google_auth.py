@@ -0,0 +1,78 @@
+import pytest
+
+import app as app_module
+from google_keys import StandInKeyServer
+
+AUDIENCE = 'test-client'
+
+
+@pytest.fixture()
+def keys():
+    server = StandInKeyServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture()
+def cache(keys):
+    return app_module.GoogleCertCache(app_module.HttpCertSource(keys.url))
+
+
+def test_valid_token_returns_claims(keys, cache):
+    claims = app_module.verify_google_id_token(keys.sign(AUDIENCE, 42), AUDIENCE, cache=cache)
+    assert (claims['sub'], claims['aud']) == ('42', AUDIENCE)
+    # a second login reuses the cached certs
+    app_module.verify_google_id_token(keys.sign(AUDIENCE, 43), AUDIENCE, cache=cache)
+    assert keys.fetches == 1
+
+
+@pytest.mark.parametrize('token_args', [
+    {'lifetime_sec': -3600},
+    {'audience': 'someone-else'},
+    {'issuer': 'https://evil.example.com'},
+], ids=['expired', 'wrong-aud', 'wrong-iss'])
+def test_invalid_tokens_are_rejected(keys, cache, token_args):
+    token = keys.sign(token_args.pop('audience', AUDIENCE), 42, **token_args)
+    with pytest.raises(ValueError):
+        app_module.verify_google_id_token(token, AUDIENCE, cache=cache)
+
+
+def test_malformed_token_is_rejected(cache):
+    with pytest.raises(ValueError):
+        app_module.verify_google_id_token('not-a-jwt', AUDIENCE, cache=cache)
+
+
+def test_unknown_kid_refreshes_once(keys, cache):
+    app_module.verify_google_id_token(keys.sign(AUDIENCE, 1), AUDIENCE, cache=cache)
+    cache._fetched_at -= cache.min_refresh_sec  # the first fetch was a while ago
+    keys.rotate()
+    for sub in (2, 3, 4):
+        app_module.verify_google_id_token(keys.sign(AUDIENCE, sub), AUDIENCE, cache=cache)
+    assert keys.fetches == 2
+    assert cache.metrics['unknown_kid_refreshes'] == 1
+
+
+def test_unknown_kid_right_after_a_fetch_does_not_refetch(keys, cache):
+    app_module.verify_google_id_token(keys.sign(AUDIENCE, 1), AUDIENCE, cache=cache)
+    keys.rotate()
+    with pytest.raises(ValueError):
+        app_module.verify_google_id_token(keys.sign(AUDIENCE, 2), AUDIENCE, cache=cache)
+    assert keys.fetches == 1
+
+
+def test_stale_certs_serve_when_refresh_fails(keys, cache):
+    app_module.verify_google_id_token(keys.sign(AUDIENCE, 1), AUDIENCE, cache=cache)
+    cache.invalidate()
+    keys.fail = True
+    claims = app_module.verify_google_id_token(keys.sign(AUDIENCE, 2), AUDIENCE, cache=cache)
+    assert claims['sub'] == '2'
+    assert (cache.metrics['fetch_errors'], cache.metrics['stale_served']) == (1, 1)
+    # backed off: the next login doesn't hit the failing endpoint again
+    app_module.verify_google_id_token(keys.sign(AUDIENCE, 3), AUDIENCE, cache=cache)
+    assert keys.fetches == 2
+
+
+def test_first_fetch_failure_raises(keys, cache):
+    keys.fail = True
+    with pytest.raises(Exception):
+        app_module.verify_google_id_token(keys.sign(AUDIENCE, 1), AUDIENCE, cache=cache)
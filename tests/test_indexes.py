@@ -0,0 +1,12 @@
+import app as app_module
+
+
+def test_hot_queries_use_their_index(app):
+    with app.app_context():
+        with app_module.db.engine.connect() as conn:
+            plans = {
+                (name, index_name): app_module.explain_query_plan(conn, stmt)
+                for name, index_name, stmt in app_module.index_probe_queries(1, app_module.utc_today())
+            }
+    missing = {key: plan for key, plan in plans.items() if not any(key[1] in line for line in plan)}
+    assert not missing, missing
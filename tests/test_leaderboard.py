@@ -0,0 +1,60 @@
+import datetime
+
+from test_dashboard_queries import count_queries
+
+import app as app_module
+
+# at any UTC hour at least one of these is on a different date than UTC
+ZONES = {8301: 'Pacific/Kiritimati', 8302: 'Etc/GMT+12'}
+
+
+def _student_in_zone(user_id, tz_name):
+    db = app_module.db
+    if db.session.get(app_module.User, user_id) is None:
+        db.session.add(app_module.User(id=user_id, google_sub=f'board-{user_id}', role='student',
+                                       display_name=f'Board {user_id}', total_xp=550))
+        db.session.flush()
+        # BigInteger keys don't autoincrement on SQLite
+        cls = app_module.Class(id=user_id, teacher_id=user_id, name=tz_name, join_code=f'BOARD{user_id}', timezone=tz_name)
+        db.session.add(cls)
+        db.session.flush()
+        db.session.add(app_module.ClassMembership(id=user_id, class_id=cls.id, user_id=user_id))
+        db.session.commit()
+
+
+def test_global_today_board_uses_each_students_local_day(app):
+    with app.app_context():
+        db = app_module.db
+        for user_id, tz_name in ZONES.items():
+            _student_in_zone(user_id, tz_name)
+            today = app_module.local_today(tz_name)
+            db.session.add(app_module.DailyActivity(user_id=user_id, day=today, xp=50, games=1))
+            db.session.add(app_module.DailyActivity(user_id=user_id, day=today - datetime.timedelta(days=1),
+                                                    xp=500, games=1))
+        db.session.commit()
+
+        entries, _, _ = app_module.scoped_leaderboard(1000, 'today')
+        period_xp = {e['user_id']: e['period_xp'] for e in entries if e['user_id'] in ZONES}
+        assert period_xp == {user_id: 50 for user_id in ZONES}
+
+
+def test_rebuild_daily_activity_looks_up_timezones_once(app):
+    utc = datetime.timezone.utc
+    with app.app_context():
+        db = app_module.db
+        for user_id in (8311, 8312, 8313):
+            _student_in_zone(user_id, 'Asia/Kolkata')
+            db.session.add_all(app_module.GameResult(user_id=user_id, mode='plane', game_name='plane', outcome='win',
+                                                     played_at=datetime.datetime(2020, 2, 3, 20, tzinfo=utc))
+                               for _ in range(2))
+        db.session.commit()
+
+        with count_queries() as statements:
+            written = app_module.rebuild_daily_activity(datetime.date(2020, 2, 1), datetime.date(2020, 3, 1))
+        assert written == 3
+        assert sum('class_memberships' in s for s in statements) == 1, '\n'.join(statements)
+        # 20:00 UTC is past midnight in Kolkata
+        days = {a.day for a in db.session.new if isinstance(a, app_module.DailyActivity)}
+        assert days == {datetime.date(2020, 2, 4)}
+        db.session.rollback()
+
@@ -0,0 +1,33 @@
+import pytest
+
+import app as app_module
+
+SYNONYMS = [(canon, name) for canon, names in app_module.MODE_SYNONYMS.items() for name in sorted(names)]
+
+
+def test_each_synonym_belongs_to_one_mode():
+    names = [name for _, name in SYNONYMS]
+    assert len(names) == len(set(names))
+
+
+@pytest.mark.parametrize('canon,name', SYNONYMS)
+def test_canonicalize_mode_maps_synonyms(canon, name):
+    for raw in (name, name.upper(), f'  {name.title()} '):
+        assert app_module.canonicalize_mode(raw) == canon
+
+
+@pytest.mark.parametrize('canon,name', SYNONYMS)
+def test_canonical_mode_group_covers_synonyms(canon, name):
+    group = app_module.canonical_mode_group(name)
+    if canon == 'plane':
+        assert group == ('plane', 'line')  # legacy 'line' results count toward the plane bucket
+    else:
+        assert group == tuple(sorted(app_module.MODE_SYNONYMS[canon]))
+
+
+@pytest.mark.parametrize('raw,expected', [('', 'unknown'), (None, 'unknown'), ('   ', 'unknown'),
+                                          (' Brand-New ', 'brand-new')])
+def test_unlisted_modes_pass_through(raw, expected):
+    assert app_module.canonicalize_mode(raw) == expected
+    if expected != 'unknown':
+        assert app_module.canonical_mode_group(raw) == (expected,)
@@ -0,0 +1,47 @@
+import app as app_module
+
+
+def _queue(tmp_path, monkeypatch):
+    queue = app_module.ResultQueue(str(tmp_path / 'queue.db'))
+    monkeypatch.setattr(app_module, 'result_queue', queue)
+    monkeypatch.setattr(app_module, 'deliver_result_processed', lambda uid, payload: None)
+    return queue
+
+
+def test_failing_entry_is_retried_then_dead_lettered(app, tmp_path, monkeypatch):
+    queue = _queue(tmp_path, monkeypatch)
+    with app.app_context():
+        if app_module.db.session.get(app_module.User, 9201) is None:
+            app_module.db.session.add(app_module.User(id=9201, google_sub='queue-9201', role='student'))
+            app_module.db.session.commit()
+    good = {'mode': 'line', 'game_name': 'line', 'outcome': 'win', 'score': None, 'duration_ms': None,
+            'room_pin': None, 'activity_id': None, 'details_json': None}
+    queue.append(9201, {'mode': 'line', 'bogus_column': 1})
+    queue.append(9201, good)
+
+    assert app_module.drain_result_queue() == 1
+    assert len(queue) == 1 and app_module.drain_result_queue() == 0  # backing off, not dropped
+
+    conn = queue._db()
+    conn.execute('UPDATE pending_results SET retry_at = NULL, attempts = ?',
+                 (app_module.RESULT_QUEUE_MAX_ATTEMPTS - 1,))
+    app_module.drain_result_queue()
+    assert len(queue) == 0 and queue.failed_count() == 1
+    error, = conn.execute('SELECT error FROM failed_results').fetchone()
+    assert 'bogus_column' in error
+
+    assert queue.requeue_failed() == 1
+    assert len(queue) == 1 and queue.failed_count() == 0
+
+
+def test_old_queue_file_gains_retry_columns(tmp_path):
+    import sqlite3
+    path = str(tmp_path / 'old.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE pending_results (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER NOT NULL, '
+                 'payload TEXT NOT NULL, played_at TEXT NOT NULL)')
+    conn.execute("INSERT INTO pending_results (user_id, payload, played_at) VALUES (1, '{}', '2026-01-01T00:00:00+00:00')")
+    conn.commit()
+    conn.close()
+    queue = app_module.ResultQueue(path)
+    assert [e[0] for e in queue.peek(10)] == [1]
@@ -0,0 +1,63 @@
+import datetime
+
+import app as app_module
+
+
+def _make_user(user_id):
+    db = app_module.db
+    with app_module.app.app_context():
+        if db.session.get(app_module.User, user_id) is None:
+            db.session.add(app_module.User(id=user_id, google_sub=f'batch-{user_id}', role='student'))
+            db.session.commit()
+
+
+def _entries(keys):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    return [{'mode': 'subitize', 'outcome': 'success', 'score': 1, 'key': key,
+             'details_json': {'challenge_type': 'add', 'correct': True},
+             'played_at': (now - datetime.timedelta(seconds=60 - i)).isoformat()}
+            for i, key in enumerate(keys)]
+
+
+def _counts(user_id):
+    with app_module.app.app_context():
+        user = app_module.db.session.get(app_module.User, user_id)
+        return (app_module.GameResult.query.filter_by(user_id=user_id).count(),
+                int(user.total_xp or 0), int(user.coins or 0))
+
+
+def test_resent_batch_is_applied_once(client, auth_header):
+    _make_user(8100)
+    entries = _entries(['a1', 'a2', 'a3'])
+    first = client.post('/api/results/batch', headers=auth_header(8100), json={'results': entries})
+    assert first.status_code == 200 and first.get_json()['accepted'] == 3
+    after_first = _counts(8100)
+
+    # the response was lost; the client resends with one new play appended
+    again = client.post('/api/results/batch', headers=auth_header(8100),
+                        json={'results': entries + _entries(['a4'])})
+    body = again.get_json()
+    assert again.status_code == 200
+    assert (body['accepted'], body['duplicates']) == (1, [0, 1, 2])
+    assert _counts(8100)[0] == after_first[0] + 1
+
+    replay = client.post('/api/results/batch', headers=auth_header(8100), json={'results': entries})
+    assert replay.get_json()['accepted'] == 0
+    assert _counts(8100)[0] == after_first[0] + 1
+
+
+def test_keys_are_scoped_per_user_and_deduplicated_within_a_batch(client, auth_header):
+    _make_user(8110)
+    _make_user(8120)
+    r = client.post('/api/results/batch', headers=auth_header(8110), json={'results': _entries(['k', 'k'])})
+    assert (r.get_json()['accepted'], r.get_json()['duplicates']) == (1, [1])
+    r = client.post('/api/results/batch', headers=auth_header(8120), json={'results': _entries(['k'])})
+    assert r.get_json()['accepted'] == 1
+
+
+def test_invalid_key_is_rejected(client, auth_header):
+    _make_user(8130)
+    r = client.post('/api/results/batch', headers=auth_header(8130),
+                    json={'results': _entries(['x' * 65]) + _entries(['ok'])})
+    body = r.get_json()
+    assert body['accepted'] == 1 and body['rejected'] == [{'index': 0, 'error': 'invalid_key'}]
@@ -0,0 +1,43 @@
+import datetime
+import sqlite3
+
+import app as app_module
+
+
+def _results(user_id, played_ats):
+    db = app_module.db
+    if db.session.get(app_module.User, user_id) is None:
+        db.session.add(app_module.User(id=user_id, google_sub=f'retention-{user_id}', role='student'))
+        db.session.flush()
+    db.session.execute(app_module.GameResult.__table__.insert(), [
+        {'user_id': user_id, 'mode': 'plane', 'game_name': 'plane', 'outcome': 'win', 'played_at': at}
+        for at in played_ats])
+    db.session.commit()
+
+
+def test_sqlite_archive_moves_old_months_out_of_the_live_table(app, monkeypatch, tmp_path):
+    archive_path = tmp_path / 'archive.db'
+    monkeypatch.setattr(app_module, 'RETENTION_ARCHIVE_PATH', str(archive_path))
+    utc = datetime.timezone.utc
+    old = [datetime.datetime(2019, 3, 5, 12, tzinfo=utc), datetime.datetime(2019, 3, 30, 23, 59, tzinfo=utc),
+           datetime.datetime(2019, 5, 1, 0, 0, tzinfo=utc)]
+    kept = [datetime.datetime(2019, 6, 1, 0, 0, tzinfo=utc)]
+    with app.app_context():
+        _results(8200, old + kept)
+        live = app_module.GameResult.query.filter_by(user_id=8200)
+
+        done = app_module.apply_retention('game_results', datetime.date(2019, 6, 1))
+
+        assert [(month, n) for month, n in done] == [(datetime.date(2019, 3, 1), 2), (datetime.date(2019, 5, 1), 1)]
+        assert [r.played_at.replace(tzinfo=utc) for r in live] == kept
+        # a second run finds nothing left before the cutoff
+        assert app_module.apply_retention('game_results', datetime.date(2019, 6, 1)) == []
+
+    archive = sqlite3.connect(archive_path)
+    try:
+        tables = {name for (name,) in archive.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        assert {'game_results_y2019m03', 'game_results_y2019m05'} <= tables
+        rows = archive.execute('SELECT user_id, mode, outcome FROM game_results_y2019m03 ORDER BY id').fetchall()
+        assert rows == [(8200, 'plane', 'win')] * 2
+    finally:
+        archive.close()
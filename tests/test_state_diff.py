@@ -0,0 +1,99 @@
+import copy
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import app as app_module
+
+STATE_SYNC_JS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'static', 'state_sync.js')
+
+
+def apply_ops(doc, ops):
+    """Python port of applyOps in static/state_sync.js."""
+    for op in ops:
+        if op['path'] == '':
+            doc = op['value']
+            continue
+        parts = [t.replace('~1', '/').replace('~0', '~') for t in op['path'].split('/')[1:]]
+        parent = doc
+        for part in parts[:-1]:
+            parent = parent[int(part)] if isinstance(parent, list) else parent[part]
+        last = parts[-1]
+        if isinstance(parent, list):
+            idx = int(last)
+            if op['op'] == 'remove':
+                del parent[idx]
+            elif op['op'] == 'add':
+                parent.insert(idx, op['value'])
+            else:
+                parent[idx] = op['value']
+        elif op['op'] == 'remove':
+            del parent[last]
+        else:
+            parent[last] = op['value']
+    return doc
+
+
+CASES = {
+    'scalar replace': ({'x': 1, 'y': 2}, {'x': 1, 'y': 3}),
+    'key added and removed': ({'a': 1, 'b': {'c': 2}}, {'a': 1, 'd': [1]}),
+    'nested dicts': ({'players': {'p1': {'x': 1, 'y': 1}}}, {'players': {'p1': {'x': 2, 'y': 1}, 'p2': {'x': 0}}}),
+    'list grows': ({'q': [1, 2]}, {'q': [1, 2, 3, 4]}),
+    'list shrinks': ({'q': [1, 2, 3, 4]}, {'q': [1]}),
+    'list emptied': ({'q': [{'a': 1}, {'a': 2}]}, {'q': []}),
+    'list of dicts changes': ({'q': [{'a': 1}, {'a': 2}]}, {'q': [{'a': 1, 'b': 0}, {'a': 3}, {'a': 4}]}),
+    'escaped keys': ({'a/b': 1, 'm~n': {'~/': 1}}, {'a/b': 2, 'm~n': {'~/': 2, '/': 0}, '~1': True}),
+    'type change': ({'v': 1, 'w': [1]}, {'v': True, 'w': {'0': 1}}),
+    'null values': ({'v': None, 'w': 0}, {'v': 0, 'w': None}),
+    'root type change': ([1, 2], {'a': 1}),
+}
+
+
+@pytest.mark.parametrize('old,new', CASES.values(), ids=CASES.keys())
+def test_ops_turn_old_into_new(old, new):
+    ops = app_module.state_diff(old, new)
+    patched = apply_ops(copy.deepcopy(old), copy.deepcopy(ops))
+    assert json.dumps(patched, sort_keys=True) == json.dumps(new, sort_keys=True)
+
+
+def test_unchanged_subtrees_produce_no_ops():
+    shared = {'big': list(range(100))}
+    assert app_module.state_diff({'s': shared, 'n': 1}, {'s': shared, 'n': 1}) == []
+    ops = app_module.state_diff({'s': shared, 'n': 1}, {'s': shared, 'n': 2})
+    assert ops == [{'op': 'replace', 'path': '/n', 'value': 2}]
+
+
+def test_keys_are_escaped_as_json_pointer_tokens():
+    ops = app_module.state_diff({}, {'a/b~c': 1})
+    assert ops == [{'op': 'add', 'path': '/a~1b~0c', 'value': 1}]
+
+
+@pytest.mark.skipif(shutil.which('node') is None, reason='node not installed')
+def test_client_apply_ops_agrees():
+    """Run the real static/state_sync.js applyOps over every case."""
+    cases = [{'old': old, 'new': new, 'ops': app_module.state_diff(old, new)} for old, new in CASES.values()]
+    script = (
+        "const fs = require('fs'); global.window = {};"
+        f"eval(fs.readFileSync({json.dumps(STATE_SYNC_JS)}, 'utf8'));"
+        "const cases = JSON.parse(fs.readFileSync(0, 'utf8'));"
+        "process.stdout.write(JSON.stringify(cases.map(c => window.StateSync.applyOps(c.old, c.ops))));"
+    )
+    out = subprocess.run(['node', '-e', script], input=json.dumps(cases), capture_output=True, text=True, check=True)
+    assert json.loads(out.stdout) == [new for _, new in CASES.values()]
+
+
+def test_room_sync_bench_counts_sender_resyncs(app, tmp_path):
+    recording = tmp_path / 'room.jsonl'
+    with open(recording, 'w') as fh:
+        for i in range(6):
+            sender = 'a' if i < 3 else 'b'
+            fh.write(json.dumps({'t': i, 'room': 'r', 'mode': 'plane', 'clientId': sender,
+                                 'state': {'tick': i, 'by': sender}}) + '\n')
+    result = app.test_cli_runner().invoke(args=['bench-room-sync', str(recording), '--spectators', '1'])
+    assert result.exit_code == 0, result.output
+    # a never received its own three updates, so b's first patch doesn't apply
+    # on a's copy and a asks for one snapshot; b and the spectator stay current
+    assert 'of which 1 resyncs' in result.output
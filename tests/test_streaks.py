@@ -0,0 +1,84 @@
+import datetime
+import random
+
+import pytest
+
+import app as app_module
+
+
+def _user_with_results(user_id, played_ats):
+    db = app_module.db
+    db.session.add(app_module.User(id=user_id, google_sub=f'streak-{user_id}', role='student',
+                                   display_name=f'Streak {user_id}'))
+    db.session.flush()
+    db.session.add_all(app_module.GameResult(user_id=user_id, mode='line', game_name='line',
+                                             outcome='win', played_at=at) for at in played_ats)
+    db.session.commit()
+    return db.session.get(app_module.User, user_id)
+
+
+def _reference(played_ats, tz_name):
+    zone = app_module.zone_for(tz_name)
+    games = {}
+    for at in played_ats:
+        day = at.replace(tzinfo=datetime.timezone.utc).astimezone(zone).date()
+        games[day] = games.get(day, 0) + 1
+    last = max(games)
+    bits = sum(1 << (last - day).days for day in games if (last - day).days < app_module.ACTIVITY_CALENDAR_DAYS)
+    return bits, (app_module.streak_from_dates(games, last), app_module.best_streak_from_dates(games),
+            last, games[last])
+
+
+@pytest.mark.parametrize('windowed', [True, False])
+@pytest.mark.parametrize('tz_name', [None, 'America/New_York', 'Asia/Kolkata'])
+def test_rebuild_matches_python_reference(app, monkeypatch, tz_name, windowed):
+    monkeypatch.setattr(app_module, '_supports_window_functions', lambda: windowed)
+    rng = random.Random(str(tz_name))
+    start = datetime.datetime(2026, 1, 1)
+    users = {}
+    with app.app_context():
+        for k in range(6):
+            user_id = 7000 + 100 * windowed + k * 10 + len(tz_name or '')
+            played = [start + datetime.timedelta(hours=rng.randrange(0, 24 * 500)) for _ in range(rng.randrange(1, 60))]
+            users[user_id] = (_user_with_results(user_id, played), played)
+        app_module.rebuild_users_activity([u for u, _ in users.values()],
+                                          {uid: tz_name for uid in users})
+        for user, played in users.values():
+            bits, expected = _reference(played, tz_name)
+            assert (user.current_streak, user.best_streak, user.last_active_date,
+                    user.last_active_games) == expected
+            assert int.from_bytes(user.activity_bitmap, 'little') == bits
+        app_module.db.session.rollback()
+
+
+def test_rebuild_user_without_results_clears_streak(app):
+    with app.app_context():
+        user = _user_with_results(7900, [])
+        user.current_streak = 4
+        app_module.rebuild_user_activity(user)
+        assert (user.current_streak, user.best_streak, user.last_active_date) == (0, 0, None)
+        app_module.db.session.rollback()
+
+
+def test_backdated_day_bridges_the_streak(app):
+    with app.app_context():
+        user = _user_with_results(7910, [])
+        monday = datetime.date(2026, 3, 2)
+        app_module.mark_user_active(user, monday)
+        app_module.mark_user_active(user, monday + datetime.timedelta(days=2))
+        assert (user.current_streak, user.best_streak) == (1, 1)
+        app_module.mark_user_active(user, monday + datetime.timedelta(days=1))
+        assert (user.current_streak, user.best_streak) == (3, 3)
+        assert user.last_active_date == monday + datetime.timedelta(days=2)
+        app_module.db.session.rollback()
+
+
+def test_backdated_day_extends_an_older_run(app):
+    with app.app_context():
+        user = _user_with_results(7920, [])
+        start = datetime.date(2026, 3, 2)
+        for offset in (0, 1, 3, 10):
+            app_module.mark_user_active(user, start + datetime.timedelta(days=offset))
+        app_module.mark_user_active(user, start + datetime.timedelta(days=2))
+        assert (user.current_streak, user.best_streak) == (1, 4)
+        app_module.db.session.rollback()
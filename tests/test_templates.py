@@ -0,0 +1,11 @@
+import app as app_module
+
+
+def test_result_socket_opens_at_load_only_for_queued_ingest(app, client, monkeypatch):
+    monkeypatch.setitem(app.config, 'GOOGLE_CLIENT_ID', 'test-client')  # the auth scripts need it
+    monkeypatch.setattr(app_module, 'RESULT_INGEST_MODE', 'sync')
+    page = client.get('/line-mode').get_data(as_text=True)
+    assert 'listenForProcessedResults(localStorage' not in page
+    monkeypatch.setattr(app_module, 'RESULT_INGEST_MODE', 'queue')
+    page = client.get('/line-mode').get_data(as_text=True)
+    assert 'listenForProcessedResults(localStorage' in page